@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+
+"""appengine_config.py
+
+App Engine runtime configuration hooks. Wraps the WSGI apps in the Appstats
+recorder so ConferenceApi and main.py requests get an RPC timeline,
+browsable at /_ah/stats. Every request is recorded on the dev server and
+on versions other than the default one; the default version, which serves
+users, records only PRODUCTION_RECORD_FRACTION of them, as recording adds
+memcache writes and latency to each request it covers.
+
+"""
+
+import os
+
+PRODUCTION_RECORD_FRACTION = 0.01
+
+
+def _recordEverything():
+    """Whether this is the dev server or a version not serving users."""
+    if os.environ.get('SERVER_SOFTWARE', '').startswith('Development'):
+        return True
+    from google.appengine.api import modules
+    try:
+        return modules.get_current_version_name() != modules.get_default_version()
+    except Exception:
+        # sample rather than record every request if it cannot be told
+        return False
+
+
+# read by Appstats (through lib_config) once per instance
+appstats_RECORD_FRACTION = 1.0 if _recordEverything() else PRODUCTION_RECORD_FRACTION
+
+
+def webapp_add_wsgi_middleware(app):
+    from google.appengine.ext.appstats import recording
+    return recording.appstats_wsgi_middleware(app)
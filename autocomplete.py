@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+"""autocomplete.py
+
+Prefix autocomplete for Conference names and cities and Session speakers.
+Every distinct value of those fields has a Completion entity counting the
+conferences (or sessions) using it and listing the prefixes it completes:
+up to MAX_PREFIX_LENGTH characters of the value and of each later word.
+The (field, prefixes, -count) index then returns the most used completions
+of a prefix in one query; the results are cached in memcache until a value
+with that prefix is next counted. A longer prefix is answered from the
+completions of its first MAX_PREFIX_LENGTH characters, filtered in memory:
+the cached ones first, then, if too few of those match, the query a page
+at a time, reading at most MAX_SCANNED completions.
+
+Requests writing those fields count them through queueAdjust(), which
+queues the changes in tasks of one transaction each, so a request
+neither waits on contended Completions nor fails after its own write
+when their transaction does. A task retried after its transaction
+committed counts its changes twice; counts only rank completions.
+
+"""
+
+import hashlib
+import json
+import logging
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import Completion
+
+MAX_PREFIX_LENGTH = 12
+# completions cached per prefix, and read per page for longer prefixes
+MAX_CANDIDATES = 50
+# completions read for a prefix longer than MAX_PREFIX_LENGTH before
+# returning fewer than asked for
+MAX_SCANNED = 1000
+MAX_RESULTS = 10
+MEMCACHE_COMPLETIONS_KEY = "COMPLETIONS_%s"
+COMPLETIONS_TTL = 3600
+# xg transaction limit
+COMPLETIONS_PER_TXN = 25
+
+
+def normalize(value):
+    return ' '.join((value or '').split()).lower()
+
+
+def prefixes(normalized):
+    """Return the prefixes a normalized value completes."""
+    words = normalized.split(' ')
+    result = set()
+    for i in range(len(words)):
+        tail = ' '.join(words[i:])
+        for n in range(1, min(len(tail), MAX_PREFIX_LENGTH) + 1):
+            if tail[n - 1] != ' ':
+                result.add(tail[:n])
+    return sorted(result)
+
+
+def _completionKey(field, normalized):
+    return ndb.Key(Completion, u'%s:%s' % (field, normalized))
+
+
+def _cacheKey(field, prefix):
+    return MEMCACHE_COMPLETIONS_KEY % hashlib.sha1(
+        (u'%s:%s' % (field, prefix)).encode('utf-8')).hexdigest()
+
+
+@ndb.transactional(xg=True)
+def _applyCounts(changes):
+    """Add deltas to a few Completions, deleting those no longer used."""
+    keys = [_completionKey(field, normalized)
+            for (field, normalized), _ in changes]
+    entries = []
+    for key, ((field, normalized), (delta, value)), entry in zip(
+            keys, changes, ndb.get_multi(keys)):
+        entry = entry or Completion(key=key, field=field, value=value,
+                                    prefixes=prefixes(normalized), count=0)
+        entry.count += delta
+        entries.append(entry)
+    ndb.put_multi([entry for entry in entries if entry.count > 0])
+    ndb.delete_multi([entry.key for entry in entries if entry.count <= 0])
+
+
+def _totals(changes):
+    """Return [((field, normalized), (delta, value))] of the non-zero net
+    changes in a list of (field, value, delta)."""
+    totals = {}
+    for field, value, delta in changes:
+        normalized = normalize(value)
+        if normalized:
+            total, _ = totals.get((field, normalized), (0, value))
+            totals[(field, normalized)] = (total + delta, value)
+    return sorted(item for item in totals.items() if item[1][0])
+
+
+def adjust(changes):
+    """Apply (field, value, delta) changes to the completion counts, e.g.
+    ('city', 'London', 1) for a new conference in London."""
+    changed = _totals(changes)
+    for start in range(0, len(changed), COMPLETIONS_PER_TXN):
+        _applyCounts(changed[start:start + COMPLETIONS_PER_TXN])
+    memcache.delete_multi([_cacheKey(field, prefix)
+                           for (field, normalized), _ in changed
+                           for prefix in prefixes(normalized)])
+
+
+def queueAdjust(changes):
+    """Queue adjust() of (field, value, delta) changes, COMPLETIONS_PER_TXN
+    values per task. Failing to queue them is logged rather than raised,
+    as the caller's write has already happened."""
+    changed = [(field, value, delta)
+               for (field, _), (delta, value) in _totals(changes)]
+    tasks = [taskqueue.Task(url='/tasks/adjust_completions', params={
+                 'changes': json.dumps(changed[start:start + COMPLETIONS_PER_TXN])})
+             for start in range(0, len(changed), COMPLETIONS_PER_TXN)]
+    try:
+        # at most 100 tasks per call
+        for start in range(0, len(tasks), 100):
+            taskqueue.Queue().add(tasks[start:start + 100])
+    except taskqueue.Error:
+        logging.exception('Completion counts not queued: %r', changed)
+
+
+def replace(field, old, new):
+    """Return the changes for a value replaced by another."""
+    if normalize(old) == normalize(new):
+        return []
+    return [(field, old, -1), (field, new, 1)]
+
+
+def _matching(normalized, candidates):
+    """Keep the (value, count) candidates the value, or one of its later
+    words, of which starts with normalized."""
+    return [(value, count) for value, count in candidates
+            if (' ' + normalize(value)).find(' ' + normalized) >= 0]
+
+
+def _scan(field, stem, normalized, limit):
+    """Page through the completions of stem, most used first, for up to
+    limit that also complete normalized."""
+    query = Completion.query(Completion.field == field,
+                             Completion.prefixes == stem).order(-Completion.count)
+    matches, cursor, more, scanned = [], None, True, 0
+    while more and len(matches) < limit and scanned < MAX_SCANNED:
+        entries, cursor, more = query.fetch_page(MAX_CANDIDATES, start_cursor=cursor)
+        scanned += len(entries)
+        matches.extend(_matching(normalized, [(entry.value, entry.count)
+                                              for entry in entries]))
+    return matches[:limit]
+
+
+def complete(field, prefix, limit=MAX_RESULTS):
+    """Return up to limit (value, count) completions of prefix, most used
+    first."""
+    normalized = normalize(prefix)
+    if not normalized:
+        return []
+    stem = normalized[:MAX_PREFIX_LENGTH].rstrip()
+    cache_key = _cacheKey(field, stem)
+    candidates = memcache.get(cache_key)
+    if candidates is None:
+        candidates = [(entry.value, entry.count) for entry in Completion.query(
+            Completion.field == field, Completion.prefixes == stem).order(
+            -Completion.count).fetch(MAX_CANDIDATES)]
+        memcache.set(cache_key, candidates, time=COMPLETIONS_TTL)
+
+    if len(normalized) > len(stem):
+        matches = _matching(normalized, candidates)
+        if len(matches) < limit and len(candidates) == MAX_CANDIDATES:
+            # less used completions of the stem than were cached may match
+            matches = _scan(field, stem, normalized, limit)
+        return matches[:limit]
+    return candidates[:limit]
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+"""backfill.py
+
+Task chains running a function over every entity of a kind, for bringing
+existing data up to date with a new index or property. Jobs are
+registered by name with @job; start(name) queues the first task, and
+each task handles BATCH keys (read keys-only) and queues the next one
+with its cursor. Tasks are named after the run and cursor, so a retried
+task does not fork the chain.
+
+"""
+
+import hashlib
+import time
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+BATCH = 100
+
+# name: (kind, function of a list of keys)
+JOBS = {}
+
+
+def job(name, kind):
+    """Register a function of a list of keys as a backfill job."""
+    def register(func):
+        JOBS[name] = (kind, func)
+        return func
+    return register
+
+
+def _queue(name, run, cursor=''):
+    try:
+        taskqueue.add(name='backfill-%s-%s-%s' % (
+                          name, run, hashlib.sha1(cursor).hexdigest()[:16]),
+                      params={'job': name, 'run': run, 'cursor': cursor},
+                      url='/tasks/backfill')
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def start(name):
+    """Start a run of a job over all its entities."""
+    if name not in JOBS:
+        raise KeyError(name)
+    _queue(name, str(int(time.time())))
+
+
+def runBatch(name, run, cursor):
+    """Apply a job to one batch of keys and queue the next batch."""
+    kind, func = JOBS[name]
+    keys, next_cursor, more = ndb.Query(kind=kind).fetch_page(
+        BATCH, start_cursor=Cursor(urlsafe=cursor) if cursor else None,
+        keys_only=True)
+    if keys:
+        func(keys)
+    if more and next_cursor:
+        _queue(name, run, next_cursor.urlsafe())
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+"""copiers.py
+
+Micro-benchmark of the compiled entity-to-form copiers in converters.py
+against the reflective copies they replaced (see tests/test_converters.py),
+timing each with timeit over fully populated entities in memory.
+
+usage: python benchmarks/copiers.py --sdk ~/google_appengine
+           [--number 10000] [--repeat 5]
+
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS)
+sys.path.insert(0, ROOT)
+
+from loadtest import StandInBackend, setupSdk
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sdk', required=True, help='App Engine Python SDK directory')
+    parser.add_argument('--number', type=int, default=10000, help='copies per timing')
+    parser.add_argument('--repeat', type=int, default=5, help='timings, best is reported')
+    args = parser.parse_args(argv)
+
+    setupSdk(args.sdk)
+    sys.path.insert(0, os.path.join(ROOT, 'tests'))
+    backend = StandInBackend()
+    import converters
+    import test_converters as reference
+
+    conf, session, prof = reference.makeEntities()
+    pairs = [
+        ('Conference', conf, converters.copyConferenceToForm,
+         reference.reflectiveConferenceCopy),
+        ('Session', session, converters.copySessionToForm,
+         reference.reflectiveSessionCopy),
+        ('Profile', prof, converters.copyProfileToForm,
+         reference.reflectiveProfileCopy),
+    ]
+
+    print('%-12s %14s %14s %8s' % ('entity', 'compiled us', 'reflective us', 'speedup'))
+    for name, entity, compiled, reflective in pairs:
+        timings = []
+        for copy in compiled, reflective:
+            best = min(timeit.repeat(lambda: copy(entity), number=args.number,
+                                     repeat=args.repeat))
+            timings.append(best / args.number * 1e6)
+        print('%-12s %14.2f %14.2f %7.1fx' % (name, timings[0], timings[1],
+                                               timings[1] / timings[0]))
+    backend.deactivate()
+
+
+if __name__ == '__main__':
+    main()
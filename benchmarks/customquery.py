@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+"""customquery.py
+
+Benchmark of getSessionsCustomRequest against the query it replaced,
+which read every session not of the excluded type and filtered startTime
+in Python. Seeds the datastore stub with sessions of random types and
+start times (or uses a dataset written by datagen.py) and reports, per
+form of the query, the median time and the sessions read.
+
+The stub's times are not production latencies, but the sessions read are
+what the datastore would read, and they are what the times follow.
+
+usage: python benchmarks/customquery.py --sdk ~/google_appengine
+           [--sessions 100000] [--conferences 1000] [--repeat 5]
+           [--datastore-file data.sqlite]
+
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import time as dtime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from loadtest import SESSION_TYPES
+from loadtest import StandInBackend, setupSdk
+
+# (excludeSessionType, startTime, startsAfter, scoped to a conference)
+QUERIES = [
+    ('workshop', '19:00', False, False),
+    ('workshop', '19:00', True, False),
+    ('keynotes', '09:00', False, False),
+    ('workshop', '19:00', False, True),
+]
+
+
+def seed(sessions, conferences, rng):
+    """Write sessions spread over conferences; returns the conference keys."""
+    from google.appengine.ext import ndb
+    from datagen import putInBatches
+    from models import Session
+
+    conf_keys = [ndb.Key('Conference', i + 1) for i in range(conferences)]
+    putInBatches([Session(name='Session %d' % i,
+                          typeOfSession=rng.choice(SESSION_TYPES),
+                          startTime=dtime(rng.randint(8, 21), rng.choice((0, 30))),
+                          conference=rng.choice(conf_keys))
+                  for i in range(sessions)], 500)
+    return conf_keys
+
+
+def scan(exclude, start_time, starts_after, conf_key):
+    """The query getSessionsCustomRequest used to run (which had no
+    conference scope; here it is applied in Python as well)."""
+    from conference import ConferenceApi
+    from models import Session
+
+    api = ConferenceApi()
+    read = 0
+    found = []
+    for sess in Session.query(Session.typeOfSession != exclude):
+        read += 1
+        if conf_key and sess.conference != conf_key:
+            continue
+        if sess.startTime and (sess.startTime >= start_time if starts_after
+                               else sess.startTime <= start_time):
+            found.append(api._copySessionToForm(sess))
+    return found, read
+
+
+def indexed(exclude, start_time, starts_after, conf_key):
+    """The query getSessionsCustomRequest runs now."""
+    from conference import ConferenceApi
+
+    method = ConferenceApi().getSessionsCustomRequest
+    response = method(method.remote.request_type(
+        excludeSessionType=exclude, startTime=start_time.strftime('%H:%M'),
+        startsAfter=starts_after,
+        websafeConferenceKey=conf_key.urlsafe() if conf_key else None))
+    return response.items, len(response.items)
+
+
+def parseTime(value):
+    hours, minutes = value.split(':')
+    return dtime(int(hours), int(minutes))
+
+
+def measure(fn, args, repeat):
+    from google.appengine.ext import ndb
+
+    times = []
+    for _ in range(repeat):
+        # no ndb context cache carried over between runs
+        ndb.tasklets.set_context(ndb.tasklets.make_default_context())
+        start = time.time()
+        found, read = fn(*args)
+        times.append(time.time() - start)
+    return sorted(times)[len(times) // 2] * 1000, len(found), read
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sdk', required=True, help='App Engine Python SDK directory')
+    parser.add_argument('--sessions', type=int, default=100000)
+    parser.add_argument('--conferences', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--datastore-file',
+                        help='benchmark an existing dataset (see datagen.py) '
+                             'instead of seeding one')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    setupSdk(args.sdk)
+    backend = StandInBackend(datastore_file=args.datastore_file)
+    from models import Session
+
+    rng = random.Random(args.seed)
+    if args.datastore_file:
+        conf_keys = [Session.query().get().conference]
+    else:
+        conf_keys = seed(args.sessions, args.conferences, rng)
+    total = Session.query().count()
+
+    print('%d sessions\n' % total)
+    print('%-34s %-8s %10s %8s %10s' % ('query', 'form', 'median ms', 'found', 'read'))
+    for exclude, start, starts_after, scoped in QUERIES:
+        conf_key = conf_keys[0] if scoped else None
+        label = 'not %s, %s %s%s' % (exclude, '>=' if starts_after else '<=', start,
+                                     ', one conference' if scoped else '')
+        query = (exclude, parseTime(start), starts_after, conf_key)
+        for name, fn in (('scan', scan), ('indexed', indexed)):
+            ms, found, read = measure(fn, query, args.repeat)
+            print('%-34s %-8s %10.1f %8d %10d' % (label, name, ms, found, read))
+    backend.deactivate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+"""buckets.py
+
+Date buckets of a Conference: every day, ISO week and year-month between
+its start and end dates, as strings. They are stored as repeated computed
+properties, so calendar queries are equality (or IN) filters, ordered by
+startDate through a (bucket, startDate) index.
+
+"""
+
+import datetime
+
+# longest span listed day by day (and week by week)
+MAX_DAYS = 366
+
+
+def _dates(start, end):
+    if not start:
+        return []
+    end = max(end or start, start)
+    count = min((end - start).days + 1, MAX_DAYS)
+    return [start + datetime.timedelta(days=n) for n in range(count)]
+
+
+def _unique(values):
+    seen = set()
+    return [v for v in values if not (v in seen or seen.add(v))]
+
+
+def dayBucket(date):
+    return date.strftime('%Y-%m-%d')
+
+
+def weekBucket(date):
+    year, week, _ = date.isocalendar()
+    return '%04d-W%02d' % (year, week)
+
+
+def monthBucket(date):
+    return date.strftime('%Y-%m')
+
+
+def days(start, end):
+    return [dayBucket(date) for date in _dates(start, end)]
+
+
+def weeks(start, end):
+    return _unique(weekBucket(date) for date in _dates(start, end))
+
+
+def months(start, end):
+    if not start:
+        return []
+    end = max(end or start, start)
+    result = []
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        result.append('%04d-%02d' % (year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return result
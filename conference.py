@@ -13,18 +13,27 @@ created by wesc on 2014 apr 21
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
 from datetime import datetime
+import csv
+import re
+import StringIO
+import time
 import endpoints
 from protorpc import messages
 from protorpc import message_types
+from protorpc import protojson
 from protorpc import remote
 
+from google.appengine.api import datastore_errors
 from google.appengine.api import memcache
 from google.appengine.api import taskqueue
 from google.appengine.ext import ndb
+from google.appengine.datastore.datastore_query import Cursor
 
 from models import MultiStringMessage
 from models import ConflictException
 from models import Profile
+from models import Registration
+from models import RosterForm
 from models import ProfileMiniForm
 from models import ProfileForm
 from models import BooleanMessage
@@ -32,11 +41,39 @@ from models import Conference
 from models import ConferenceForm
 from models import ConferenceForms
 from models import Session
+from models import ConferenceSpeaker
 from models import SessionForm, SessionForms
+from models import SessionImportForm
+from models import WishlistForms
+from models import ConflictGroupForm
+from models import ConflictGroupForms
 from models import ConferenceQueryForm
 from models import ConferenceQueryForms
+from models import QueryPlanForm
+from models import CompletionForm
+from models import CompletionForms
 from models import TeeShirtSize
+from models import GroupRegistrationForm
+from models import RegistrationStatus
+from models import AttendeeRegistrationForm
+from models import AttendeeRegistrationForms
+from models import NearlySoldOutEntry
 from utils import getUserId
+from converters import copyConferenceToForm
+from converters import copyProfileToForm
+from converters import copySessionToForm
+import autocomplete
+import backfill
+import buckets
+import instrument
+import mailqueue
+import planner
+import querycache
+import responsecache
+import schedule
+import seats
+import speakers
+import textsearch
 from google.appengine.api import memcache
 from models import StringMessage
 from google.appengine.api import taskqueue
@@ -50,7 +87,26 @@ from settings import ANDROID_AUDIENCE
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
 MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
+NEARLY_SOLD_OUT_SEATS = 5
+# conferences named in the Announcement, fewest seats first
+MAX_ANNOUNCED = 20
 FEATURED_SPEAKER_SESSIONS_KEY = "THIS_IS_A_FEATURED_SPEAKER"
+MEMCACHE_FEATURED_SPEAKER_KEY = "FEATURED_SPEAKER_%s"
+FEATURED_SPEAKER_WINDOW = 60   # seconds of session writes per recomputation
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+MAX_IMPORT_SESSIONS = 1000
+MAX_GROUP_SIZE = 500
+# IN filters run one datastore query per value
+MAX_CALENDAR_BUCKETS = 30
+MAX_CALENDAR_RESULTS = 100
+# conferences read past a page's end before giving up on filling it
+MAX_CALENDAR_SKIPPED = 1000
+ISO_WEEK = re.compile(r'^\d{4}-W(0[1-9]|[1-4]\d|5[0-3])$')
+# Profiles per group registration transaction (the xg entity group limit)
+GROUP_TXN_PROFILES = 25
+# registrations moved off a Profile per transaction
+MIGRATE_REGISTRATIONS = 400
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 DEFAULTS = {
@@ -60,6 +116,12 @@ DEFAULTS = {
     "topics": [ "Default", "Topic" ],
 }
 
+COMPLETION_FIELDS = {
+            'NAME': 'name',
+            'CITY': 'city',
+            'SPEAKER': 'speaker',
+            }
+
 OPERATORS = {
             'EQ':   '=',
             'GT':   '>',
@@ -82,6 +144,12 @@ CONF_GET_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+CONF_CACHED_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    ifNoneMatch=messages.StringField(2),
+)
+
 CONF_POST_REQUEST = endpoints.ResourceContainer(
     ConferenceForm,
     websafeConferenceKey=messages.StringField(1),
@@ -90,6 +158,7 @@ CONF_POST_REQUEST = endpoints.ResourceContainer(
 SESSION_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
+    ifNoneMatch=messages.StringField(2),
 )
 
 SESSION_POST_REQUEST = endpoints.ResourceContainer(
@@ -97,6 +166,26 @@ SESSION_POST_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+GROUP_REGISTRATION_REQUEST = endpoints.ResourceContainer(
+    GroupRegistrationForm,
+    websafeConferenceKey=messages.StringField(2),
+)
+
+SESSION_IMPORT_REQUEST = endpoints.ResourceContainer(
+    SessionForms,
+    websafeConferenceKey=messages.StringField(2),
+)
+
+SESSION_IMPORT_TEXT_REQUEST = endpoints.ResourceContainer(
+    SessionImportForm,
+    websafeConferenceKey=messages.StringField(3),
+)
+
+SESSION_DELETE_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeSessionKey=messages.StringField(1),
+)
+
 SESSION_TYPE_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
@@ -111,6 +200,44 @@ SPEAKER_SESSIONS_GET_REQUEST = endpoints.ResourceContainer(
 WISHLIST_POST_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeSessionKey=messages.StringField(1),
+    allowConflict=messages.BooleanField(2),
+)
+
+ROSTER_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    pageSize=messages.IntegerField(2),
+    cursor=messages.StringField(3),
+)
+
+SEARCH_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    query=messages.StringField(1),
+    pageSize=messages.IntegerField(2),
+    cursor=messages.StringField(3),
+)
+
+CALENDAR_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    startDate=messages.StringField(1),
+    endDate=messages.StringField(2),
+    week=messages.StringField(3),
+    city=messages.StringField(4),
+    topic=messages.StringField(5),
+    pageSize=messages.IntegerField(6),
+    cursor=messages.StringField(7),
+)
+
+COMPLETIONS_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    field=messages.StringField(1),
+    prefix=messages.StringField(2),
+    limit=messages.IntegerField(3),
+)
+
+FEATURED_SPEAKER_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
 )
 
 SESSION_START_TIME_GET_REQUEST = endpoints.ResourceContainer(
@@ -130,6 +257,8 @@ CUSTOM_SESSION_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     excludeSessionType=messages.StringField(1),
     startTime=messages.StringField(2),
+    startsAfter=messages.BooleanField(3),
+    websafeConferenceKey=messages.StringField(4),
 )
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
@@ -142,38 +271,30 @@ class ConferenceApi(remote.Service):
 
 # - - - Conference objects - - - - - - - - - - - - - - - - -
 
-    def _copyConferenceToForm(self, conf, displayName):
+    def _copyConferenceToForm(self, conf, displayName, seatsAvailable=None):
         """Copy relevant fields from Conference to ConferenceForm."""
-        cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
+        cf = copyConferenceToForm(conf)
         if displayName:
             setattr(cf, 'organizerDisplayName', displayName)
-        cf.check_initialized()
+        # seats live in sharded counters, not on the Conference entity
+        if seatsAvailable is None:
+            seatsAvailable = seats.getSeatsAvailable(conf)
+        cf.seatsAvailable = seatsAvailable
         return cf
 
     def _createConferenceObject(self, request):
         """Create or update Conference object, returning ConferenceForm/request."""
         # preload necessary data items
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+        user, user_id = self._getUser()
 
         if not request.name:
             raise endpoints.BadRequestException("Conference 'name' field required")
 
         # copy ConferenceForm/ProtoRPC Message into dict
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
-        del data['websafeKey']
-        del data['organizerDisplayName']
+        # outbound only
+        for field in ('websafeKey', 'organizerDisplayName', 'etag', 'notModified'):
+            del data[field]
 
         # add default values for those missing (both data model & outbound Message)
         for df in DEFAULTS:
@@ -204,25 +325,52 @@ class ConferenceApi(remote.Service):
         # create Conference, send email to organizer confirming
         # creation of Conference & return (modified) ConferenceForm
         Conference(**data).put()
-        taskqueue.add(params={'email': user.email(),
-            'conferenceInfo': repr(request)},
-            url='/tasks/send_confirmation_email'
-        )
+        if data["seatsAvailable"] > 0:
+            seats.initSeats(c_key, data["seatsAvailable"])
+        querycache.bumpGeneration()
+        textsearch.queueIndexing([c_key])
+        autocomplete.queueAdjust([('name', data['name'], 1), ('city', data['city'], 1)])
+        mailqueue.queueConfirmation(user.email(), c_key.urlsafe(), {
+            'name': request.name, 'city': request.city,
+            'startDate': request.startDate, 'endDate': request.endDate,
+            'topics': request.topics, 'maxAttendees': request.maxAttendees})
 
         return request
 
-    @ndb.transactional()
+    @ndb.tasklet
+    def _getConferenceAsync(self, websafeConferenceKey):
+        """Get a Conference and its organizer's Profile concurrently."""
+        conf_key = ndb.Key(urlsafe=websafeConferenceKey)
+        conf, prof = yield conf_key.get_async(), conf_key.parent().get_async()
+        raise ndb.Return(conf, prof)
+
     def _updateConferenceObject(self, request):
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+        """Update Conference object, returning ConferenceForm."""
+        conf, displayName, delta, old = self._updateConferenceTxn(request)
+        # seat shards are separate entity groups, so adjust them
+        # once the conference update has committed
+        if delta:
+            seats.adjustSeats(conf, delta)
+        available = seats.getSeatsAvailable(conf)
+        # seats or name may have changed
+        self._updateNearlySoldOut(conf, available)
+        responsecache.bumpVersions([request.websafeConferenceKey])
+        querycache.bumpGeneration()
+        textsearch.queueIndexing([conf.key])
+        autocomplete.queueAdjust(autocomplete.replace('name', old.name, conf.name) +
+                                 autocomplete.replace('city', old.city, conf.city))
+        return self._copyConferenceToForm(conf, displayName, available)
+
+    @ndb.transactional()
+    def _updateConferenceTxn(self, request):
+        user, user_id = self._getUser()
 
         # copy ConferenceForm/ProtoRPC Message into dict
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
 
-        # update existing conference
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        # update existing conference; the organizer Profile is fetched
+        # alongside it, and is the user's own once ownership is checked
+        conf, prof = self._getConferenceAsync(request.websafeConferenceKey).get_result()
         # check that conference exists
         if not conf:
             raise endpoints.NotFoundException(
@@ -235,8 +383,14 @@ class ConferenceApi(remote.Service):
 
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
+        oldMaxAttendees = conf.maxAttendees or 0
+        old = Conference(name=conf.name, city=conf.city)
         for field in request.all_fields():
             data = getattr(request, field.name)
+            # seatsAvailable is owned by the seat shards; the rest are outbound only
+            if field.name in ('seatsAvailable', 'websafeKey', 'organizerDisplayName',
+                              'etag', 'notModified'):
+                continue
             # only copy fields where we get data
             if data not in (None, []):
                 # special handling for dates (convert string to Date)
@@ -247,11 +401,12 @@ class ConferenceApi(remote.Service):
                 # write to Conference object
                 setattr(conf, field.name, data)
         conf.put()
-        prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        return (conf, getattr(prof, 'displayName'),
+                (conf.maxAttendees or 0) - oldMaxAttendees, old)
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
             http_method='POST', name='createConference')
+    @instrument.timed
     def createConference(self, request):
         """Create new conference."""
         return self._createConferenceObject(request)
@@ -259,99 +414,115 @@ class ConferenceApi(remote.Service):
     @endpoints.method(CONF_POST_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='PUT', name='updateConference')
+    @instrument.timed
     def updateConference(self, request):
         """Update conference w/provided fields & return w/updated info."""
         return self._updateConferenceObject(request)
 
-    @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
-            path='conference/{websafeConferenceKey}',
-            http_method='GET', name='getConference')
-    def getConference(self, request):
-        """Return requested conference (by websafeConferenceKey)."""
-        # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        if not conf:
-            raise endpoints.NotFoundException(
-                'No conference found with key: %s' % request.websafeConferenceKey)
-        prof = conf.key.parent().get()
-        # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
-
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
             path='getConferencesCreated',
             http_method='POST', name='getConferencesCreated')
+    @instrument.timed
     def getConferencesCreated(self, request):
         """Return conferences created by user."""
         # make sure user is authed
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id =  getUserId(user)
+        prof = self._getProfileFromUser()
         # create ancestor query for all key matches for this user
-        confs = Conference.query(ancestor=ndb.Key(Profile, user_id))
-        prof = ndb.Key(Profile, user_id).get()
+        confs = Conference.query(ancestor=prof.key).fetch()
+        available = seats.getSeatsAvailableMulti(confs)
         # return set of ConferenceForm objects per Conference
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, getattr(prof, 'displayName')) for conf in confs]
+            items=[self._copyConferenceToForm(conf, getattr(prof, 'displayName'),
+                                              available[conf.key]) for conf in confs]
         )
 
-    def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
-        q = Conference.query()
-        inequality_filter, filters = self._formatFilters(request.filters)
-
-        # If exists, sort on inequality filter first
-        if not inequality_filter:
-            q = q.order(Conference.name)
-        else:
-            q = q.order(ndb.GenericProperty(inequality_filter))
-            q = q.order(Conference.name)
-
-        for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
-            formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
-            q = q.filter(formatted_query)
-        return q
-
     def _formatFilters(self, filters):
         """Parse, check validity and format user supplied filters."""
-        formatted_filters = []
-        inequality_field = None
-
+        predicates = []
         for f in filters:
-            filtr = {field.name: getattr(f, field.name) for field in f.all_fields()}
-
             try:
-                filtr["field"] = FIELDS[filtr["field"]]
-                filtr["operator"] = OPERATORS[filtr["operator"]]
+                field = FIELDS[f.field]
+                operator = OPERATORS[f.operator]
             except KeyError:
                 raise endpoints.BadRequestException("Filter contains invalid field or operator.")
 
-            # Every operation except "=" is an inequality
-            if filtr["operator"] != "=":
-                # check if inequality operation has been used in previous filters
-                # disallow the filter if inequality was performed on a different field before
-                # track the field on which the inequality operation is performed
-                if inequality_field and inequality_field != filtr["field"]:
-                    raise endpoints.BadRequestException("Inequality filter is allowed on only one field.")
-                else:
-                    inequality_field = filtr["field"]
+            value = f.value
+            if field in ["month", "maxAttendees"]:
+                try:
+                    value = int(value)
+                except (TypeError, ValueError):
+                    raise endpoints.BadRequestException(
+                        "Filter on %s needs a number." % f.field)
+            # any number of inequalities, on any fields, is allowed: the
+            # planner runs at most one field's in the datastore
+            predicates.append(planner.Predicate(field, operator, value))
+        return predicates
+
+    def _planQuery(self, predicates, cursor):
+        """Return (plan, cursor) for a query, reusing the plan a page
+        cursor was made with so later pages read the same query."""
+        if not cursor:
+            return planner.plan(predicates), None
+        try:
+            number, cursor = cursor.split(':', 1)
+            return planner.plan(predicates, int(number)), Cursor(urlsafe=cursor)
+        except Exception:
+            raise endpoints.BadRequestException("Invalid 'cursor'.")
 
-            formatted_filters.append(filtr)
-        return (inequality_field, formatted_filters)
+    @staticmethod
+    def _copyPlanToForm(plan):
+        """Copy a query plan to a QueryPlanForm."""
+        return QueryPlanForm(
+            datastoreFilters=[str(p) for p in plan.driver],
+            postFilters=[str(p) for p in plan.postFilters],
+            order=plan.order(),
+            estimatedCost=plan.estimate,
+            candidates=['%s: %d' % (' AND '.join(str(p) for p in driver) or 'all',
+                                    estimate) for driver, estimate in plan.candidates])
 
     @endpoints.method(ConferenceQueryForms, ConferenceForms,
             path='queryConferences',
             http_method='POST',
             name='queryConferences')
+    @instrument.timed
     def queryConferences(self, request):
-        """Query for conferences."""
-        conferences = self._getQuery(request)
+        """Query for conferences, one page at a time."""
+        pageSize = min(request.pageSize or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        if pageSize < 1:
+            raise endpoints.BadRequestException("'pageSize' must be positive.")
+        predicates = self._formatFilters(request.filters)
+        if request.explain:
+            plan, _ = self._planQuery(predicates, request.cursor)
+            return ConferenceForms(plan=self._copyPlanToForm(plan))
+
+        def run():
+            plan, cursor = self._planQuery(predicates, request.cursor)
+            # a page may come back short (or empty) with a cursor when
+            # post-filtering had to read MAX_SCAN conferences
+            try:
+                conferences, next_cursor = planner.run(plan, pageSize, cursor)
+            except datastore_errors.BadRequestError:
+                # a cursor from another query
+                raise endpoints.BadRequestException("Invalid 'cursor'.")
+            return conferences, ('%d:%s' % (plan.number, next_cursor.urlsafe())
+                                 if next_cursor else None)
+
+        conferences, next_cursor = querycache.getPage(
+            predicates, pageSize, request.cursor, run)
+
+        # return individual ConferenceForm object per Conference, plus
+        # the cursor for the next page if there is one
+        return ConferenceForms(
+                items=self._copyConferencesToForms(conferences),
+                nextCursor=next_cursor
+        )
 
+    def _copyConferencesToForms(self, conferences):
+        """Copy Conferences to ConferenceForms with their organizers' names
+        and seats, each fetched for all of them at once."""
         # need to fetch organiser displayName from profiles
         # get all keys and use get_multi for speed
-        organisers = [(ndb.Key(Profile, conf.organizerUserId)) for conf in conferences]
+        organisers = list(set(ndb.Key(Profile, conf.organizerUserId) for conf in conferences))
         profiles = ndb.get_multi(organisers)
 
         # put display names in a dict for easier fetching
@@ -359,37 +530,212 @@ class ConferenceApi(remote.Service):
         for profile in profiles:
             names[profile.key.id()] = profile.displayName
 
-        # return individual ConferenceForm object per Conference
-        return ConferenceForms(
-                items=[self._copyConferenceToForm(conf, names[conf.organizerUserId]) for conf in \
-                conferences]
-        )
+        available = seats.getSeatsAvailableMulti(conferences)
+        return [self._copyConferenceToForm(conf, names[conf.organizerUserId],
+                                           available[conf.key]) for conf in conferences]
+
+# - - - Calendar - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def _calendarQuery(self, request):
+        """Return (query, start, end) for a calendar request; start and end
+        are set when results must still be checked against the range."""
+        if request.week:
+            if not ISO_WEEK.match(request.week):
+                raise endpoints.BadRequestException("'week' required in this format (2016-W05)")
+            return Conference.query(Conference.weeks == request.week), None, None
+
+        try:
+            start = datetime.strptime(request.startDate or '', "%Y-%m-%d").date()
+            end = datetime.strptime(request.endDate or request.startDate, "%Y-%m-%d").date()
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "'startDate' (and 'endDate') required in this format (year-month-day)")
+        if end < start:
+            raise endpoints.BadRequestException("'endDate' is before 'startDate'.")
+
+        # a day bucket per day of a short range, else a month bucket per
+        # month (whose results must still overlap the range)
+        days = buckets.days(start, end)
+        if len(days) <= MAX_CALENDAR_BUCKETS:
+            return Conference.query(Conference.days.IN(days)), None, None
+        months = buckets.months(start, end)
+        if len(months) > MAX_CALENDAR_BUCKETS:
+            raise endpoints.BadRequestException(
+                'Ranges of at most %d months are allowed.' % MAX_CALENDAR_BUCKETS)
+        return Conference.query(Conference.yearMonths.IN(months)), start, end
+
+    @endpoints.method(CALENDAR_GET_REQUEST, ConferenceForms,
+            path='conferences/calendar',
+            http_method='GET', name='getConferenceCalendar')
+    @instrument.timed
+    def getConferenceCalendar(self, request):
+        """Return conferences taking place in a date range or ISO week,
+        optionally in a city or on a topic, by start date, one page at a
+        time."""
+        q, start, end = self._calendarQuery(request)
+        pageSize = min(request.pageSize or MAX_CALENDAR_RESULTS, MAX_CALENDAR_RESULTS)
+        if pageSize < 1:
+            raise endpoints.BadRequestException("'pageSize' must be positive.")
+        after = self._calendarCursor(request.cursor)
+
+        # each bucket's (bucket, startDate) index merge-joins with the
+        # (city, startDate) and (topics, startDate) ones
+        if request.city:
+            q = q.filter(Conference.city == request.city)
+        if request.topic:
+            q = q.filter(Conference.topics == request.topic)
+        # an IN query cannot take a datastore cursor, so a page carries on
+        # from the (startDate, key) of the previous page's last conference
+        if after:
+            q = q.filter(Conference.startDate >= after[0])
+        q = q.order(Conference.startDate, Conference.key)
+
+        conferences = []
+        last = None
+        more = False
+        for read, conf in enumerate(q, 1):
+            if len(conferences) == pageSize or read > pageSize + MAX_CALENDAR_SKIPPED:
+                more = True
+                break
+            last = conf
+            # key paths sort as the datastore orders keys
+            if after and (conf.startDate, conf.key.pairs()) <= after:
+                continue
+            if start and not (conf.startDate <= end and
+                              (conf.endDate or conf.startDate) >= start):
+                continue
+            conferences.append(conf)
+
+        # carry on after the last conference looked at, returned or not
+        next_cursor = None
+        if more:
+            next_cursor = '%s,%s' % (last.startDate.isoformat(), last.key.urlsafe())
+        return ConferenceForms(items=self._copyConferencesToForms(conferences),
+                               nextCursor=next_cursor)
+
+    @staticmethod
+    def _calendarCursor(cursor):
+        """Return the (startDate, key path) a calendar cursor continues after."""
+        if not cursor:
+            return None
+        try:
+            startDate, wsck = cursor.split(',', 1)
+            return (datetime.strptime(startDate, "%Y-%m-%d").date(),
+                    ndb.Key(urlsafe=wsck).pairs())
+        except Exception:
+            raise endpoints.BadRequestException("Invalid 'cursor'.")
+
+    @staticmethod
+    @backfill.job('calendar-buckets', 'Conference')
+    def _putCalendarBuckets(keys):
+        """Write a batch of conferences again, so their days, weeks and
+        yearMonths (computed on put) are stored and indexed; for
+        conferences written before those properties existed."""
+        for key in keys:
+            ConferenceApi._reputConference(key)
+
+    @staticmethod
+    @ndb.transactional()
+    def _reputConference(key):
+        conf = key.get()
+        if conf:
+            conf.put()
+
+# - - - Search - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    @endpoints.method(COMPLETIONS_GET_REQUEST, CompletionForms,
+            path='completions',
+            http_method='GET', name='getCompletions')
+    @instrument.timed
+    def getCompletions(self, request):
+        """Complete a prefix of a conference name or city, or a speaker.
+        Prefixes longer than 12 characters are matched against the 1000
+        most used completions of their first 12, so rarer ones are missed."""
+        try:
+            field = COMPLETION_FIELDS[request.field]
+        except KeyError:
+            raise endpoints.BadRequestException(
+                "'field' must be one of %s" % ', '.join(sorted(COMPLETION_FIELDS)))
+        limit = min(request.limit or autocomplete.MAX_RESULTS, autocomplete.MAX_CANDIDATES)
+        if limit < 1:
+            raise endpoints.BadRequestException("'limit' must be positive.")
+        return CompletionForms(items=[
+            CompletionForm(value=value, count=count)
+            for value, count in autocomplete.complete(field, request.prefix, limit)])
+
+    def _search(self, kind, request):
+        """Return (documents, next page cursor) of a search request."""
+        pageSize = min(request.pageSize or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        if pageSize < 1:
+            raise endpoints.BadRequestException("'pageSize' must be positive.")
+        try:
+            offset = int(request.cursor or 0)
+        except ValueError:
+            raise endpoints.BadRequestException("Invalid 'cursor'.")
+
+        keys, next_offset = textsearch.search(kind, request.query, offset, pageSize)
+        # documents deleted since they were indexed are skipped
+        docs = [doc for doc in ndb.get_multi(keys) if doc]
+        return docs, str(next_offset) if next_offset is not None else None
+
+    @endpoints.method(SEARCH_REQUEST, ConferenceForms,
+            path='conferences/search',
+            http_method='GET', name='searchConferences')
+    @instrument.timed
+    def searchConferences(self, request):
+        """Search conference names and descriptions, best matches first."""
+        conferences, next_cursor = self._search('Conference', request)
+        return ConferenceForms(items=self._copyConferencesToForms(conferences),
+                               nextCursor=next_cursor)
+
+    @endpoints.method(SEARCH_REQUEST, SessionForms,
+            path='sessions/search',
+            http_method='GET', name='searchSessions')
+    @instrument.timed
+    def searchSessions(self, request):
+        """Search session names and highlights, best matches first."""
+        sessions, next_cursor = self._search('Session', request)
+        return SessionForms(items=[self._copySessionToForm(s) for s in sessions],
+                            nextCursor=next_cursor)
 
 # - - - Profile objects - - - - - - - - - - - - - - - - - - -
 
     def _copyProfileToForm(self, prof):
         """Copy relevant fields from Profile to ProfileForm."""
-        # copy relevant fields from Profile to ProfileForm
-        pf = ProfileForm()
-        for field in pf.all_fields():
-            if hasattr(prof, field.name):
-                # convert t-shirt string to Enum; just copy others
-                if field.name == 'teeShirtSize':
-                    setattr(pf, field.name, getattr(TeeShirtSize, getattr(prof, field.name)))
-                else:
-                    setattr(pf, field.name, getattr(prof, field.name))
-        pf.check_initialized()
+        pf = copyProfileToForm(prof)
+        pf.conferenceKeysToAttend = self._attendingKeys(prof)
         return pf
 
+    # ConferenceApi is instantiated for every request, so these hold
+    # the current request's user and Profile once resolved
+    _currentUser = None
+    _currentProfile = None
+
+    def _getUser(self):
+        """Return (user, user_id) for this request, resolving auth only once."""
+        if self._currentUser is None:
+            # make sure user is authed
+            user = endpoints.get_current_user()
+            if not user:
+                raise endpoints.UnauthorizedException('Authorization required')
+            self._currentUser = (user, getUserId(user))
+        return self._currentUser
+
+    def _ifNoneMatch(self, request):
+        """Return the ETag the client has: the ifNoneMatch parameter, else
+        an If-None-Match header if the frontend passed one on."""
+        if request.ifNoneMatch:
+            return request.ifNoneMatch
+        headers = getattr(getattr(self, 'request_state', None), 'headers', None)
+        return headers.get('If-None-Match') if headers else None
+
     def _getProfileFromUser(self):
         """Return user Profile from datastore, creating new one if non-existent."""
-        # make sure user is authed
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
+        if self._currentProfile is not None:
+            return self._currentProfile
+        user, user_id = self._getUser()
 
-        # get Profile from datastore
-        user_id = getUserId(user)
+        # get Profile from datastore (read through memcache by ndb)
         p_key = ndb.Key(Profile, user_id)
         profile = p_key.get()
         # create new Profile if not there
@@ -402,6 +748,7 @@ class ConferenceApi(remote.Service):
             )
             profile.put()
 
+        self._currentProfile = profile
         return profile      # return Profile
 
     def _doProfile(self, save_request=None):
@@ -427,22 +774,22 @@ class ConferenceApi(remote.Service):
 
     @endpoints.method(message_types.VoidMessage, ProfileForm,
             path='profile', http_method='GET', name='getProfile')
+    @instrument.timed
     def getProfile(self, request):
         """Return user profile."""
         return self._doProfile()
 
     @endpoints.method(ProfileMiniForm, ProfileForm,
             path='profile', http_method='POST', name='saveProfile')
+    @instrument.timed
     def saveProfile(self, request):
         """Update & return user profile."""
         return self._doProfile(request)
 
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
 
-    @ndb.transactional(xg=True)
     def _conferenceRegistration(self, request, reg=True):
         """Register or unregister user for selected conference."""
-        retval = None
         prof = self._getProfileFromUser() # get user Profile
 
         # check if conf exists given websafeConfKey
@@ -453,48 +800,170 @@ class ConferenceApi(remote.Service):
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
 
-        # register
-        if reg:
-            # check if user already registered otherwise add
-            if wsck in prof.conferenceKeysToAttend:
-                raise ConflictException(
-                    "You have already registered for this conference")
-
-            # check if seats avail
-            if conf.seatsAvailable <= 0:
-                raise ConflictException(
-                    "There are no seats available.")
-
-            # register user, take away one seat
-            prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
-            retval = True
-
-        # unregister
-        else:
-            # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
+        # check if user already registered before looking for a seat
+        reg_key = ndb.Key(Registration, wsck, parent=prof.key)
+        # registrations are no longer added to the Profile's own list, so
+        # a conference missing from it now cannot appear there later
+        legacy = wsck in prof.conferenceKeysToAttend
+        registered = legacy or reg_key.get() is not None
+        if reg and registered:
+            raise ConflictException(
+                "You have already registered for this conference")
+        if not reg and not registered:
+            return BooleanMessage(data=False)
+
+        def attend():
+            # runs in the same transaction as the seat shard update,
+            # so read the Registration (and Profile) again and check again
+            if legacy:
+                registration, prof_txn = ndb.get_multi([reg_key, prof.key])
+            else:
+                registration, prof_txn = reg_key.get(), None
+            if prof_txn and wsck in prof_txn.conferenceKeysToAttend:
+                if reg:
+                    raise ConflictException(
+                        "You have already registered for this conference")
+                prof_txn.conferenceKeysToAttend.remove(wsck)
+                prof_txn.put()
+            elif reg:
+                if registration:
+                    raise ConflictException(
+                        "You have already registered for this conference")
+                Registration(key=reg_key, conference=conf.key).put()
+            elif registration:
+                reg_key.delete()
+            else:
+                return False
+            return True
+
+        # register takes a seat from one shard, unregister gives one back;
+        # raises ConflictException when no shard has a seat left
+        retval = seats.changeSeats(conf, -1 if reg else 1, attend)
+        if legacy:
+            # the Profile may have been rewritten inside the transaction
+            self._currentProfile = None
+
+        # a one seat change can only move the conference into or out of
+        # the nearly sold out set when it ends up at or next to the threshold
+        if retval:
+            # seatsAvailable is part of the conference's responses
+            responsecache.bumpVersions([wsck])
+            available = seats.getSeatsAvailable(conf)
+            if available <= NEARLY_SOLD_OUT_SEATS + 1:
+                self._updateNearlySoldOut(conf, available)
+        return BooleanMessage(data=retval)
 
-                # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
-                retval = True
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _addAttendees(wsck, emails):
+        """Register a few Profiles for a conference, creating missing ones;
+        returns the emails of those not already attending it."""
+        keys = [ndb.Key(Profile, email) for email in emails]
+        reg_keys = [ndb.Key(Registration, wsck, parent=key) for key in keys]
+        entities = ndb.get_multi(keys + reg_keys)
+        conf_key = ndb.Key(urlsafe=wsck)
+        added = []
+        for key, reg_key, email, prof, registration in zip(
+                keys, reg_keys, emails, entities[:len(keys)], entities[len(keys):]):
+            if registration or (prof and wsck in prof.conferenceKeysToAttend):
+                continue
+            if not prof:
+                added.append(Profile(
+                    key = key,
+                    displayName = email.split('@')[0],
+                    mainEmail = email,
+                    teeShirtSize = str(TeeShirtSize.NOT_SPECIFIED),
+                ))
+            added.append(Registration(key=reg_key, conference=conf_key))
+        ndb.put_multi(added)
+        return [entity.key.parent().id() for entity in added
+                if isinstance(entity, Registration)]
+
+    def _groupRegistration(self, request):
+        """Register several attendees (by email) for a conference at once;
+        only its organizer may.
+
+        Seats for the whole group are taken in one transaction, all or
+        nothing; the Profiles are then updated GROUP_TXN_PROFILES at a time
+        and any seat not used (attendee registered meanwhile) is given back.
+        """
+        wsck = request.websafeConferenceKey
+        conf = self._getOrganizedConference(wsck, 'register groups')
+
+        # one outcome per distinct attendee, in request order; Profiles
+        # are keyed by lowercase email
+        emails = []
+        statuses = {}
+        for email in (email.strip().lower() for email in request.attendees):
+            if email not in statuses:
+                emails.append(email)
+                statuses[email] = (None if '@' in email
+                                   else RegistrationStatus.INVALID_EMAIL)
+        if len(emails) > MAX_GROUP_SIZE:
+            raise endpoints.BadRequestException(
+                'At most %d attendees can be registered at once.' % MAX_GROUP_SIZE)
+
+        # only attendees not registered yet need a seat
+        valid = [email for email in emails if statuses[email] is None]
+        keys = [ndb.Key(Profile, email) for email in valid]
+        entities = ndb.get_multi(keys + [ndb.Key(Registration, wsck, parent=key)
+                                         for key in keys])
+        wanted = []
+        for email, prof, registration in zip(valid, entities[:len(keys)],
+                                             entities[len(keys):]):
+            if registration or (prof and wsck in prof.conferenceKeysToAttend):
+                statuses[email] = RegistrationStatus.ALREADY_REGISTERED
             else:
-                retval = False
+                wanted.append(email)
 
-        # write things back to the datastore & return
-        prof.put()
-        conf.put()
-        return BooleanMessage(data=retval)
+        if not seats.reserveSeats(conf, len(wanted)):
+            raise ConflictException(
+                "There are not enough seats available for this group.")
+
+        registered = 0
+        try:
+            for start in range(0, len(wanted), GROUP_TXN_PROFILES):
+                batch = wanted[start:start + GROUP_TXN_PROFILES]
+                added = set(self._addAttendees(wsck, batch))
+                for email in batch:
+                    statuses[email] = (RegistrationStatus.REGISTERED if email in added
+                                       else RegistrationStatus.ALREADY_REGISTERED)
+                registered += len(added)
+        finally:
+            # give back the seats reserved for attendees who were
+            # registered meanwhile, or not at all if a transaction failed
+            if registered < len(wanted):
+                seats.adjustSeats(conf, len(wanted) - registered)
+        # the caller may have been among the attendees
+        self._currentProfile = None
+
+        available = seats.getSeatsAvailable(conf)
+        if registered:
+            responsecache.bumpVersions([wsck])
+            self._updateNearlySoldOut(conf, available)
+        return AttendeeRegistrationForms(
+            items=[AttendeeRegistrationForm(email=email, status=statuses[email])
+                   for email in emails],
+            seatsAvailable=available)
+
+    @endpoints.method(GROUP_REGISTRATION_REQUEST, AttendeeRegistrationForms,
+            path='conference/{websafeConferenceKey}/group',
+            http_method='POST', name='registerGroupForConference')
+    @instrument.timed
+    def registerGroupForConference(self, request):
+        """Register a group of attendees for selected conference
+        (organizer only)."""
+        return self._groupRegistration(request)
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
             path='conferences/attending',
             http_method='GET', name='getConferencesToAttend')
+    @instrument.timed
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
         prof = self._getProfileFromUser() # get user Profile
-        conf_keys = [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
+        conf_keys = [ndb.Key(urlsafe=wsck) for wsck in self._attendingKeys(prof)]
+        conferences = [conf for conf in ndb.get_multi(conf_keys) if conf]
 
         # get organizers
         organisers = [ndb.Key(Profile, conf.organizerUserId) for conf in conferences]
@@ -505,14 +974,52 @@ class ConferenceApi(remote.Service):
         for profile in profiles:
             names[profile.key.id()] = profile.displayName
 
+        available = seats.getSeatsAvailableMulti(conferences)
+
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(items=[self._copyConferenceToForm(conf, names[conf.organizerUserId])\
+        return ConferenceForms(items=[self._copyConferenceToForm(conf, names[conf.organizerUserId],
+                                                                 available[conf.key])\
          for conf in conferences]
         )
 
+    @staticmethod
+    def _attendingKeys(prof):
+        """Return the websafe keys of the conferences a Profile is
+        registered for: its Registrations, plus any still on the Profile."""
+        wscks = list(prof.conferenceKeysToAttend)
+        for key in Registration.query(ancestor=prof.key).iter(keys_only=True):
+            if key.id() not in wscks:
+                wscks.append(key.id())
+        return wscks
+
+    @endpoints.method(ROSTER_GET_REQUEST, RosterForm,
+            path='conference/{websafeConferenceKey}/attendees',
+            http_method='GET', name='getConferenceAttendees')
+    @instrument.timed
+    def getConferenceAttendees(self, request):
+        """Return the user ids registered for a conference, one page at a
+        time (organizer only)."""
+        conf = self._getOrganizedConference(request.websafeConferenceKey,
+                                            'see its attendees')
+        pageSize = min(request.pageSize or MAX_PAGE_SIZE, MAX_PAGE_SIZE)
+        if pageSize < 1:
+            raise endpoints.BadRequestException("'pageSize' must be positive.")
+        try:
+            cursor = Cursor(urlsafe=request.cursor) if request.cursor else None
+        except Exception:
+            raise endpoints.BadRequestException("Invalid 'cursor'.")
+
+        # the Registration's parent is the attendee's Profile
+        keys, next_cursor, more = Registration.query(
+            Registration.conference == conf.key).fetch_page(
+            pageSize, start_cursor=cursor, keys_only=True)
+        return RosterForm(attendees=[key.parent().id() for key in keys],
+                          nextCursor=next_cursor.urlsafe() if more and next_cursor else None)
+
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
             path='conference/{websafeConferenceKey}',
             http_method='POST', name='registerForConference')
+    @instrument.timed
     def registerForConference(self, request):
         """Register user for selected conference."""
         return self._conferenceRegistration(request)
@@ -520,69 +1027,56 @@ class ConferenceApi(remote.Service):
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
             path='conference/{websafeConferenceKey}',
             http_method='DELETE', name='unregisterFromConference')
+    @instrument.timed
     def unregisterFromConference(self, request):
         """Unregister user for selected conference."""
         return self._conferenceRegistration(request, reg=False)
 
-    @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
+    @endpoints.method(CONF_CACHED_GET_REQUEST, ConferenceForm,
                       path='conference/{websafeConferenceKey}',
                       http_method='GET', name='getConference')
+    @instrument.timed
     def getConference(self, request):
         """Return requested conference (by websafeConferenceKey)."""
-        # Get Conference object from request; bail if not found.
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        if not conf:
-            raise endpoints.NotFoundException(
-                'No conference found with key: %s' % request.websafeConferenceKey)
-        prof = conf.key.parent().get()
-        # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        def build():
+            # Get Conference object from request; bail if not found.
+            conf, prof = self._getConferenceAsync(request.websafeConferenceKey).get_result()
+            if not conf:
+                raise endpoints.NotFoundException(
+                    'No conference found with key: %s' % request.websafeConferenceKey)
+            # return ConferenceForm
+            return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+
+        return responsecache.getResponse(
+            'getConference', request.websafeConferenceKey, ConferenceForm,
+            self._ifNoneMatch(request), build)
 
     # - - - Sessions Object- - - - - - - - - - - - - - - - - - -
 
     def _copySessionToForm(self, session):
         """Copy relevant fields from Session to SessionForm."""
-        sf = SessionForm()
-        print str(session)
-        for field in sf.all_fields():
-            if hasattr(session, field.name):
-                # convert Date to date string; just copy others
-                if field.name in ['startDate', 'startTime'] :
-                    setattr(sf, field.name, str(getattr(session, field.name)))
-                elif field.name == 'duration':
-                    setattr(sf, field.name, int(getattr(session, field.name)))
-                else:
-                    setattr(sf, field.name, getattr(session, field.name))
-        if type(session) is Session:
-            # if Session object
-            setattr(sf, 'sessionKey', str(session.key.urlsafe()))
-        else:
-            # if request
-            setattr(sf, 'sessionKey', str(session.sessionKey))
-        sf.check_initialized()
-        return sf
-
-    def _createSessionObject(self, request):
-        """Create or update Session object, returning SessionForm/request."""
-        # preload necessary data items
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
+        return copySessionToForm(session)
 
-        if not request.name:
-            raise endpoints.BadRequestException("Session 'name' field required")
-
-        # check the user is the owner of the conference
-        user_id = getUserId(user)
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+    def _getOrganizedConference(self, webSafeKey, action='create sessions'):
+        """Return a conference, checking the user is its organizer."""
+        user, user_id = self._getUser()
+        conf = ndb.Key(urlsafe=webSafeKey).get()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % webSafeKey)
         if user_id != conf.organizerUserId:
             raise endpoints.ForbiddenException(
-                'Only the conference organizer can create sessions.')
+                'Only the conference organizer can %s.' % action)
+        return conf
+
+    def _sessionFromForm(self, form, conf_key):
+        """Validate a SessionForm, returning an (unsaved) Session."""
+        if not form.name:
+            raise endpoints.BadRequestException("Session 'name' field required")
 
         # copy SessionForm/ProtoRPC Message into dict
-        data = {field.name: getattr(request, field.name) for field in request.all_fields()}
-        data['conference'] = ndb.Key(urlsafe=request.websafeConferenceKey)
-        del data['websafeConferenceKey']
+        data = {field.name: getattr(form, field.name) for field in SessionForm.all_fields()}
+        data['conference'] = conf_key
         del data['sessionKey']
 
         # convert dates from strings
@@ -602,20 +1096,27 @@ class ConferenceApi(remote.Service):
         except Exception:
             raise ValueError("'duration' required and has to be a number.")
 
-        # creation of Session and return SessionForm
-        new_key = Session(**data).put()
-        request.sessionKey = new_key.urlsafe()
+        return Session(**data)
+
+    def _createSessionObject(self, request):
+        """Create or update Session object, returning SessionForm/request."""
+        # check the user is the owner of the conference
+        conf = self._getOrganizedConference(request.websafeConferenceKey)
+
+        # creation of Session and return SessionForm; the speaker index
+        # is updated in the same transaction
+        session = self._sessionFromForm(request, conf.key)
+        conf_speaker = speakers.putSession(session)
+        responsecache.bumpVersions([request.websafeConferenceKey])
+        textsearch.queueIndexing([session.key])
+        autocomplete.queueAdjust([('speaker', session.speaker, 1)])
 
         # Check to see if the speaker is present in more than one
-        # session and if it is then add a task queue
-        speaker_sessions = Session.query(Session.speaker == data['speaker']).count()
-        if speaker_sessions > 1:
-            taskqueue.add(params={'speaker': data['speaker'],
-                          'websafeConferenceKey': request.websafeConferenceKey},
-                          url='/tasks/set_featured_speaker'
-                          )
+        # session of this conference and if it is then add a task queue
+        if conf_speaker and conf_speaker.sessionCount > 1:
+            self._queueFeaturedSpeaker(request.websafeConferenceKey)
 
-        return self._copySessionToForm(request)
+        return self._copySessionToForm(session)
 
     # get all the sessions given a conference
     def _getSessions(self, webSafeKey):
@@ -633,32 +1134,145 @@ class ConferenceApi(remote.Service):
 
     @endpoints.method(SESSION_POST_REQUEST, SessionForm, path='session/create/{websafeConferenceKey}',
                       http_method='POST', name='createSession')
+    @instrument.timed
     def createSession(self, request):
         """Create new session."""
         return self._createSessionObject(request)
 
+# - - - Import sessions in bulk - - - - - - - - - - - - - - -
+
+    def _importSessions(self, webSafeKey, forms):
+        """Validate every SessionForm, then write them all in bulk.
+
+        Nothing is written if any form is invalid. Ownership is checked
+        once, sessions are written with put_multi, the speaker index is
+        updated per speaker and at most one featured speaker task is queued.
+        """
+        conf = self._getOrganizedConference(webSafeKey)
+        if len(forms) > MAX_IMPORT_SESSIONS:
+            raise endpoints.BadRequestException(
+                'At most %d sessions can be imported at once.' % MAX_IMPORT_SESSIONS)
+
+        sessions = []
+        for i, form in enumerate(forms):
+            try:
+                sessions.append(self._sessionFromForm(form, conf.key))
+            except (endpoints.BadRequestException, ValueError,
+                    datastore_errors.BadValueError) as e:
+                raise endpoints.BadRequestException('Session %d: %s' % (i + 1, e))
+
+        conf_speakers = speakers.putSessions(sessions)
+        responsecache.bumpVersions([webSafeKey])
+        textsearch.queueIndexing([session.key for session in sessions])
+        autocomplete.queueAdjust([('speaker', session.speaker, 1) for session in sessions])
+        if any(entry.sessionCount > 1 for entry in conf_speakers):
+            self._queueFeaturedSpeaker(webSafeKey)
+        return SessionForms(items=[self._copySessionToForm(s) for s in sessions])
+
+    @staticmethod
+    def _parseSessions(dataFormat, data):
+        """Parse CSV (with a header row of SessionForm field names and
+        highlights separated by ';') or NDJSON text into SessionForms,
+        a line at a time."""
+        if dataFormat == 'ndjson':
+            forms = []
+            for line_no, line in enumerate(data.splitlines(), 1):
+                if not line.strip():
+                    continue
+                try:
+                    forms.append(protojson.decode_message(SessionForm, line))
+                except (ValueError, messages.Error) as e:
+                    raise endpoints.BadRequestException('Line %d: %s' % (line_no, e))
+            return forms
+
+        if dataFormat != 'csv':
+            raise endpoints.BadRequestException("'format' must be csv or ndjson")
+        # the csv module reads byte strings only
+        rows = csv.DictReader(StringIO.StringIO(data.encode('utf-8')))
+        forms = []
+        for row in rows:
+            fields = dict((name.strip(), value.decode('utf-8').strip())
+                          for name, value in row.items() if name and value)
+            try:
+                if 'highlights' in fields:
+                    fields['highlights'] = [h.strip() for h in fields['highlights'].split(';')]
+                if 'duration' in fields:
+                    fields['duration'] = int(fields['duration'])
+                forms.append(SessionForm(**fields))
+            except (AttributeError, TypeError, ValueError, messages.Error) as e:
+                raise endpoints.BadRequestException('Line %d: %s' % (rows.line_num, e))
+        return forms
+
+    @endpoints.method(SESSION_IMPORT_REQUEST, SessionForms,
+                      path='sessions/import/{websafeConferenceKey}',
+                      http_method='POST', name='importSessions')
+    @instrument.timed
+    def importSessions(self, request):
+        """Create many sessions of a conference at once (organizer only)."""
+        return self._importSessions(request.websafeConferenceKey, request.items)
+
+    @endpoints.method(SESSION_IMPORT_TEXT_REQUEST, SessionForms,
+                      path='sessions/import/{websafeConferenceKey}/text',
+                      http_method='POST', name='importSessionsText')
+    @instrument.timed
+    def importSessionsText(self, request):
+        """Create many sessions of a conference from CSV or NDJSON text."""
+        return self._importSessions(request.websafeConferenceKey,
+                                    self._parseSessions(request.format, request.data or ''))
+
+# - - - Delete a session - - - - - - - - - - - - - - - - -
+
+    @endpoints.method(SESSION_DELETE_REQUEST, BooleanMessage,
+                      path='session/{websafeSessionKey}',
+                      http_method='DELETE', name='deleteSession')
+    @instrument.timed
+    def deleteSession(self, request):
+        """Delete a session (conference organizer only)."""
+        user, user_id = self._getUser()
+        session = ndb.Key(urlsafe=request.websafeSessionKey).get()
+        if not session:
+            raise endpoints.NotFoundException(
+                'No session found with key: %s' % request.websafeSessionKey)
+        conf = session.conference.get()
+        if not conf or user_id != conf.organizerUserId:
+            raise endpoints.ForbiddenException(
+                'Only the conference organizer can delete sessions.')
+        speakers.deleteSession(session)
+        responsecache.bumpVersions([session.conference.urlsafe()])
+        textsearch.queueIndexing([session.key])
+        autocomplete.queueAdjust([('speaker', session.speaker, -1)])
+        self._queueFeaturedSpeaker(session.conference.urlsafe())
+        return BooleanMessage(data=True)
+
 # - - - Get all sessions from a given conference - - - - - - - - -
 
     @endpoints.method(SESSION_GET_REQUEST, SessionForms,
             path='sessions/{websafeConferenceKey}',
             http_method='GET', name='getConferenceSessions')
+    @instrument.timed
     def getConferenceSessions(self, request):
         """Given a conference, return all sessions (by websafeConferenceKey)."""
-        sessions = self._getSessions(request.websafeConferenceKey).fetch()
-        if not sessions:
+        def build():
+            sessions = self._getSessions(request.websafeConferenceKey).fetch()
+            if not sessions:
+                return SessionForms(
+                    items=[]
+                )
+            # return SessionForm
             return SessionForms(
-                items=[]
+                items=[self._copySessionToForm(session) for session in sessions]
             )
-        # return SessionForm
-        return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
-        )
+
+        return responsecache.getResponse(
+            'getConferenceSessions', request.websafeConferenceKey, SessionForms,
+            self._ifNoneMatch(request), build)
 
 # - - - - -  Given a conference return a specific session type ( lecture, workshop etc. )- - - -
 
     @endpoints.method(SESSION_TYPE_GET_REQUEST, SessionForms,
                       path='session/{websafeConferenceKey}/type/{sessionType}',
                       http_method='GET', name='getConferenceSessionsByType')
+    @instrument.timed
     def getConferenceSessionsByType(self, request):
             """Return all sessions of a particular type."""
             all_sessions = self._getSessions(request.websafeConferenceKey)
@@ -674,14 +1288,18 @@ class ConferenceApi(remote.Service):
     @endpoints.method(SPEAKER_SESSIONS_GET_REQUEST, SessionForms,
                       path='session/speaker/{speaker}',
                       http_method='GET', name='getSessionsBySpeaker')
+    @instrument.timed
     def getSessionsBySpeaker(self, request):
             """Return all sessions featuring a speaker's name."""
 
-            # not using the ndb classmethod this time,
-            # select all sessions and filter by speaker
-            sessions = Session.query()
-            if request.speaker:
-                sessions = sessions.filter(Session.speaker == request.speaker)
+            if not request.speaker:
+                sessions = Session.query()
+            else:
+                # the speaker's ConferenceSpeaker entries hold the session
+                # keys (sessions from before the index are added by the
+                # index-speakers backfill)
+                keys = speakers.speakerSessionKeys(request.speaker)
+                sessions = [sess for sess in ndb.get_multi(keys) if sess]
             return SessionForms(
                 items=[self._copySessionToForm(sess) for sess in sessions]
             )
@@ -691,27 +1309,39 @@ class ConferenceApi(remote.Service):
     @endpoints.method(WISHLIST_POST_REQUEST, MultiStringMessage,
                       path='wishlist/{websafeSessionKey}',
                       http_method='POST', name='addSessionToWishlist')
+    @instrument.timed
     def addSessionToWishlist(self, request):
         """Adds the session to the current user's wishlist."""
 
-        # check if user is logged in
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-
-        # get Profile from datastore
-        user_id = getUserId(user)
-        p_key = ndb.Key(Profile, user_id)
-        profile = p_key.get()
+        # get Profile of the logged in user
+        profile = self._getProfileFromUser()
 
         # Check if session was already added.
         if request.websafeSessionKey in profile.sessionWishlist:
             raise ConflictException(
                 "This session is already on your wishlist.")
+        try:
+            session = ndb.Key(urlsafe=request.websafeSessionKey).get()
+        except Exception:
+            session = None
+        if not session:
+            raise endpoints.NotFoundException(
+                'No session found with key: %s' % request.websafeSessionKey)
+
+        # Check the session doesn't overlap one already on the wishlist,
+        # unless the user allows it.
+        intervals = schedule.getIntervals(profile)
+        conflicts = schedule.overlapping(intervals, session)
+        if conflicts and not request.allowConflict:
+            names = [sess.name for sess in ndb.get_multi(
+                [ndb.Key(urlsafe=wssk) for wssk in conflicts]) if sess]
+            raise ConflictException(
+                "This session overlaps with %s on your wishlist." % ', '.join(names))
 
         # Add session to wishlist.
         profile.sessionWishlist.append(request.websafeSessionKey)
         profile.put()
+        schedule.addInterval(profile, intervals, session)
 
         # After adding successfully return the entire wish list
         sessions_list = profile.sessionWishlist
@@ -722,29 +1352,140 @@ class ConferenceApi(remote.Service):
 
     @endpoints.method(message_types.VoidMessage, MultiStringMessage,
                       http_method='GET', name='getSessionsInWishlist')
+    @instrument.timed
     def getSessionsInWishlist(self, request):
         """Get all sessions from the user's wishlist."""
 
-        # check if user is logged in
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-
-        # get Profile from datastore
-        user_id = getUserId(user)
-        p_key = ndb.Key(Profile, user_id)
-        profile = p_key.get()
+        # get Profile of the logged in user
+        profile = self._getProfileFromUser()
 
         # Get all the sessions keys in your wish list
         sessions_list = profile.sessionWishlist
 
         return MultiStringMessage(data=sessions_list)
 
+# - - - - - Get the user's wishlist conflicts - - - - - - - - - - -
+
+    @endpoints.method(message_types.VoidMessage, ConflictGroupForms,
+                      path='wishlist/conflicts',
+                      http_method='GET', name='getWishlistConflicts')
+    @instrument.timed
+    def getWishlistConflicts(self, request):
+        """Get the groups of sessions on the user's wishlist that overlap."""
+        profile = self._getProfileFromUser()
+
+        def formatMinutes(minutes):
+            return datetime.utcfromtimestamp(minutes * 60).strftime('%Y-%m-%d %H:%M')
+
+        return ConflictGroupForms(items=[
+            ConflictGroupForm(startTime=formatMinutes(start),
+                              endTime=formatMinutes(end),
+                              sessions=sessions)
+            for start, end, sessions in schedule.conflictGroups(
+                schedule.getIntervals(profile))])
+
+# - - - - - Get the user's wishlist as full sessions - - - - - - -
+
+    @endpoints.method(message_types.VoidMessage, WishlistForms,
+                      path='wishlist/sessions',
+                      http_method='GET', name='getWishlistSessions')
+    @instrument.timed
+    def getWishlistSessions(self, request):
+        """Get the sessions in the user's wishlist and their conferences."""
+
+        # get Profile of the logged in user
+        profile = self._getProfileFromUser()
+
+        # fetch every wishlisted session in one batch; keys that don't
+        # parse or whose session is gone are skipped and pruned later
+        stale = []
+        wishlist = []
+        for wssk in profile.sessionWishlist:
+            try:
+                wishlist.append((wssk, ndb.Key(urlsafe=wssk)))
+            except Exception:
+                stale.append(wssk)
+        sessions = []
+        for (wssk, _), session in zip(wishlist, ndb.get_multi([key for _, key in wishlist])):
+            if session is None:
+                stale.append(wssk)
+            else:
+                sessions.append(session)
+
+        # then their distinct conferences and organizers in one more batch
+        conf_keys = []
+        for session in sessions:
+            if session.conference and session.conference not in conf_keys:
+                conf_keys.append(session.conference)
+        entities = ndb.get_multi(conf_keys + [key.parent() for key in conf_keys])
+        conferences = []
+        for conf, prof in zip(entities[:len(conf_keys)], entities[len(conf_keys):]):
+            if conf is not None:
+                conferences.append((conf, getattr(prof, 'displayName', None)))
+        available = seats.getSeatsAvailableMulti([conf for conf, _ in conferences])
+
+        if stale:
+            taskqueue.add(params={'userId': profile.key.id(),
+                                  'websafeSessionKey': stale},
+                          url='/tasks/prune_wishlist'
+                          )
+
+        return WishlistForms(
+            sessions=[self._copySessionToForm(session) for session in sessions],
+            conferences=[self._copyConferenceToForm(conf, displayName, available[conf.key])
+                         for conf, displayName in conferences]
+        )
+
+    @staticmethod
+    @ndb.transactional()
+    def _migrateRegistrations(user_id):
+        """Move up to MIGRATE_REGISTRATIONS of the registrations listed on a
+        Profile to Registration entities; returns True if any are left."""
+        profile = ndb.Key(Profile, user_id).get()
+        if not profile:
+            return False
+        moving = profile.conferenceKeysToAttend[:MIGRATE_REGISTRATIONS]
+        registrations = []
+        for wsck in moving:
+            try:
+                conf_key = ndb.Key(urlsafe=wsck)
+            except Exception:
+                continue
+            registrations.append(Registration(
+                key=ndb.Key(Registration, wsck, parent=profile.key),
+                conference=conf_key))
+        profile.conferenceKeysToAttend = profile.conferenceKeysToAttend[len(moving):]
+        ndb.put_multi(registrations + [profile])
+        return bool(profile.conferenceKeysToAttend)
+
+    @staticmethod
+    @backfill.job('migrate-registrations', 'Profile')
+    def _migrateProfiles(keys):
+        """Move the registrations listed on a batch of Profiles to
+        Registration entities; for registrations made before they existed."""
+        for key in keys:
+            while ConferenceApi._migrateRegistrations(key.id()):
+                pass
+
+    @staticmethod
+    @ndb.transactional()
+    def _pruneWishlist(user_id, websafeSessionKeys):
+        """Remove stale session keys from a user's wishlist."""
+        profile = ndb.Key(Profile, user_id).get()
+        if not profile:
+            return
+        wishlist = [wssk for wssk in profile.sessionWishlist
+                    if wssk not in websafeSessionKeys]
+        if len(wishlist) != len(profile.sessionWishlist):
+            profile.sessionWishlist = wishlist
+            profile.put()
+
 # - - - - - - - - - - 2 Extra queries - - - - - - - - - - - - -
 
     @endpoints.method(SESSION_START_TIME_GET_REQUEST, SessionForms,
                       path='session/{websafeConferenceKey}/time/{startTime}',
                       http_method='GET', name='getConferenceSessionsByStartTime')
+    @instrument.timed
     def getConferenceSessionsByStartTime(self, request):
             """Return all sessions for a conference by start time."""
 
@@ -769,6 +1510,7 @@ class ConferenceApi(remote.Service):
     @endpoints.method(SESSION_HIGHLIGHTS_GET_REQUEST, SessionForms,
                       path='session/{websafeConferenceKey}/highlights/{highlights}',
                       http_method='GET', name='getConferenceSessionsByHighlights')
+    @instrument.timed
     def getConferenceSessionsByHighlights(self, request):
             """Return all sessions for a conference by start time."""
 
@@ -784,8 +1526,10 @@ class ConferenceApi(remote.Service):
     @endpoints.method(CUSTOM_SESSION_GET_REQUEST, SessionForms,
                       path='session/by/{excludeSessionType}/and/{startTime}',
                       http_method='GET', name='getSessionsCustomRequest')
+    @instrument.timed
     def getSessionsCustomRequest(self, request):
-            """Return all sessions excluding certain type and specific start time"""
+            """Return all sessions excluding certain type, starting before (or
+            with startsAfter, after) a time; optionally within one conference."""
 
             # Collect data from request and check startTime format
             # this is so we don't use : request.startTime, '%H:%M'
@@ -798,50 +1542,103 @@ class ConferenceApi(remote.Service):
                     data['startTime'] = datetime.strptime(
                         value, '%H:%M').time()
 
-            # first query select all sessions with inequality filter
-            sessions_type_filtered = Session.query(Session.typeOfSession != request.excludeSessionType)
-            # iterate through the results and look apply second inequality filter
-            sessions_qualified = [t for t in sessions_type_filtered if t.startTime <= data['startTime']]
+            if 'startTime' not in data:
+                raise endpoints.BadRequestException("'startTime' needed: '%H:%M'")
+
+            # "type != X" plus a startTime inequality would need two
+            # inequality filters; since the types are a fixed set, ask for
+            # the other types (and untyped sessions) by equality instead,
+            # so the typeOfSession/startTime index answers it directly
+            other_types = [None] + sorted(
+                t for t in Session.typeOfSession._choices
+                if t != request.excludeSessionType)
+            sessions = Session.query(Session.typeOfSession.IN(other_types))
+            if request.websafeConferenceKey:
+                sessions = sessions.filter(
+                    Session.conference == ndb.Key(urlsafe=request.websafeConferenceKey))
+            if request.startsAfter:
+                sessions = sessions.filter(Session.startTime >= data['startTime'])
+            else:
+                sessions = sessions.filter(Session.startTime <= data['startTime'])
             # display results
             return SessionForms(
-                items=[self._copySessionToForm(sess) for sess in sessions_qualified]
+                items=[self._copySessionToForm(sess)
+                       for sess in sessions.order(Session.startTime)]
             )
 # - - - - - - - Used to add a task queue when more than one session with same speaker - - - - -
 
     @staticmethod
-    def _setFeaturedSpeaker(speaker, webSafeKey):
-        """This will check if the speaker is featured in more
-        than one session then it will create an anouncement
-        assigning it to memcache.
+    def _queueFeaturedSpeaker(webSafeKey):
+        """Queue a featured speaker recomputation for a conference.
+
+        The task is named after the conference and the current time window,
+        so a burst of session writes queues one task per window; it runs at
+        the end of the window to pick up the whole burst.
         """
-        # get all existing sessions
+        window = int(time.time()) // FEATURED_SPEAKER_WINDOW
+        try:
+            taskqueue.add(params={'websafeConferenceKey': webSafeKey},
+                          url='/tasks/set_featured_speaker',
+                          name='featured-speaker-%s-%d' % (webSafeKey, window),
+                          countdown=FEATURED_SPEAKER_WINDOW
+                          )
+        except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+            # already queued for this window
+            pass
+
+    @staticmethod
+    def _featuredSpeaker(webSafeKey):
+        """Return the announcement of the speaker featured in the most
+        sessions of a conference, if in more than one, else ""."""
+        # the speakers of this conference and their sessions come from the index
         confkey = ndb.Key(urlsafe=webSafeKey)
-        all_sessions = Session.get_session_by_conferencekey(confkey)
-        # check to see if speaker is present already in other sessions
-        speaker_sessions = all_sessions.filter(Session.speaker == speaker)
-        if speaker_sessions.count() > 1:
-            announcement = '%s %s %s %s' % (
-                'This speaker is very popular:',
-                speaker,
-                '. He is featured in these sessions:',
-                ', '.join(sess.name for sess in speaker_sessions))
-            memcache.set(FEATURED_SPEAKER_SESSIONS_KEY, announcement)
-        else:
-            # delete the memcache announcements entry
-            announcement = ""
-            memcache.delete(FEATURED_SPEAKER_SESSIONS_KEY)
+        conf_speaker = ConferenceSpeaker.query(ancestor=confkey).order(
+            -ConferenceSpeaker.sessionCount).get()
+        if not conf_speaker or conf_speaker.sessionCount < 2:
+            return ""
+        speaker_sessions = [sess for sess in ndb.get_multi(conf_speaker.speakerSess) if sess]
+        return '%s %s %s %s' % (
+            'This speaker is very popular:',
+            conf_speaker.speakerName,
+            '. He is featured in these sessions:',
+            ', '.join(sess.name for sess in speaker_sessions))
 
+    @staticmethod
+    def _setFeaturedSpeaker(webSafeKey):
+        """This will find the speaker featured in the most sessions of a
+        conference, if in more than one, then it will create an anouncement
+        assigning it to memcache for that conference, and as the latest one.
+        Run by the featured speaker task only.
+        """
+        announcement = ConferenceApi._featuredSpeaker(webSafeKey)
+        if announcement:
+            memcache.set(FEATURED_SPEAKER_SESSIONS_KEY, announcement)
+        # cache "no featured speaker" too, so misses can be told apart
+        memcache.set(MEMCACHE_FEATURED_SPEAKER_KEY % webSafeKey, announcement)
         return announcement
 
     # This provides the means to check if the memcache has indeed been updated
     # ,you can simply run this in the API explorer to check if it worked
-    @endpoints.method(message_types.VoidMessage, StringMessage,
+    @endpoints.method(FEATURED_SPEAKER_GET_REQUEST, StringMessage,
             path='conference/getFeaturedSpeaker',
             http_method='GET', name='getFeaturedSpeaker')
+    @instrument.timed
     def getFeaturedSpeaker(self, request):
-        """Return featured speaker from memcache."""
-        # return an existing announcement from Memcache or an empty string.
-        announcement = memcache.get(FEATURED_SPEAKER_SESSIONS_KEY)
+        """Return featured speaker of a conference (or the latest one) from memcache."""
+        if not request.websafeConferenceKey:
+            # return the most recently set announcement or an empty string.
+            announcement = memcache.get(FEATURED_SPEAKER_SESSIONS_KEY)
+        else:
+            announcement = memcache.get(
+                MEMCACHE_FEATURED_SPEAKER_KEY % request.websafeConferenceKey)
+            if announcement is None:
+                # evicted or never computed; rebuild it from the speaker index.
+                # Only this conference's entry is filled in, and only if no
+                # task has set it meanwhile; the latest announcement is left
+                # to the task
+                announcement = self._featuredSpeaker(request.websafeConferenceKey)
+                memcache.add(MEMCACHE_FEATURED_SPEAKER_KEY % request.websafeConferenceKey,
+                             announcement)
         if not announcement:
             announcement = ""
         return StringMessage(data=announcement)
@@ -849,40 +1646,104 @@ class ConferenceApi(remote.Service):
 # - - - Announcements - - - - - - - - - - - - - - - - - - - -
 
     @staticmethod
-    def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
-        """
-        confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
-            Conference.seatsAvailable > 0)
-        ).fetch(projection=[Conference.name])
+    def _setAnnouncement(changed_key=None, changed=None):
+        """Format the Announcement from the nearly sold out entries with the
+        fewest seats & assign it to memcache (an empty one too, so a miss
+        means not cached).
 
-        if confs:
+        changed_key and changed give an entry just written, or deleted
+        (None), which the query may not reflect yet.
+        """
+        entries = NearlySoldOutEntry.query().order(
+            NearlySoldOutEntry.seatsAvailable).fetch(MAX_ANNOUNCED + 1)
+        if changed_key:
+            entries = [e for e in entries if e.conference != changed_key]
+            if changed:
+                entries.append(changed)
+                entries.sort(key=lambda e: e.seatsAvailable)
+        if entries:
             # If there are almost sold out conferences,
-            # format announcement and set it in memcache
+            # format announcement
             announcement = '%s %s' % (
                 'Last chance to attend! The following conferences '
                 'are nearly sold out:',
-                ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
+                ', '.join(entry.name for entry in entries[:MAX_ANNOUNCED]))
+            if len(entries) > MAX_ANNOUNCED:
+                announcement += ' and more'
         else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
             announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
-
+        memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
         return announcement
 
+    @staticmethod
+    def _nearlySoldOutEntry(conf, available):
+        """Return the NearlySoldOutEntry a conference should have, or None."""
+        if not 0 < available <= NEARLY_SOLD_OUT_SEATS:
+            return None
+        return NearlySoldOutEntry(key=ndb.Key(NearlySoldOutEntry, conf.key.urlsafe()),
+                                  conference=conf.key, name=conf.name,
+                                  seatsAvailable=available)
+
+    @staticmethod
+    def _isCurrent(entry, wanted):
+        if wanted is None:
+            return entry is None
+        return (entry is not None and entry.name == wanted.name
+                and entry.seatsAvailable == wanted.seatsAvailable)
+
+    @staticmethod
+    def _updateNearlySoldOut(conf, available):
+        """Add a conference to, update or drop it from the nearly sold out
+        entries according to its seats available, refreshing the
+        Announcement. Entries are separate root entities, so conferences
+        selling out at once do not contend."""
+        entry_key = ndb.Key(NearlySoldOutEntry, conf.key.urlsafe())
+        wanted = ConferenceApi._nearlySoldOutEntry(conf, available)
+        # nothing to write unless membership (or what is shown) changes
+        if ConferenceApi._isCurrent(entry_key.get(), wanted):
+            return
+        if wanted:
+            wanted.put()
+        else:
+            entry_key.delete()
+        ConferenceApi._setAnnouncement(conf.key, wanted)
+
+    @staticmethod
+    @backfill.job('nearly-sold-out', 'Conference')
+    def _repairNearlySoldOut(keys):
+        """Bring a batch of conferences' nearly sold out entries in line
+        with their seats; run over every conference by the cron job to
+        repair any drift in the incremental updates."""
+        confs = [conf for conf in ndb.get_multi(keys) if conf]
+        # seats are kept in sharded counters, so check their (cached)
+        # totals rather than Conference.seatsAvailable
+        available = seats.getSeatsAvailableMulti(confs)
+        entry_keys = [ndb.Key(NearlySoldOutEntry, conf.key.urlsafe()) for conf in confs]
+        put, deleted = [], []
+        for conf, key, entry in zip(confs, entry_keys, ndb.get_multi(entry_keys)):
+            wanted = ConferenceApi._nearlySoldOutEntry(conf, available[conf.key])
+            if not ConferenceApi._isCurrent(entry, wanted):
+                if wanted:
+                    put.append(wanted)
+                else:
+                    deleted.append(key)
+        ndb.put_multi(put)
+        ndb.delete_multi(deleted)
+        if put or deleted:
+            # rebuilt on the next read
+            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
+
     @endpoints.method(message_types.VoidMessage, StringMessage,
             path='conference/announcement/get',
             http_method='GET', name='getAnnouncement')
+    @instrument.timed
     def getAnnouncement(self, request):
         """Return Announcement from memcache."""
-        # return an existing announcement from Memcache or an empty string.
+        # return an existing announcement from Memcache, rebuilding it
+        # from the nearly sold out set if it isn't there
         announcement = memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY)
-        if not announcement:
-            announcement = ""
+        if announcement is None:
+            announcement = self._setAnnouncement()
         return StringMessage(data=announcement)
 
 api = endpoints.api_server([ConferenceApi]) # register API
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+"""converters.py
+
+Entity-to-message copiers for ConferenceApi. Each copier is compiled once at
+import from the ndb model and ProtoRPC message definitions, so copying an
+entity is a fixed list of (property, conversion) steps instead of walking
+all_fields() with hasattr/getattr and name checks for every item.
+
+"""
+
+from google.appengine.ext import ndb
+from protorpc import messages
+
+from models import Conference
+from models import ConferenceForm
+from models import Profile
+from models import ProfileForm
+from models import Session
+from models import SessionForm
+
+
+def _keyToString(key):
+    return key.urlsafe()
+
+
+def _converter(prop, field):
+    """Return the function converting a prop value for field, or None."""
+    if isinstance(field, messages.EnumField):
+        convert = field.type.lookup_by_name
+    elif isinstance(prop, ndb.KeyProperty):
+        convert = _keyToString
+    elif isinstance(prop, ndb.DateTimeProperty):
+        # also covers DateProperty and TimeProperty
+        convert = str
+    elif isinstance(field, messages.IntegerField) and \
+            not isinstance(prop, ndb.IntegerProperty):
+        convert = int
+    else:
+        return None
+
+    if prop._repeated:
+        return lambda values: [convert(value) for value in values]
+    return convert
+
+
+def compileCopier(model, message, keyField=None):
+    """Return a function copying an entity of model into a new message.
+
+    Fields named like a model property are copied (skipping None values)
+    through a conversion picked from the property and field types; if
+    keyField is given it is set to the entity's websafe key.
+    """
+    plan = []
+    for field in message.all_fields():
+        prop = model._properties.get(field.name)
+        if prop is not None:
+            plan.append((field.name, _converter(prop, field)))
+    plan = tuple(plan)
+    check = any(field.required for field in message.all_fields())
+
+    def copy(entity):
+        msg = message()
+        for name, convert in plan:
+            value = getattr(entity, name)
+            if value is None:
+                continue
+            if convert is not None:
+                value = convert(value)
+            setattr(msg, name, value)
+        if keyField:
+            setattr(msg, keyField, entity.key.urlsafe())
+        if check:
+            msg.check_initialized()
+        return msg
+
+    return copy
+
+
+copyConferenceToForm = compileCopier(Conference, ConferenceForm, keyField='websafeKey')
+copySessionToForm = compileCopier(Session, SessionForm, keyField='sessionKey')
+copyProfileToForm = compileCopier(Profile, ProfileForm)
@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+
+"""datagen.py
+
+Seeded synthetic dataset generator for benchmarks. Writes Profiles,
+Conferences, Sessions and registrations straight to the datastore with
+put_multi, in chunks so memory stays bounded however many entities are
+made, together with the state the API keeps alongside them: seat shards,
+the speaker index, the nearly sold out set, autocomplete counts and (with
+--search) the search index.
+
+Popularity is skewed: conferences are picked for registration with a Zipf
+distribution (hot conferences sell out), speakers are picked for sessions
+with another (a few prolific speakers), and the number of conferences a
+user attends is Pareto distributed (some attend hundreds).
+
+Entity names match loadtest.py ('user<n>@example.com', 'organizer<n>@...',
+'Speaker <n>'), so a dataset written to a --datastore-file can be load
+tested with loadtest.py --datastore-file.
+
+usage: python datagen.py --sdk ~/google_appengine --datastore-file data.sqlite
+           [--profiles 100000] [--conferences 20000] [--seed 0]
+       python datagen.py --sdk ~/google_appengine --remote-api HOST [...]
+
+--remote-api needs a staging app serving remote_api, which app.yaml does
+not: deploy remote_api.yaml (the remote-api module) for the run and pass
+its host, remote-api-dot-<app>.appspot.com.
+
+"""
+
+import argparse
+import array
+import bisect
+import datetime
+import random
+import sys
+import time
+
+from loadtest import CITIES, HIGHLIGHTS, SESSION_TYPES, TOPICS, WORDS
+from loadtest import MAX_SHARDS, StandInBackend, setupSdk
+
+CAPACITIES = [10, 50, 200, 1000, 5000]
+DURATIONS = [30, 45, 60, 90]
+MAX_PICKS = 10      # tries at a conference the user can still register for
+
+
+class Zipf(object):
+    """Draws ranks 0..n-1 with P(rank) proportional to 1 / (rank + 1) ** s;
+    s = 0 draws uniformly."""
+
+    def __init__(self, n, s, rng):
+        self.rng = rng
+        self.cumulative = array.array('d')
+        total = 0.0
+        for rank in xrange(n):
+            total += 1.0 / (rank + 1) ** s
+            self.cumulative.append(total)
+
+    def draw(self):
+        rank = bisect.bisect_right(self.cumulative,
+                                   self.rng.random() * self.cumulative[-1])
+        return min(rank, len(self.cumulative) - 1)
+
+
+def chunks(n, size):
+    """Yield (start, stop) ranges covering 0..n in steps of size."""
+    for start in xrange(0, n, size):
+        yield start, min(start + size, n)
+
+
+def putInBatches(entities, batch):
+    """put_multi entities, at most batch per RPC."""
+    from google.appengine.ext import ndb
+    for start, stop in chunks(len(entities), batch):
+        ndb.put_multi(entities[start:stop])
+
+
+def userEmail(i):
+    return 'user%d@example.com' % i
+
+
+def organizerEmail(i):
+    return 'organizer%d@example.com' % i
+
+
+def conferenceName(i):
+    return 'Conference %d' % i
+
+
+class Generator(object):
+    """Writes one seeded dataset; see the module docstring."""
+
+    def __init__(self, args, out=sys.stdout):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.out = out
+        self.written = 0
+        self.started = time.time()
+        self.conferenceKeys = []                        # by conference number
+        self.capacity = array.array('l')                # maxAttendees
+        self.registered = array.array('l', [0]) * args.conferences
+
+    def progress(self, what, count):
+        self.written += count
+        elapsed = time.time() - self.started
+        self.out.write('%-12s %9d entities, %6.0f/s\n'
+                       % (what, self.written, self.written / elapsed if elapsed else 0))
+
+    def run(self):
+        from google.appengine.ext import ndb
+
+        # nothing written here is read back, so keep it out of the
+        # in-context cache and memcache
+        context = ndb.get_context()
+        context.set_cache_policy(False)
+        context.set_memcache_policy(False)
+
+        self.writeOrganizers()
+        self.writeConferences()
+        self.writeProfiles()
+        self.writeSeats()
+        self.out.write('done: %d entities in %.1fs\n'
+                       % (self.written, time.time() - self.started))
+
+    # - - - Conferences and Sessions - - - - - - - - - - - - - - - - - -
+
+    def writeOrganizers(self):
+        from models import Profile
+        from google.appengine.ext import ndb
+
+        profiles = [Profile(key=ndb.Key(Profile, organizerEmail(i)),
+                            displayName='Organizer %d' % i,
+                            mainEmail=organizerEmail(i))
+                    for i in xrange(self.args.organizers)]
+        putInBatches(profiles, self.args.batch)
+        self.progress('organizers', len(profiles))
+
+    def conference(self, i):
+        from models import Conference, Profile
+        from google.appengine.ext import ndb
+
+        rng = self.rng
+        organizer = organizerEmail(rng.randrange(self.args.organizers))
+        start = datetime.date(self.args.year, 1, 1) + datetime.timedelta(
+            days=rng.randrange(365))
+        capacity = rng.choice(CAPACITIES)
+        return Conference(parent=ndb.Key(Profile, organizer),
+                          name=conferenceName(i),
+                          description='Synthetic conference %d on %s' % (i, self.words(8)),
+                          organizerUserId=organizer,
+                          topics=rng.sample(TOPICS, rng.randint(1, 3)),
+                          city=CITIES[self.cityZipf.draw()],
+                          startDate=start,
+                          month=start.month,
+                          endDate=start + datetime.timedelta(days=rng.randint(0, 3)),
+                          maxAttendees=capacity,
+                          seatsAvailable=capacity)
+
+    def words(self, n):
+        """Draw n words, some far more common than others."""
+        return ' '.join(WORDS[self.wordZipf.draw()] for _ in range(n))
+
+    def session(self, conf):
+        from models import Session
+
+        rng = self.rng
+        days = (conf.endDate - conf.startDate).days
+        return Session(name='Session %d: %s' % (rng.randrange(10 ** 6), self.words(3)),
+                       speaker='Speaker %d' % self.speakerZipf.draw(),
+                       highlights=rng.sample(HIGHLIGHTS, rng.randint(1, 2)),
+                       duration=rng.choice(DURATIONS),
+                       typeOfSession=rng.choice(SESSION_TYPES),
+                       startDate=conf.startDate + datetime.timedelta(
+                           days=rng.randint(0, days)),
+                       startTime=datetime.time(rng.randint(8, 20),
+                                               rng.choice([0, 30])),
+                       conference=conf.key)
+
+    def writeConferences(self):
+        """Write conferences a chunk at a time, each chunk followed by
+        its sessions and their speaker index entries."""
+        args = self.args
+        self.cityZipf = Zipf(len(CITIES), args.skew, self.rng)
+        self.speakerZipf = Zipf(args.speakers, args.speaker_skew, self.rng)
+        self.wordZipf = Zipf(len(WORDS), 1.0, self.rng)
+
+        for start, stop in chunks(args.conferences, args.batch):
+            confs = [self.conference(i) for i in xrange(start, stop)]
+            putInBatches(confs, args.batch)
+            for conf in confs:
+                self.conferenceKeys.append(conf.key)
+                self.capacity.append(conf.maxAttendees)
+
+            sessions = [self.session(conf) for conf in confs
+                        for _ in range(self.rng.randint(0, 2 * args.sessions))]
+            putInBatches(sessions, args.batch)
+            self.progress('conferences', len(confs) + len(sessions))
+            self.indexSpeakers(sessions)
+            self.countCompletions(confs, sessions)
+            if args.search:
+                import textsearch
+                textsearch.indexDocuments([doc.key for doc in confs + sessions])
+                self.progress('search index', 0)
+
+    def indexSpeakers(self, sessions):
+        """Write the ConferenceSpeaker entries of a chunk's conferences
+        (all their sessions are in the chunk)."""
+        from models import ConferenceSpeaker
+        from speakers import conferenceSpeakerKey
+
+        conf_speakers = {}
+        for session in sessions:
+            key = conferenceSpeakerKey(session.conference, session.speaker)
+            entry = conf_speakers.get(key)
+            if entry is None:
+                entry = conf_speakers[key] = ConferenceSpeaker(
+                    key=key, speakerName=session.speaker)
+            entry.speakerSess.append(session.key)
+        for entry in conf_speakers.values():
+            entry.sessionCount = len(entry.speakerSess)
+
+        putInBatches(conf_speakers.values(), self.args.batch)
+        self.progress('speakers', len(conf_speakers))
+
+    def countCompletions(self, confs, sessions):
+        import autocomplete
+
+        changes = [(field, getattr(conf, field), 1)
+                   for conf in confs for field in ('name', 'city')]
+        changes += [('speaker', session.speaker, 1) for session in sessions]
+        autocomplete.adjust(changes)
+        self.progress('completions', 0)
+
+    # - - - Profiles and registrations - - - - - - - - - - - - - - - - -
+
+    def attendance(self):
+        """Draw how many conferences a user registers for."""
+        count = int(self.rng.paretovariate(self.args.attendance_alpha)) - 1
+        return min(count, self.args.max_attendance, len(self.conferenceKeys))
+
+    def pickConference(self, attending):
+        """Draw a conference the user isn't attending and that has seats
+        left, or None if none turns up in MAX_PICKS tries."""
+        for _ in range(MAX_PICKS):
+            n = self.popularity[self.conferenceZipf.draw()]
+            if n not in attending and self.registered[n] < self.capacity[n]:
+                return n
+        return None
+
+    def writeProfiles(self):
+        from models import Profile, Registration
+        from google.appengine.ext import ndb
+
+        args = self.args
+        # conference numbers in order of popularity, so the hot ones are
+        # spread over organizers and dates rather than the first created
+        self.popularity = array.array('l', xrange(len(self.conferenceKeys)))
+        self.rng.shuffle(self.popularity)
+        self.conferenceZipf = Zipf(len(self.popularity), args.skew, self.rng)
+
+        for start, stop in chunks(args.profiles, args.batch):
+            profiles = []
+            registrations = []
+            for i in xrange(start, stop):
+                attending = set()
+                for _ in range(self.attendance()):
+                    n = self.pickConference(attending)
+                    if n is not None:
+                        attending.add(n)
+                        self.registered[n] += 1
+                p_key = ndb.Key(Profile, userEmail(i))
+                profiles.append(Profile(
+                    key=p_key,
+                    displayName='User %d' % i,
+                    mainEmail=userEmail(i)))
+                for n in sorted(attending):
+                    conf_key = self.conferenceKeys[n]
+                    registrations.append(Registration(
+                        key=ndb.Key(Registration, conf_key.urlsafe(), parent=p_key),
+                        conference=conf_key))
+            ndb.put_multi(profiles)
+            putInBatches(registrations, args.batch)
+            self.progress('profiles', len(profiles))
+
+    # - - - Seats - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def writeSeats(self):
+        """Write each conference's seat shards holding the seats left
+        after registration, and the nearly sold out entries."""
+        from conference import MEMCACHE_ANNOUNCEMENTS_KEY
+        from conference import NEARLY_SOLD_OUT_SEATS
+        from models import NearlySoldOutEntry
+        from seats import NUM_SHARDS, seatShards
+        from google.appengine.api import memcache
+        from google.appengine.ext import ndb
+
+        per_chunk = max(1, self.args.batch // NUM_SHARDS)
+        entries = []
+        for start, stop in chunks(len(self.conferenceKeys), per_chunk):
+            shards = []
+            for n in xrange(start, stop):
+                available = self.capacity[n] - self.registered[n]
+                shards.extend(seatShards(self.conferenceKeys[n], available))
+                if 0 < available <= NEARLY_SOLD_OUT_SEATS:
+                    conf_key = self.conferenceKeys[n]
+                    entries.append(NearlySoldOutEntry(
+                        key=ndb.Key(NearlySoldOutEntry, conf_key.urlsafe()),
+                        conference=conf_key, name=conferenceName(n),
+                        seatsAvailable=available))
+            ndb.put_multi(shards)
+            self.progress('seat shards', len(shards))
+
+        putInBatches(entries, self.args.batch)
+        memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
+        self.progress('nearly sold out', len(entries))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sdk', required=True, help='App Engine Python SDK directory')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--datastore-file',
+                        help='write to a local sqlite datastore file')
+    target.add_argument('--remote-api', metavar='HOST',
+                        help='write to a deployed app through remote_api '
+                             '(the remote-api module of remote_api.yaml)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--organizers', type=int, default=1000)
+    parser.add_argument('--profiles', type=int, default=100000)
+    parser.add_argument('--conferences', type=int, default=20000)
+    parser.add_argument('--sessions', type=int, default=10,
+                        help='mean sessions per conference')
+    parser.add_argument('--speakers', type=int, default=20000)
+    parser.add_argument('--skew', type=float, default=1.1,
+                        help='Zipf exponent of conference and city popularity')
+    parser.add_argument('--speaker-skew', type=float, default=1.1,
+                        help='Zipf exponent of sessions per speaker')
+    parser.add_argument('--attendance-alpha', type=float, default=1.2,
+                        help='Pareto shape of conferences attended per user')
+    parser.add_argument('--max-attendance', type=int, default=500)
+    parser.add_argument('--shards', type=int,
+                        help='seat shards per conference, 1 to %d '
+                             '(default seats.NUM_SHARDS)' % MAX_SHARDS)
+    parser.add_argument('--search', action='store_true',
+                        help='also build the search index (slower)')
+    parser.add_argument('--year', type=int, default=2027)
+    parser.add_argument('--batch', type=int, default=500,
+                        help='entities per put_multi (the datastore allows 500)')
+    args = parser.parse_args(argv)
+    if args.shards is not None and not 1 <= args.shards <= MAX_SHARDS:
+        parser.error('--shards must be between 1 and %d' % MAX_SHARDS)
+
+    setupSdk(args.sdk)
+    if args.shards:
+        import seats
+        seats.NUM_SHARDS = args.shards
+    if args.remote_api:
+        from google.appengine.ext.remote_api import remote_api_stub
+        remote_api_stub.ConfigureRemoteApiForOAuth(args.remote_api,
+                                                   '/_ah/remote_api')
+        backend = None
+    else:
+        backend = StandInBackend(datastore_file=args.datastore_file)
+
+    Generator(args).run()
+    if backend:
+        backend.deactivate()
+
+
+if __name__ == '__main__':
+    main()
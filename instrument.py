@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+"""instrument.py
+
+Per-endpoint latency and RPC statistics. Methods wrapped with @timed have
+their calls, errors and latency (as a histogram) recorded, along with the
+API calls made while they ran, counted by service, and the memcache keys
+they asked for and found. RPCs are seen through apiproxy hooks, so ndb,
+memcache, taskqueue and urlfetch calls are all counted without changing
+the code making them.
+
+Counts are added up per instance and added to memcache counters at most
+every FLUSH_INTERVAL, so recording costs no RPCs on most calls. Counts an
+instance has not flushed yet (or memcache has evicted) are lost; these
+are statistics, not accounts.
+
+"""
+
+import functools
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+
+# upper bounds, in milliseconds, of the latency histogram buckets; the
+# last bucket has no upper bound
+LATENCY_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+SERVICES = ('datastore_v3', 'memcache', 'taskqueue', 'urlfetch', 'mail')
+FIELDS = (('calls', 'errors', 'ms', 'memcacheKeys', 'memcacheHits') +
+          tuple('bucket%d' % i for i in range(len(LATENCY_BUCKETS) + 1)) +
+          tuple('rpc_%s' % service for service in SERVICES + ('other',)))
+FLUSH_INTERVAL = 30     # seconds
+MEMCACHE_NAMES_KEY = "STATS_NAMES"
+MEMCACHE_COUNT_KEY = "STATS_%s_%s"
+
+_local = threading.local()
+_lock = threading.Lock()
+_totals = {}
+_names = set()
+_flushed = [time.time()]
+
+
+def _record():
+    return getattr(_local, 'record', None)
+
+
+def _preCall(service, call, request, response):
+    record = _record()
+    if record is not None:
+        field = 'rpc_%s' % (service if service in SERVICES else 'other')
+        record[field] = record.get(field, 0) + 1
+
+
+def _postCall(service, call, request, response):
+    record = _record()
+    if record is not None and service == 'memcache' and call == 'Get':
+        record['memcacheKeys'] = record.get('memcacheKeys', 0) + request.key_size()
+        record['memcacheHits'] = record.get('memcacheHits', 0) + response.item_size()
+
+
+apiproxy_stub_map.apiproxy.GetPreCallHooks().Append('instrument', _preCall)
+apiproxy_stub_map.apiproxy.GetPostCallHooks().Append('instrument', _postCall)
+
+
+def _bucket(ms):
+    for i, bound in enumerate(LATENCY_BUCKETS):
+        if ms <= bound:
+            return i
+    return len(LATENCY_BUCKETS)
+
+
+def _addNames(names):
+    """Add to the set of recorded names kept in memcache."""
+    client = memcache.Client()
+    for _ in range(5):
+        current = client.gets(MEMCACHE_NAMES_KEY)
+        if current is None:
+            if client.add(MEMCACHE_NAMES_KEY, set(names)):
+                return True
+        elif names <= current or client.cas(MEMCACHE_NAMES_KEY, current | names):
+            return True
+    return False
+
+
+def _flush():
+    """Add this instance's counts to the memcache counters."""
+    with _lock:
+        totals = _totals.copy()
+        _totals.clear()
+        new = set(name for name, _ in totals) - _names
+        _names.update(new)
+        _flushed[0] = time.time()
+    if new and not _addNames(new):
+        with _lock:
+            _names.difference_update(new)
+    memcache.offset_multi(dict((MEMCACHE_COUNT_KEY % key, value)
+                               for key, value in totals.items()),
+                          initial_value=0)
+
+
+def _add(name, record):
+    with _lock:
+        for field, value in record.items():
+            _totals[(name, field)] = _totals.get((name, field), 0) + value
+        due = time.time() - _flushed[0] >= FLUSH_INTERVAL
+    if due:
+        _flush()
+
+
+def timed(func):
+    """Record calls of a method as '<class>.<method>'."""
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if _record() is not None:
+            # already inside a recorded call
+            return func(self, *args, **kwargs)
+        record = _local.record = {'calls': 1}
+        start = time.time()
+        try:
+            return func(self, *args, **kwargs)
+        except Exception:
+            record['errors'] = 1
+            raise
+        finally:
+            _local.record = None
+            ms = int((time.time() - start) * 1000)
+            record['ms'] = ms
+            record['bucket%d' % _bucket(ms)] = 1
+            _add('%s.%s' % (type(self).__name__, func.__name__), record)
+    return wrapper
+
+
+def _percentile(buckets, calls, fraction):
+    """Return the upper bound of the bucket holding a percentile."""
+    seen = 0
+    for i, count in enumerate(buckets):
+        seen += count
+        if seen >= fraction * calls:
+            return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else None
+    return None
+
+
+def stats():
+    """Return the counts in memcache as a list of dicts, one per name,
+    slowest (by total latency) first."""
+    names = sorted(memcache.get(MEMCACHE_NAMES_KEY) or [])
+    counts = memcache.get_multi([MEMCACHE_COUNT_KEY % (name, field)
+                                 for name in names for field in FIELDS])
+    result = []
+    for name in names:
+        values = dict((field, counts.get(MEMCACHE_COUNT_KEY % (name, field), 0))
+                      for field in FIELDS)
+        calls = values['calls']
+        if not calls:
+            continue
+        buckets = [values['bucket%d' % i] for i in range(len(LATENCY_BUCKETS) + 1)]
+        result.append({
+            'name': name,
+            'calls': calls,
+            'errors': values['errors'],
+            'totalMs': values['ms'],
+            'meanMs': float(values['ms']) / calls,
+            'p50Ms': _percentile(buckets, calls, 0.5),
+            'p95Ms': _percentile(buckets, calls, 0.95),
+            'histogram': buckets,
+            'rpcsPerCall': dict((service, float(values['rpc_%s' % service]) / calls)
+                                for service in SERVICES + ('other',)),
+            'memcacheHitRatio': (float(values['memcacheHits']) / values['memcacheKeys']
+                                 if values['memcacheKeys'] else None),
+        })
+    result.sort(key=lambda entry: -entry['totalMs'])
+    return result
+
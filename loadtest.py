@@ -0,0 +1,651 @@
+#!/usr/bin/env python
+
+"""loadtest.py
+
+Offline load test for ConferenceApi. Runs conference.py and main.py
+in-process against the App Engine SDK service stubs (testbed) instead of a
+deployment: an HR datastore stub enforcing index.yaml and transaction
+conflicts, memcache, a task queue whose push tasks are run against main.app,
+captured mail and a stand-in tokeninfo service. A pool of threads then
+drives the API endpoints and the report gives p50/p95/p99 latency,
+throughput and RPC counts per endpoint.
+
+usage: python loadtest.py --sdk ~/google_appengine [--threads 8]
+           [--requests 2000] [--tasks sync|deferred]
+           [--datastore-file data.sqlite --users N] [--shards N]
+
+"""
+
+import argparse
+import base64
+import collections
+import json
+import os
+import random
+import sys
+import threading
+import time
+import traceback
+import urlparse
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+CITIES = ['London', 'Paris', 'Berlin', 'Chicago', 'Tokyo', 'Sydney']
+TOPICS = ['Cloud', 'Web', 'Mobile', 'Data', 'Security']
+SESSION_TYPES = ['workshop', 'keynotes', 'breakout']
+HIGHLIGHTS = ['intro', 'advanced', 'hands-on', 'demo']
+# vocabulary of generated names and descriptions, for search
+WORDS = ['cloud', 'web', 'mobile', 'data', 'security', 'python', 'java',
+         'scaling', 'design', 'testing', 'performance', 'machine', 'learning',
+         'databases', 'apis', 'frontend', 'backend', 'devops', 'containers',
+         'serverless', 'analytics', 'streaming', 'privacy', 'networks',
+         'games', 'graphics', 'accessibility', 'startups', 'open', 'source']
+# seats.adjustSeats() writes every shard in one cross-group transaction,
+# which may span at most 25 entity groups
+MAX_SHARDS = 25
+
+
+def setupSdk(sdk_path):
+    """Put the App Engine SDK and its bundled libraries on sys.path."""
+    sys.path.insert(0, sdk_path)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    sys.path.insert(0, ROOT)
+
+
+# - - - Stand-in backend - - - - - - - - - - - - - - - - - - - - - -
+
+class ThreadLocalEnviron(dict):
+    """os.environ stand-in with per-thread overrides, the way the python27
+    runtime gives every concurrent request its own environment."""
+
+    def __init__(self, base):
+        dict.__init__(self, base)
+        self._local = threading.local()
+
+    def setThreadValues(self, values):
+        self._local.values = dict(values)
+
+    def _values(self):
+        return getattr(self._local, 'values', None)
+
+    def __getitem__(self, key):
+        values = self._values()
+        if values is not None and key in values:
+            return values[key]
+        return dict.__getitem__(self, key)
+
+    def __contains__(self, key):
+        values = self._values()
+        return (values is not None and key in values) or dict.__contains__(self, key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        values = self._values()
+        if values is not None:
+            values[key] = value
+        else:
+            dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        values = self._values()
+        if values is not None and key in values:
+            del values[key]
+        else:
+            dict.__delitem__(self, key)
+
+    def pop(self, key, *default):
+        values = self._values()
+        if values is not None and key in values:
+            return values.pop(key)
+        return dict.pop(self, key, *default)
+
+
+def makeTokenInfoStub():
+    """Return a urlfetch stub answering tokeninfo lookups: the token is the
+    user id, except tokens starting with 'invalid' which are rejected."""
+    from google.appengine.api import apiproxy_stub
+
+    class TokenInfoStub(apiproxy_stub.APIProxyStub):
+
+        def __init__(self):
+            super(TokenInfoStub, self).__init__('urlfetch')
+
+        def _Dynamic_Fetch(self, request, response):
+            query = urlparse.parse_qs(urlparse.urlparse(request.url()).query)
+            token = (query.get('id_token') or query.get('access_token') or [''])[0]
+            if not token or token.startswith('invalid'):
+                response.set_statuscode(400)
+                response.set_content(json.dumps({'error': 'invalid_token'}))
+            else:
+                response.set_statuscode(200)
+                response.set_content(json.dumps({'user_id': token,
+                                                 'expires_in': 3600}))
+
+    return TokenInfoStub()
+
+
+class StandInBackend(object):
+    """Activates the SDK service stubs and runs queued push tasks."""
+
+    def __init__(self, consistency=1.0, require_indexes=True, datastore_file=None):
+        from google.appengine.api import apiproxy_stub_map
+        from google.appengine.datastore import datastore_stub_util
+        from google.appengine.ext import testbed
+
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.setup_env(app_id='conference-loadtest', overwrite=True)
+        policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=consistency)
+        # with a datastore_file the data persists between runs, e.g. a
+        # dataset written by datagen.py
+        self.testbed.init_datastore_v3_stub(consistency_policy=policy,
+                                            require_indexes=require_indexes,
+                                            root_path=ROOT,
+                                            datastore_file=datastore_file,
+                                            use_sqlite=bool(datastore_file))
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=ROOT)
+        self.testbed.init_mail_stub()
+        self.testbed.init_app_identity_stub()
+        self.testbed.init_user_stub()
+        apiproxy_stub_map.apiproxy.RegisterStub('urlfetch', makeTokenInfoStub())
+
+        self.taskqueue = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        self.mail = self.testbed.get_stub(testbed.MAIL_SERVICE_NAME)
+        self._taskLock = threading.Lock()
+
+    def flushMemcache(self):
+        from google.appengine.api import memcache
+        memcache.flush_all()
+
+    def runTasks(self, run):
+        """Run queued push tasks (and any they queue) against main.app.
+
+        run(label, fn) is called for every task so it can be measured.
+        """
+        import main
+        import webapp2
+
+        with self._taskLock:
+            ran = 0
+            while True:
+                pending = [(queue['name'], task)
+                           for queue in self.taskqueue.GetQueues()
+                           if queue.get('mode', 'push') == 'push'
+                           for task in self.taskqueue.GetTasks(queue['name'])]
+                if not pending:
+                    return ran
+                for queue_name, task in pending:
+                    self.taskqueue.DeleteTask(queue_name, task['name'])
+                    request = webapp2.Request.blank(
+                        task['url'], method=task['method'],
+                        headers=dict(task['headers']),
+                        body=base64.b64decode(task['body']))
+                    run(task['url'].split('?')[0],
+                        lambda: self._checkResponse(request.get_response(main.app)))
+                    ran += 1
+
+    @staticmethod
+    def _checkResponse(response):
+        if response.status_int >= 400:
+            raise RuntimeError('task failed: %s' % response.status)
+        return response
+
+    def deactivate(self):
+        self.testbed.deactivate()
+
+
+# - - - Measurements - - - - - - - - - - - - - - - - - - - - - - - -
+
+# RPC counter of the request running on the current thread
+_current = threading.local()
+
+
+def countRpc(service, call, request, response):
+    """apiproxy pre-call hook counting RPCs by service."""
+    counts = getattr(_current, 'rpcs', None)
+    if counts is not None:
+        counts[service] += 1
+
+
+class Stats(object):
+    """Latencies, outcomes and RPC counts per endpoint."""
+
+    def __init__(self):
+        self.latencies = collections.defaultdict(list)
+        self.rejected = collections.Counter()
+        self.errors = collections.Counter()
+        self.rpcs = collections.defaultdict(collections.Counter)
+        self._lock = threading.Lock()
+
+    def run(self, label, fn):
+        """Run fn() as one request to label, recording how it went."""
+        import endpoints
+        from google.appengine.ext import ndb
+
+        # every request gets a fresh ndb context, as in production
+        ndb.tasklets.set_context(ndb.tasklets.make_default_context())
+        _current.rpcs = rpcs = collections.Counter()
+        start = time.time()
+        outcome = None
+        try:
+            result = fn()
+        except endpoints.ServiceException:
+            result, outcome = None, 'rejected'
+        except Exception:
+            result, outcome = None, 'error'
+            if not self.errors[label]:
+                traceback.print_exc()
+        elapsed = time.time() - start
+        _current.rpcs = None
+
+        with self._lock:
+            self.latencies[label].append(elapsed)
+            self.rpcs[label].update(rpcs)
+            if outcome == 'rejected':
+                self.rejected[label] += 1
+            elif outcome == 'error':
+                self.errors[label] += 1
+        return result
+
+    def report(self, wall_time, out=sys.stdout):
+        def pct(values, q):
+            return values[min(len(values) - 1, int(q * len(values)))] * 1000
+
+        services = sorted(set(s for counts in self.rpcs.values() for s in counts))
+        header = '%-36s %7s %8s %8s %8s %6s %6s' % (
+            'endpoint', 'calls', 'p50 ms', 'p95 ms', 'p99 ms', 'rej', 'err')
+        header += ''.join(' %12s' % s[:12] for s in services)
+        out.write(header + '\n')
+        total = 0
+        for label in sorted(self.latencies):
+            values = sorted(self.latencies[label])
+            total += len(values)
+            line = '%-36s %7d %8.1f %8.1f %8.1f %6d %6d' % (
+                label, len(values), pct(values, 0.50), pct(values, 0.95),
+                pct(values, 0.99), self.rejected[label], self.errors[label])
+            line += ''.join(' %12.1f' % (float(self.rpcs[label][s]) / len(values))
+                            for s in services)
+            out.write(line + '\n')
+        out.write('\n%d requests in %.1fs: %.1f requests/s '
+                  '(RPC columns are calls per request)\n'
+                  % (total, wall_time, total / wall_time if wall_time else 0))
+
+
+# - - - Driving the API - - - - - - - - - - - - - - - - - - - - - - -
+
+class Client(object):
+    """Calls ConferenceApi endpoints in-process as a given user."""
+
+    def __init__(self, environ):
+        self.environ = environ
+
+    def call(self, email, name, **fields):
+        from endpoints import users_id_token
+        from conference import ConferenceApi
+
+        self.environ.setThreadValues({
+            users_id_token._ENV_AUTH_EMAIL: email or '',
+            users_id_token._ENV_AUTH_DOMAIN: 'gmail.com' if email else '',
+        })
+        # a new service instance per request, as endpoints does
+        method = getattr(ConferenceApi(), name)
+        return method(method.remote.request_type(**fields))
+
+
+class Scenario(object):
+    """Seeds conferences and sessions, then issues weighted random calls."""
+
+    def __init__(self, client, rng, organizers, users, conferences, sessions):
+        self.client = client
+        self.rng = rng
+        self.organizers = ['organizer%d@example.com' % i for i in range(organizers)]
+        self.users = ['user%d@example.com' % i for i in range(users)]
+        self.numConferences = conferences
+        self.numSessions = sessions
+        self.conferences = []   # (websafeConferenceKey, organizer email)
+        self.sessions = []      # (websafeSessionKey, websafeConferenceKey)
+        self._lock = threading.Lock()
+
+    def conferenceForm(self, i):
+        month = self.rng.randint(1, 12)
+        return dict(name='Conference %d' % i,
+                    description='Load test conference %d on %s' % (
+                        i, ' '.join(self.rng.sample(WORDS, 4))),
+                    city=self.rng.choice(CITIES),
+                    topics=self.rng.sample(TOPICS, 2),
+                    startDate='2027-%02d-01' % month,
+                    endDate='2027-%02d-03' % month,
+                    maxAttendees=self.rng.choice([10, 50, 200, 1000]))
+
+    def sessionForm(self, wsck):
+        hour = self.rng.randint(8, 20)
+        return dict(websafeConferenceKey=wsck,
+                    name='Session %d: %s' % (self.rng.randint(0, 10 ** 6),
+                                             ' '.join(self.rng.sample(WORDS, 2))),
+                    speaker='Speaker %d' % self.rng.randint(0, 20),
+                    highlights=self.rng.sample(HIGHLIGHTS, 2),
+                    duration=self.rng.choice([30, 45, 60]),
+                    typeOfSession=self.rng.choice(SESSION_TYPES),
+                    startDate='2027-01-01',
+                    startTime='%02d:%02d' % (hour, self.rng.choice([0, 30])))
+
+    def seed(self, run):
+        for i in range(self.numConferences):
+            organizer = self.organizers[i % len(self.organizers)]
+            run('createConference', lambda: self.client.call(
+                organizer, 'createConference', **self.conferenceForm(i)))
+        for organizer in self.organizers:
+            forms = run('getConferencesCreated', lambda: self.client.call(
+                organizer, 'getConferencesCreated'))
+            for conf in forms.items if forms else []:
+                self.conferences.append((conf.websafeKey, organizer))
+        for wsck, organizer in self.conferences:
+            for _ in range(self.numSessions):
+                self.createSession(run, wsck, organizer)
+
+    def load(self, run, sample):
+        """Use a sample of an existing dataset, e.g. one written by
+        datagen.py, instead of seeding."""
+        from models import Conference, Session
+
+        def fetch():
+            keys = Conference.query().fetch(sample, keys_only=True)
+            sessions = Session.query().fetch(sample, projection=[Session.conference])
+            return keys, sessions
+
+        keys, sessions = run('loadDataset', fetch)
+        # conferences are children of their organizer's Profile
+        self.conferences = [(key.urlsafe(), key.parent().id()) for key in keys]
+        self.sessions = [(session.key.urlsafe(), session.conference.urlsafe())
+                         for session in sessions]
+
+    def createSession(self, run, wsck, organizer):
+        form = run('createSession', lambda: self.client.call(
+            organizer, 'createSession', **self.sessionForm(wsck)))
+        if form:
+            with self._lock:
+                self.sessions.append((form.sessionKey, wsck))
+
+    def importForms(self, wsck):
+        """Return IMPORT_SIZE SessionForms for an import into a conference."""
+        from models import SessionForm
+        forms = []
+        for _ in range(self.IMPORT_SIZE):
+            fields = self.sessionForm(wsck)
+            del fields['websafeConferenceKey']
+            forms.append(SessionForm(**fields))
+        return forms
+
+    def importText(self, forms):
+        """Return (format, data) of SessionForms as CSV or NDJSON text."""
+        from protorpc import protojson
+        if self.rng.random() < 0.5:
+            return 'ndjson', '\n'.join(protojson.encode_message(form) for form in forms)
+        lines = [','.join(self.CSV_FIELDS)]
+        for form in forms:
+            lines.append(','.join(
+                ';'.join(form.highlights) if name == 'highlights'
+                else str(getattr(form, name)) for name in self.CSV_FIELDS))
+        return 'csv', '\n'.join(lines)
+
+    def importSessions(self, run, name, wsck, organizer):
+        forms = self.importForms(wsck)
+        if name == 'importSessions':
+            result = run(name, lambda: self.client.call(
+                organizer, name, websafeConferenceKey=wsck, items=forms))
+        else:
+            dataFormat, data = self.importText(forms)
+            result = run(name, lambda: self.client.call(
+                organizer, name, websafeConferenceKey=wsck, format=dataFormat, data=data))
+        if result:
+            with self._lock:
+                self.sessions.extend((form.sessionKey, wsck) for form in result.items)
+
+    def deleteSession(self, run):
+        with self._lock:
+            if not self.sessions:
+                return None
+            wssk, wsck = self.sessions.pop(self.rng.randrange(len(self.sessions)))
+        from google.appengine.ext import ndb
+        # conferences are children of their organizer's Profile
+        organizer = ndb.Key(urlsafe=wsck).parent().id()
+        return run('deleteSession', lambda: self.client.call(
+            organizer, 'deleteSession', websafeSessionKey=wssk))
+
+    def step(self, run):
+        """Issue one weighted random call."""
+        rng = self.rng
+        name = rng.choice(self.WEIGHTED)
+        user = rng.choice(self.users)
+        wsck, organizer = rng.choice(self.conferences)
+        wssk = rng.choice(self.sessions)[0] if self.sessions else None
+        call = self.client.call
+
+        if name == 'createSession':
+            return self.createSession(run, wsck, organizer)
+        if name in ('importSessions', 'importSessionsText'):
+            return self.importSessions(run, name, wsck, organizer)
+        if name == 'deleteSession':
+            return self.deleteSession(run)
+        calls = {
+            'getConference': lambda: call(user, name, websafeConferenceKey=wsck),
+            'queryConferences': lambda: call(user, name, filters=self.filters()),
+            'getConferencesCreated': lambda: call(organizer, name),
+            'updateConference': lambda: call(
+                organizer, name, websafeConferenceKey=wsck,
+                description='Updated %d' % rng.randint(0, 10 ** 6)),
+            'registerForConference': lambda: call(user, name, websafeConferenceKey=wsck),
+            'unregisterFromConference': lambda: call(user, name, websafeConferenceKey=wsck),
+            'getConferencesToAttend': lambda: call(user, name),
+            'getProfile': lambda: call(user, name),
+            'saveProfile': lambda: call(user, name, displayName=user.split('@')[0]),
+            'getConferenceSessions': lambda: call(user, name, websafeConferenceKey=wsck),
+            'getConferenceSessionsByType': lambda: call(
+                user, name, websafeConferenceKey=wsck, sessionType=rng.choice(SESSION_TYPES)),
+            'getSessionsBySpeaker': lambda: call(
+                user, name, speaker='Speaker %d' % rng.randint(0, 20)),
+            'getConferenceSessionsByStartTime': lambda: call(
+                user, name, websafeConferenceKey=wsck, startTime='%02d:00' % rng.randint(8, 20)),
+            'getConferenceSessionsByHighlights': lambda: call(
+                user, name, websafeConferenceKey=wsck, highlights=rng.choice(HIGHLIGHTS)),
+            'getSessionsCustomRequest': lambda: call(
+                user, name, excludeSessionType='workshop', startTime='19:00'),
+            'addSessionToWishlist': lambda: call(user, name, websafeSessionKey=wssk),
+            'getSessionsInWishlist': lambda: call(user, name),
+            'getWishlistSessions': lambda: call(user, name),
+            'getWishlistConflicts': lambda: call(user, name),
+            'getFeaturedSpeaker': lambda: call(user, name, websafeConferenceKey=wsck),
+            'searchConferences': lambda: call(user, name, query=self.searchQuery()),
+            'searchSessions': lambda: call(user, name, query=self.searchQuery()),
+            'getAnnouncement': lambda: call(user, name),
+            'registerGroupForConference': lambda: call(
+                organizer, name, websafeConferenceKey=wsck,
+                attendees=rng.sample(self.users, min(self.GROUP_SIZE, len(self.users)))),
+            'getConferenceAttendees': lambda: call(organizer, name, websafeConferenceKey=wsck),
+            'getCompletions': lambda: call(user, name, **self.completion()),
+            'getConferenceCalendar': lambda: call(user, name, **self.calendarRange()),
+        }
+        return run(name, calls[name])
+
+    def searchQuery(self):
+        return ' '.join(self.rng.sample(WORDS, self.rng.randint(1, 2)))
+
+    def completion(self):
+        field = self.rng.choice(['NAME', 'CITY', 'SPEAKER'])
+        if field == 'NAME':
+            prefix = 'Conference %d' % self.rng.randint(1, 9)
+        elif field == 'CITY':
+            prefix = self.rng.choice(CITIES)[:self.rng.randint(1, 3)]
+        else:
+            prefix = 'Speaker %d' % self.rng.randint(0, 2)
+        return dict(field=field, prefix=prefix)
+
+    def calendarRange(self):
+        rng = self.rng
+        choice = rng.randint(0, 2)
+        if choice == 0:
+            return dict(week='2027-W%02d' % rng.randint(1, 52))
+        month = rng.randint(1, 12)
+        if choice == 1:
+            day = rng.randint(1, 28)
+            return dict(startDate='2027-%02d-%02d' % (month, day))
+        return dict(startDate='2027-%02d-01' % month,
+                    endDate='2027-%02d-28' % min(month + 2, 12))
+
+    def filters(self):
+        from models import ConferenceQueryForm
+        rng = self.rng
+        choice = rng.randint(0, 3)
+        if choice == 0:
+            return []
+        if choice == 1:
+            return [ConferenceQueryForm(field='CITY', operator='EQ', value=rng.choice(CITIES))]
+        if choice == 2:
+            return [ConferenceQueryForm(field='MONTH', operator='EQ', value=str(rng.randint(1, 12)))]
+        return [ConferenceQueryForm(field='TOPIC', operator='EQ', value=rng.choice(TOPICS)),
+                ConferenceQueryForm(field='MAX_ATTENDEES', operator='GT', value='20')]
+
+    IMPORT_SIZE = 20        # sessions per importSessions(Text) call
+    GROUP_SIZE = 10         # attendees per registerGroupForConference call
+    CSV_FIELDS = ('name', 'speaker', 'highlights', 'duration', 'typeOfSession',
+                  'startDate', 'startTime')
+
+    # endpoint name -> relative weight of the call mix
+    MIX = {
+        'getConference': 10, 'queryConferences': 10, 'getConferencesCreated': 2,
+        'updateConference': 1, 'registerForConference': 8,
+        'unregisterFromConference': 3, 'getConferencesToAttend': 4,
+        'getProfile': 3, 'saveProfile': 1, 'createSession': 2,
+        'getConferenceSessions': 6, 'getConferenceSessionsByType': 2,
+        'getSessionsBySpeaker': 2, 'getConferenceSessionsByStartTime': 2,
+        'getConferenceSessionsByHighlights': 2, 'getSessionsCustomRequest': 2,
+        'addSessionToWishlist': 3, 'getSessionsInWishlist': 2,
+        'getWishlistSessions': 2, 'getFeaturedSpeaker': 2, 'getAnnouncement': 3,
+        'searchConferences': 3, 'searchSessions': 3, 'getWishlistConflicts': 2,
+        'importSessions': 1, 'importSessionsText': 1,
+        'registerGroupForConference': 1, 'getConferenceAttendees': 1,
+        'getCompletions': 4, 'getConferenceCalendar': 3, 'deleteSession': 1,
+    }
+    WEIGHTED = [name for name, weight in sorted(MIX.items()) for _ in range(weight)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sdk', required=True, help='App Engine Python SDK directory')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=2000, help='calls after seeding')
+    parser.add_argument('--organizers', type=int, default=5)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--conferences', type=int, default=50)
+    parser.add_argument('--sessions', type=int, default=5, help='per conference')
+    parser.add_argument('--tasks', choices=['sync', 'deferred'], default='sync',
+                        help='run push tasks after every call, or in the background')
+    parser.add_argument('--consistency', type=float, default=1.0,
+                        help='HR datastore stub probability of applying a write at once')
+    parser.add_argument('--memcache-flush-every', type=int, default=0,
+                        help='flush memcache every N calls to exercise cache misses')
+    parser.add_argument('--datastore-file',
+                        help='load test an existing dataset (see datagen.py) '
+                             'instead of seeding one; it is modified in place')
+    parser.add_argument('--sample', type=int, default=10000,
+                        help='conferences and sessions of the dataset to use')
+    parser.add_argument('--shards', type=int,
+                        help='seat shards per conference, 1 to %d (default '
+                             'seats.NUM_SHARDS); a dataset must have been written '
+                             'with the same count' % MAX_SHARDS)
+    parser.add_argument('--no-require-indexes', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    if args.shards is not None and not 1 <= args.shards <= MAX_SHARDS:
+        parser.error('--shards must be between 1 and %d' % MAX_SHARDS)
+
+    setupSdk(args.sdk)
+    import seats
+    if args.shards:
+        seats.NUM_SHARDS = args.shards
+    backend = StandInBackend(consistency=args.consistency,
+                             require_indexes=not args.no_require_indexes,
+                             datastore_file=args.datastore_file)
+    environ = os.environ = ThreadLocalEnviron(os.environ)
+    from google.appengine.api import apiproxy_stub_map
+    apiproxy_stub_map.apiproxy.GetPreCallHooks().Append('loadtest', countRpc)
+
+    scenario = Scenario(Client(environ), random.Random(args.seed), args.organizers,
+                        args.users, args.conferences, args.sessions)
+
+    def runner(stats, tasks):
+        """Return run(label, fn) recording into stats, optionally running
+        the tasks queued by each call right after it."""
+        def run(label, fn):
+            result = stats.run(label, fn)
+            if tasks == 'sync':
+                environ.setThreadValues({})
+                backend.runTasks(stats.run)
+            return result
+        return run
+
+    seedStats = Stats()
+    start = time.time()
+    if args.datastore_file:
+        scenario.load(runner(seedStats, 'sync'), args.sample)
+    else:
+        scenario.seed(runner(seedStats, 'sync'))
+    seed_time = time.time() - start
+
+    stats = Stats()
+    run = runner(stats, args.tasks)
+    remaining = [args.requests]
+    counterLock = threading.Lock()
+    done = threading.Event()
+
+    def worker():
+        while True:
+            with counterLock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+                n = remaining[0]
+            if args.memcache_flush_every and n % args.memcache_flush_every == 0:
+                backend.flushMemcache()
+            scenario.step(run)
+
+    def taskRunner():
+        environ.setThreadValues({})
+        while not done.wait(0.5):
+            backend.runTasks(stats.run)
+
+    workers = [threading.Thread(target=worker) for _ in range(args.threads)]
+    others = [threading.Thread(target=taskRunner)] if args.tasks == 'deferred' else []
+    start = time.time()
+    for thread in workers + others:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    done.set()
+    for thread in others:
+        thread.join()
+    environ.setThreadValues({})
+    backend.runTasks(stats.run)
+    wall_time = time.time() - start
+
+    sys.stdout.write('Seeding\n\n')
+    seedStats.report(seed_time)
+    sys.stdout.write('\nLoad (%d threads, %s tasks, %d seat shards)\n\n'
+                     % (args.threads, args.tasks, seats.NUM_SHARDS))
+    stats.report(wall_time)
+    sys.stdout.write('%d conferences, %d sessions used; %d mails captured\n'
+                     % (len(scenario.conferences), len(scenario.sessions),
+                        len(backend.mail.get_sent_messages())))
+    backend.deactivate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+"""mailqueue.py
+
+Confirmation mails through a pull queue. Each notification is a pull task
+named after its conference (so it is never queued twice) and tagged with
+its recipient. A worker, started by a push task named after a KICK_WINDOW
+time window (so there is one per window however many notifications came
+in), leases a recipient's notifications together and sends them as one
+mail rendered from templates/email.
+
+Sending is retried in place a few times, then the recipient's tasks are
+leased for an exponentially growing delay and a worker is kicked for when
+it runs out. Sent tasks are marked in memcache before they are deleted,
+so a failed delete does not mail them again.
+
+"""
+
+import json
+import logging
+import os
+import string
+import time
+
+from google.appengine.api import app_identity
+from google.appengine.api import mail
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+
+MAIL_QUEUE = 'mail'
+LEASE_SECONDS = 60
+# most a lease may take
+MAX_TASKS = 1000
+KICK_WINDOW = 30        # seconds
+WORKER_BUDGET = 300     # seconds
+SEND_ATTEMPTS = 3
+BACKOFF_BASE = 30       # seconds
+MAX_BACKOFF = 3600      # seconds
+MAX_RETRIES = 10
+MEMCACHE_SENT_PREFIX = "MAIL_SENT_"
+SENT_TTL = 86400
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), 'templates', 'email')
+
+
+def _template(name):
+    with open(os.path.join(TEMPLATE_DIR, name)) as f:
+        return string.Template(f.read())
+
+CONFIRMATION = _template('confirmation.txt')
+CONFIRMATION_ITEM = _template('confirmation_item.txt')
+
+
+def _kick(eta):
+    """Make sure a worker runs after eta (seconds since the epoch)."""
+    window = int(eta) // KICK_WINDOW + 1
+    try:
+        taskqueue.add(name='send-mail-%d' % window, url='/tasks/send_mail',
+                      countdown=max(0, window * KICK_WINDOW - time.time()))
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def queueConfirmation(email, websafeKey, conference):
+    """Queue the mail confirming a new conference to its organizer;
+    conference is a dict of the fields shown in it."""
+    task = taskqueue.Task(name='confirm-%s' % websafeKey, method='PULL',
+                          payload=json.dumps(conference),
+                          tag=email.encode('utf-8'))
+    try:
+        taskqueue.Queue(MAIL_QUEUE).add(task)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        return
+    _kick(time.time())
+
+
+def _render(conferences):
+    """Return (subject, body) of the mail for one or more conferences."""
+    items = []
+    for conf in conferences:
+        items.append(CONFIRMATION_ITEM.substitute(
+            name=conf.get('name') or '-',
+            city=conf.get('city') or '-',
+            startDate=(conf.get('startDate') or '-')[:10],
+            endDate=(conf.get('endDate') or '-')[:10],
+            topics=', '.join(conf.get('topics') or []) or '-',
+            maxAttendees=conf.get('maxAttendees') or '-'))
+    if len(conferences) == 1:
+        subject, what = 'You created a new Conference!', 'conference'
+    else:
+        subject = 'You created %d new Conferences!' % len(conferences)
+        what = '%d conferences' % len(conferences)
+    return subject, CONFIRMATION.substitute(what=what, conferences='\n'.join(items))
+
+
+def _send(recipient, subject, body):
+    """Send a mail, retrying with exponential backoff."""
+    for attempt in range(SEND_ATTEMPTS):
+        try:
+            mail.send_mail('noreply@%s.appspotmail.com' % (
+                               app_identity.get_application_id()),
+                           recipient, subject, body)
+            return
+        except mail.InvalidEmailError:
+            raise
+        except Exception:
+            if attempt == SEND_ATTEMPTS - 1:
+                raise
+            time.sleep(2 ** attempt)
+
+
+def _sendTasks(queue, tasks):
+    """Send one mail for a recipient's leased tasks, then delete them."""
+    recipient = tasks[0].tag
+    sent = memcache.get_multi([task.name for task in tasks],
+                              key_prefix=MEMCACHE_SENT_PREFIX)
+    pending = [task for task in tasks if task.name not in sent]
+    conferences = {}
+    for task in pending:
+        conferences[task.name] = json.loads(task.payload)
+
+    if conferences:
+        try:
+            _send(recipient, *_render([conferences[name] for name in sorted(conferences)]))
+        except mail.InvalidEmailError:
+            logging.warning('Dropping mail to invalid address %r', recipient)
+        except Exception:
+            retries = max(task.retry_count for task in pending)
+            if retries < MAX_RETRIES:
+                delay = min(BACKOFF_BASE * 2 ** retries, MAX_BACKOFF)
+                logging.warning('Mail to %r failed, retrying in %ds',
+                                recipient, delay, exc_info=True)
+                for task in pending:
+                    queue.modify_task_lease(task, delay)
+                _kick(time.time() + delay)
+                return
+            logging.error('Giving up on mail to %r', recipient, exc_info=True)
+        else:
+            memcache.set_multi(dict((task.name, 1) for task in pending),
+                               key_prefix=MEMCACHE_SENT_PREFIX, time=SENT_TTL)
+    queue.delete_tasks(tasks)
+
+
+def sendPending():
+    """Send queued mails, one recipient at a time, for up to
+    WORKER_BUDGET seconds."""
+    queue = taskqueue.Queue(MAIL_QUEUE)
+    deadline = time.time() + WORKER_BUDGET
+    while time.time() < deadline:
+        # with no tag given, leases the tasks sharing the first task's tag
+        tasks = queue.lease_tasks_by_tag(LEASE_SECONDS, MAX_TASKS)
+        if not tasks:
+            return
+        _sendTasks(queue, tasks)
+    # out of time with tasks possibly left
+    _kick(time.time())
@@ -12,20 +12,33 @@ created by wesc on 2014 may 24
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
+import cgi
+import json
 import webapp2
 from google.appengine.api import app_identity
 from google.appengine.api import mail
 MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
+from google.appengine.ext import ndb
 from conference import ConferenceApi
+import autocomplete
+import backfill
+import instrument
+import mailqueue
+import querycache
+import textsearch
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
+    @instrument.timed
     def get(self):
-        """Set Announcement in Memcache."""
-        ConferenceApi._cacheAnnouncement()
+        """Start repairing the nearly sold out set behind the Announcement,
+        a batch of conferences per task."""
+        backfill.start('nearly-sold-out')
 
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
+    @instrument.timed
     def post(self):
-        """Send email confirming Conference creation."""
+        """Send email confirming Conference creation (for tasks queued
+        before confirmations went through the mail queue)."""
         mail.send_mail(
             'noreply@%s.appspotmail.com' % (
                 app_identity.get_application_id()),     # from
@@ -37,13 +50,107 @@ class SendConfirmationEmailHandler(webapp2.RequestHandler):
         )
 
 class SetFeaturedSpeakerHandler(webapp2.RequestHandler):
+    @instrument.timed
     def post(self):
         """Set Featured Speaker in Memcache"""
-        ConferenceApi._setFeaturedSpeaker(self.request.get('speaker'),
-                                          self.request.get('websafeConferenceKey'))
+        ConferenceApi._setFeaturedSpeaker(self.request.get('websafeConferenceKey'))
+
+class PruneWishlistHandler(webapp2.RequestHandler):
+    @instrument.timed
+    def post(self):
+        """Remove stale session keys from a user's wishlist."""
+        ConferenceApi._pruneWishlist(self.request.get('userId'),
+                                     self.request.get_all('websafeSessionKey'))
+
+class IndexDocumentsHandler(webapp2.RequestHandler):
+    @instrument.timed
+    def post(self):
+        """Update the search index for written or deleted documents."""
+        textsearch.indexDocuments([ndb.Key(urlsafe=wsk)
+                                   for wsk in self.request.get('keys').split()])
+
+class AdjustCompletionsHandler(webapp2.RequestHandler):
+    @instrument.timed
+    def post(self):
+        """Apply queued changes to the autocomplete counts."""
+        autocomplete.adjust(json.loads(self.request.get('changes')))
+
+class SendMailHandler(webapp2.RequestHandler):
+    @instrument.timed
+    def post(self):
+        """Send the mails waiting in the mail queue."""
+        mailqueue.sendPending()
+
+class BackfillHandler(webapp2.RequestHandler):
+    @instrument.timed
+    def post(self):
+        """Run one batch of a backfill job."""
+        backfill.runBatch(self.request.get('job'), self.request.get('run'),
+                          self.request.get('cursor'))
+
+class StartBackfillHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start a backfill job (?job=name)."""
+        name = self.request.get('job')
+        if name not in backfill.JOBS:
+            self.response.set_status(400)
+            self.response.write('Unknown job; one of: %s' % cgi.escape(
+                ', '.join(sorted(backfill.JOBS))))
+            return
+        backfill.start(name)
+        self.response.write('Started %s' % cgi.escape(name))
+
+class QueryCacheStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Report queryConferences result cache hits and misses."""
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(querycache.stats()))
+
+class StatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Show latency and RPC counts per endpoint and handler."""
+        entries = instrument.stats()
+        if self.request.get('format') == 'json':
+            self.response.headers['Content-Type'] = 'application/json'
+            self.response.write(json.dumps({'endpoints': entries,
+                                            'queryCache': querycache.stats()}))
+            return
+
+        def number(value, fmt='%.1f'):
+            return '-' if value is None else fmt % value
+        rows = []
+        for e in entries:
+            rows.append('<tr><td>%s</td><td>%d</td><td>%d</td><td>%s</td>'
+                        '<td>%s</td><td>%s</td>%s<td>%s</td></tr>' % (
+                cgi.escape(e['name']), e['calls'], e['errors'], number(e['meanMs']),
+                number(e['p50Ms'], '%d'), number(e['p95Ms'], '%d'),
+                ''.join('<td>%.2f</td>' % e['rpcsPerCall'][service]
+                        for service in instrument.SERVICES + ('other',)),
+                number(e['memcacheHitRatio'], '%.2f')))
+        self.response.write(
+            '<html><head><title>Stats</title></head><body>'
+            '<h1>Endpoints and handlers</h1><table border="1">'
+            '<tr><th>name</th><th>calls</th><th>errors</th><th>mean ms</th>'
+            '<th>p50 ms</th><th>p95 ms</th>%s<th>memcache hit ratio</th></tr>'
+            '%s</table><p>p50 and p95 are histogram bucket bounds (%s ms); '
+            '- means above the last bound.</p>'
+            '<h1>queryConferences cache</h1><pre>%s</pre></body></html>' % (
+                ''.join('<th>%s per call</th>' % service
+                        for service in instrument.SERVICES + ('other',)),
+                ''.join(rows),
+                ', '.join(str(b) for b in instrument.LATENCY_BUCKETS),
+                cgi.escape(json.dumps(querycache.stats()))))
 
 app = webapp2.WSGIApplication([
     ('/crons/set_announcement', SetAnnouncementHandler),
     ('/tasks/set_featured_speaker', SetFeaturedSpeakerHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
+    ('/tasks/send_mail', SendMailHandler),
+    ('/tasks/prune_wishlist', PruneWishlistHandler),
+    ('/tasks/index_documents', IndexDocumentsHandler),
+    ('/tasks/adjust_completions', AdjustCompletionsHandler),
+    ('/admin/query_cache_stats', QueryCacheStatsHandler),
+    ('/admin/stats', StatsHandler),
+    ('/tasks/backfill', BackfillHandler),
+    ('/admin/backfill', StartBackfillHandler),
 ], debug=True)
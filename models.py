@@ -17,6 +17,8 @@ import endpoints
 from protorpc import messages
 from google.appengine.ext import ndb
 
+import buckets
+
 class ConflictException(endpoints.ServiceException):
     """ConflictException -- exception mapped to HTTP 409 response"""
     http_status = httplib.CONFLICT
@@ -26,9 +28,19 @@ class Profile(ndb.Model):
     displayName = ndb.StringProperty()
     mainEmail = ndb.StringProperty()
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
+    # registrations made before Registration entities, until migrated
     conferenceKeysToAttend = ndb.StringProperty(repeated=True)
     sessionWishlist = ndb.StringProperty(repeated=True)
 
+    # read through memcache on get(), invalidated by ndb on put()
+    _use_memcache = True
+
+class Registration(ndb.Model):
+    """Registration -- a Profile (the parent) attending a Conference,
+    keyed by the conference's websafe key"""
+    conference      = ndb.KeyProperty(kind='Conference')
+    registeredAt    = ndb.DateTimeProperty(auto_now_add=True)
+
 class ProfileMiniForm(messages.Message):
     """ProfileMiniForm -- update Profile form message"""
     displayName = messages.StringField(1)
@@ -58,6 +70,20 @@ class Conference(ndb.Model):
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    # date buckets for calendar queries, kept up to date on every put
+    days            = ndb.ComputedProperty(lambda self: buckets.days(self.startDate, self.endDate), repeated=True)
+    weeks           = ndb.ComputedProperty(lambda self: buckets.weeks(self.startDate, self.endDate), repeated=True)
+    yearMonths      = ndb.ComputedProperty(lambda self: buckets.months(self.startDate, self.endDate), repeated=True)
+
+class SeatShard(ndb.Model):
+    """SeatShard -- one slice of a Conference's available seats"""
+    seats           = ndb.IntegerProperty(default=0, indexed=False)
+
+class NearlySoldOutEntry(ndb.Model):
+    """NearlySoldOutEntry -- a Conference with only a few seats left, keyed by its websafe key"""
+    conference      = ndb.KeyProperty(kind='Conference')
+    name            = ndb.StringProperty(indexed=False)
+    seatsAvailable  = ndb.IntegerProperty()
 
 class ConferenceForm(messages.Message):
     """ConferenceForm -- Conference outbound form message"""
@@ -73,6 +99,8 @@ class ConferenceForm(messages.Message):
     endDate         = messages.StringField(10) #DateTimeField()
     websafeKey      = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
+    etag            = messages.StringField(13)
+    notModified     = messages.BooleanField(14)
 
 
 class Session(ndb.Model):
@@ -100,13 +128,15 @@ class SessionForm(messages.Message):
     startDate       = messages.StringField(6) #DateField()
     startTime       = messages.StringField(7) #TimeField()
     sessionKey      = messages.StringField(8)
+    conference      = messages.StringField(9) # websafe Conference key
 
-class Speaker(ndb.Model):
-    """Speaker -- Speaker object"""
+class ConferenceSpeaker(ndb.Model):
+    """ConferenceSpeaker -- a Speaker's sessions in one Conference (child of the Conference),
+    keyed by normalized speaker name"""
     speakerName     = ndb.StringProperty(required=True)
-    email           = ndb.StringProperty()
-    apeakerSess     = ndb.StringProperty(repeated=True)
-    speakerKey      = ndb.StringProperty()
+    speakerId       = ndb.ComputedProperty(lambda self: self.key.id() if self.key else None)
+    speakerSess     = ndb.KeyProperty(kind='Session', repeated=True)
+    sessionCount    = ndb.IntegerProperty(default=0)
 
 class SpeakerForm(messages.Message):
     """SpeakerForm -- Speaker outbound form message"""
@@ -119,10 +149,95 @@ class SpeakerForm(messages.Message):
 class SessionForms(messages.Message):
     """SessionForms -- multiple Sessions outbound form message"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
+    nextCursor = messages.StringField(2)
+    etag = messages.StringField(3)
+    notModified = messages.BooleanField(4)
+
+class SessionImportForm(messages.Message):
+    """SessionImportForm -- inbound sessions as CSV (header row first) or NDJSON text"""
+    format          = messages.StringField(1)
+    data            = messages.StringField(2)
+
+class GroupRegistrationForm(messages.Message):
+    """GroupRegistrationForm -- inbound emails of attendees to register together"""
+    attendees       = messages.StringField(1, repeated=True)
+
+class RegistrationStatus(messages.Enum):
+    """RegistrationStatus -- outcome of one attendee's group registration"""
+    REGISTERED = 1
+    ALREADY_REGISTERED = 2
+    INVALID_EMAIL = 3
+
+class AttendeeRegistrationForm(messages.Message):
+    """AttendeeRegistrationForm -- outbound outcome for one attendee"""
+    email           = messages.StringField(1)
+    status          = messages.EnumField('RegistrationStatus', 2)
+
+class AttendeeRegistrationForms(messages.Message):
+    """AttendeeRegistrationForms -- outbound outcomes of a group registration"""
+    items           = messages.MessageField(AttendeeRegistrationForm, 1, repeated=True)
+    seatsAvailable  = messages.IntegerField(2)
+
+class RosterForm(messages.Message):
+    """RosterForm -- outbound page of the user ids attending a conference"""
+    attendees       = messages.StringField(1, repeated=True)
+    nextCursor      = messages.StringField(2)
+
+class SearchPostings(ndb.Model):
+    """SearchPostings -- one block (weight band and shard) of a search term's postings, {websafe document key: weight}"""
+    postings        = ndb.JsonProperty(compressed=True)
+
+class CommonTerm(ndb.Model):
+    """CommonTerm -- marks a search term in too many documents to index, keyed kind:term"""
+
+class SearchDocument(ndb.Model):
+    """SearchDocument -- search terms a document is indexed under, keyed by its websafe key"""
+    terms           = ndb.JsonProperty(compressed=True)
+
+class Completion(ndb.Model):
+    """Completion -- an autocomplete value of a field, with the prefixes it completes"""
+    field           = ndb.StringProperty()
+    value           = ndb.StringProperty(indexed=False)
+    prefixes        = ndb.StringProperty(repeated=True)
+    count           = ndb.IntegerProperty()
+
+class CompletionForm(messages.Message):
+    """CompletionForm -- outbound autocomplete value and how often it is used"""
+    value           = messages.StringField(1)
+    count           = messages.IntegerField(2)
+
+class CompletionForms(messages.Message):
+    """CompletionForms -- multiple CompletionForm outbound form message"""
+    items           = messages.MessageField(CompletionForm, 1, repeated=True)
+
+class WishlistForms(messages.Message):
+    """WishlistForms -- wishlisted Sessions and their Conferences outbound form message"""
+    sessions = messages.MessageField(SessionForm, 1, repeated=True)
+    conferences = messages.MessageField(ConferenceForm, 2, repeated=True)
+
+class ConflictGroupForm(messages.Message):
+    """ConflictGroupForm -- outbound wishlist sessions whose times overlap"""
+    startTime = messages.StringField(1)     # of the earliest session, '%Y-%m-%d %H:%M'
+    endTime = messages.StringField(2)       # of the latest ending session
+    sessions = messages.StringField(3, repeated=True)   # websafe Session keys
+
+class ConflictGroupForms(messages.Message):
+    """ConflictGroupForms -- multiple ConflictGroupForm outbound form message"""
+    items = messages.MessageField(ConflictGroupForm, 1, repeated=True)
+
+class QueryPlanForm(messages.Message):
+    """QueryPlanForm -- outbound plan chosen for a Conference query"""
+    datastoreFilters = messages.StringField(1, repeated=True)
+    postFilters = messages.StringField(2, repeated=True)
+    order = messages.StringField(3, repeated=True)
+    estimatedCost = messages.IntegerField(4)    # conferences expected to be read
+    candidates = messages.StringField(5, repeated=True)
 
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextCursor = messages.StringField(2)
+    plan = messages.MessageField(QueryPlanForm, 3)
 
 class TeeShirtSize(messages.Enum):
     """TeeShirtSize -- t-shirt size enumeration value"""
@@ -151,6 +266,9 @@ class ConferenceQueryForm(messages.Message):
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2)
+    cursor = messages.StringField(3)
+    explain = messages.BooleanField(4)  # return the query plan instead of results
 
 class StringMessage(messages.Message):
     """StringMessage-- outbound (single) string message"""
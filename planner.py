@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+"""planner.py
+
+Query planner for queryConferences. Of the submitted filters only one
+"driver" is run in the datastore: a single equality filter, or the range
+filters of a single field, each needing just a (field, name) index. The
+driver expected to scan the fewest conferences is picked, using counts
+over the built-in indexes cached in memcache. All other filters, including
+inequalities on further fields and !=, are applied in memory to the
+streamed results.
+
+"""
+
+import hashlib
+import operator
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import Conference
+
+ESTIMATE_LIMIT = 1000       # count at most this far when estimating
+ESTIMATE_TTL = 600
+MEMCACHE_ESTIMATE_KEY = "QUERY_ESTIMATE_%s"
+MAX_SCAN = 1000             # conferences read per page at most
+
+COMPARE = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+RANGE_OPERATORS = ('<', '<=', '>', '>=')
+
+
+class Predicate(object):
+    """One filter on a Conference property."""
+
+    def __init__(self, field, op, value):
+        self.field = field
+        self.op = op
+        self.value = value
+
+    def matches(self, conf):
+        """Apply the filter with datastore semantics: a repeated property
+        matches if any of its values does, a missing one never does."""
+        value = getattr(conf, self.field)
+        values = value if isinstance(value, list) else [value]
+        return any(v is not None and COMPARE[self.op](v, self.value)
+                   for v in values)
+
+    def node(self):
+        return ndb.query.FilterNode(self.field, self.op, self.value)
+
+    def __str__(self):
+        return '%s %s %r' % (self.field, self.op, self.value)
+
+
+class Plan(object):
+    """Filters to run in the datastore (the driver) and in memory."""
+
+    def __init__(self, number, driver, predicates, estimate=None, candidates=()):
+        self.number = number
+        self.driver = driver
+        self.postFilters = [p for p in predicates if p not in driver]
+        self.estimate = estimate
+        self.candidates = candidates
+
+    def order(self):
+        """Sort order: a range driver must sort on its field first."""
+        order = ['name', '__key__']
+        if self.driver and self.driver[0].op in RANGE_OPERATORS:
+            order.insert(0, self.driver[0].field)
+        return order
+
+    def query(self):
+        q = Conference.query()
+        for predicate in self.driver:
+            q = q.filter(predicate.node())
+        # order by key last so page cursors are stable
+        for field in self.order():
+            q = q.order(Conference.key if field == '__key__'
+                        else ndb.GenericProperty(field))
+        return q
+
+    def matches(self, conf):
+        return all(predicate.matches(conf) for predicate in self.postFilters)
+
+
+def canonicalOrder(predicates):
+    """Return predicates sorted the same however they were submitted."""
+    return sorted(predicates, key=lambda p: (p.field, p.op, repr(p.value)))
+
+
+def _candidates(predicates):
+    """List the possible drivers: a full scan, then each equality filter
+    and the range filters of each field, in the canonical order of the
+    filters. The order does not depend on how the filters were submitted,
+    as a plan's number in a page cursor indexes this list and cached pages
+    are shared by every order of the same filters."""
+    candidates = [[]]
+    ranges = {}
+    for predicate in canonicalOrder(predicates):
+        if predicate.op == '=':
+            candidates.append([predicate])
+        elif predicate.op in RANGE_OPERATORS:
+            if predicate.field not in ranges:
+                ranges[predicate.field] = []
+                candidates.append(ranges[predicate.field])
+            ranges[predicate.field].append(predicate)
+    return candidates
+
+
+def _estimate(candidates):
+    """Estimate the conferences each candidate driver would scan, counting
+    (in parallel, up to ESTIMATE_LIMIT) those not cached."""
+    cache_keys = [MEMCACHE_ESTIMATE_KEY % hashlib.sha1(
+        repr(sorted(str(p) for p in driver))).hexdigest() for driver in candidates]
+    cached = memcache.get_multi(cache_keys)
+
+    counts = {}
+    for cache_key, driver in zip(cache_keys, candidates):
+        if cache_key not in cached:
+            q = Conference.query()
+            for predicate in driver:
+                q = q.filter(predicate.node())
+            counts[cache_key] = q.count_async(limit=ESTIMATE_LIMIT)
+    fresh = dict((cache_key, future.get_result())
+                 for cache_key, future in counts.items())
+    if fresh:
+        memcache.set_multi(fresh, time=ESTIMATE_TTL)
+    cached.update(fresh)
+    return [cached[cache_key] for cache_key in cache_keys]
+
+
+def plan(predicates, number=None):
+    """Pick the driver expected to scan the fewest conferences, preferring
+    equality (results stay sorted by name) over range on a tie. With a
+    number (from a page cursor) that candidate is used without estimating.
+    """
+    candidates = _candidates(predicates)
+    if number is not None:
+        if not 0 <= number < len(candidates):
+            raise ValueError('no such plan: %d' % number)
+        return Plan(number, candidates[number], predicates)
+
+    estimates = _estimate(candidates)
+    number = min(range(len(candidates)), key=lambda i: (
+        estimates[i], not candidates[i],
+        any(p.op in RANGE_OPERATORS for p in candidates[i])))
+    return Plan(number, candidates[number], predicates, estimates[number],
+                zip(candidates, estimates))
+
+
+def run(chosen, pageSize, cursor=None):
+    """Stream the plan's query, post-filtering, until pageSize conferences
+    match or MAX_SCAN have been read.
+
+    Returns (conferences, cursor to continue from, or None when done).
+    """
+    it = chosen.query().iter(start_cursor=cursor, produce_cursors=True,
+                             batch_size=min(pageSize * 2, MAX_SCAN))
+    conferences = []
+    scanned = 0
+    for conf in it:
+        scanned += 1
+        if chosen.matches(conf):
+            conferences.append(conf)
+        if len(conferences) == pageSize or scanned == MAX_SCAN:
+            break
+    else:
+        return conferences, None
+    return conferences, it.cursor_after() if it.probably_has_next() else None
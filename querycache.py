@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+"""querycache.py
+
+Result cache for queryConferences. A page is cached as the list of its
+conference keys plus the cursor for the next page, under a canonical form
+of the filters (sorted, with typed values), the page size and the cursor.
+Entries carry the generation they were made at; one global generation is
+replaced by bumpGeneration() whenever a conference is created or changed,
+which makes every cached page stale at once.
+
+Generations are versions from responsecache, so one lost to memcache
+eviction is never reused, and pages are not cached until SETTLE_TIME after
+a bump as conference queries are eventually consistent. Hit and miss
+counts are kept in memcache; see stats().
+
+"""
+
+import hashlib
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+import planner
+import responsecache
+
+MEMCACHE_GENERATION_KEY = "QUERY_GENERATION"
+MEMCACHE_PAGE_KEY = "QUERY_PAGE_%s"
+MEMCACHE_HITS_KEY = "QUERY_CACHE_HITS"
+MEMCACHE_MISSES_KEY = "QUERY_CACHE_MISSES"
+PAGE_TTL = 3600
+
+
+def bumpGeneration():
+    """Make every cached page stale."""
+    memcache.set(MEMCACHE_GENERATION_KEY, responsecache.newVersion())
+
+
+def canonical(predicates, pageSize, cursor):
+    """Return the cache key of a page; filters given in any order (or
+    with values spelled differently, e.g. '10' and '010') share it."""
+    filters = [(p.field, p.op, repr(p.value)) for p in planner.canonicalOrder(predicates)]
+    return MEMCACHE_PAGE_KEY % hashlib.sha1(
+        repr((filters, pageSize, cursor or None))).hexdigest()
+
+
+def getPage(predicates, pageSize, cursor, run):
+    """Return (conferences, next cursor) of a page, from the cache if it
+    is current, else from run() (which must return the same)."""
+    page_key = canonical(predicates, pageSize, cursor)
+    cached = memcache.get_multi([MEMCACHE_GENERATION_KEY, page_key])
+    generation = cached.get(MEMCACHE_GENERATION_KEY)
+    if generation is None:
+        generation = responsecache.newVersion()
+        if not memcache.add(MEMCACHE_GENERATION_KEY, generation):
+            generation = memcache.get(MEMCACHE_GENERATION_KEY) or generation
+
+    entry = cached.get(page_key)
+    if entry and entry[0] == generation:
+        memcache.incr(MEMCACHE_HITS_KEY, initial_value=0)
+        conferences = ndb.get_multi([ndb.Key(urlsafe=wsck) for wsck in entry[1]])
+        return [conf for conf in conferences if conf], entry[2]
+
+    memcache.incr(MEMCACHE_MISSES_KEY, initial_value=0)
+    conferences, next_cursor = run()
+    if responsecache.settled(generation):
+        memcache.set(page_key, (generation, [conf.key.urlsafe() for conf in conferences],
+                                next_cursor), time=PAGE_TTL)
+    return conferences, next_cursor
+
+
+def stats():
+    """Return the hit and miss counts and the hit rate."""
+    counts = memcache.get_multi([MEMCACHE_HITS_KEY, MEMCACHE_MISSES_KEY])
+    hits = counts.get(MEMCACHE_HITS_KEY, 0)
+    misses = counts.get(MEMCACHE_MISSES_KEY, 0)
+    return {'hits': hits, 'misses': misses,
+            'hitRate': float(hits) / (hits + misses) if hits + misses else None}
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+"""responsecache.py
+
+Versioned response cache for per-conference reads. Each conference has a
+version in memcache, replaced by bumpVersions() whenever something shown
+by its responses changes (the conference, its sessions, its seats). A
+response is cached with the version it was built at and carries that
+version as its ETag, so a client sending a matching If-None-Match gets
+an empty reply after a single memcache read. Endpoints can neither send a
+304 nor set response headers, so the ETag is the response's etag field
+and the empty reply has notModified set.
+
+Versions are a timestamp plus a random part rather than a counter, so a
+version lost to memcache eviction is never reused for other content.
+Responses are not cached (or given an ETag) until SETTLE_TIME after a
+bump, as session queries are eventually consistent and could still
+return what was there before the write.
+
+"""
+
+import random
+import time
+
+from google.appengine.api import memcache
+from protorpc import protojson
+
+MEMCACHE_VERSION_KEY = "CONF_VERSION_%s"
+MEMCACHE_RESPONSE_KEY = "CONF_RESPONSE_%s_%s"
+RESPONSE_TTL = 3600
+SETTLE_TIME = 5     # seconds
+
+
+def newVersion():
+    """Return a version that is unique and tells when it was made."""
+    return int(time.time() * 1000) * 1000 + random.randrange(1000)
+
+
+def settled(version):
+    """Whether SETTLE_TIME has passed since version was made."""
+    return time.time() - version // 1000000 >= SETTLE_TIME
+
+
+def bumpVersions(wscks):
+    """Give conferences (by websafe key) new versions, so their cached
+    responses and ETags go stale."""
+    memcache.set_multi(dict((MEMCACHE_VERSION_KEY % wsck, newVersion())
+                            for wsck in wscks))
+
+
+def _matches(etag, if_none_match):
+    return if_none_match and (if_none_match.strip() == '*' or etag in
+                              [tag.strip() for tag in if_none_match.split(',')])
+
+
+def getResponse(name, wsck, message_type, if_none_match, build):
+    """Return the response of endpoint name for a conference, from the
+    cache if it is current, else from build() (message_type must have
+    etag and notModified fields).
+
+    When if_none_match has the current ETag, returns a message_type with
+    only the ETag and notModified set.
+    """
+    version_key = MEMCACHE_VERSION_KEY % wsck
+    response_key = MEMCACHE_RESPONSE_KEY % (name, wsck)
+    cached = memcache.get_multi([version_key, response_key])
+    version = cached.get(version_key)
+    if version is None:
+        version = newVersion()
+        if not memcache.add(version_key, version):
+            version = memcache.get(version_key) or version
+
+    current = settled(version)
+    etag = '"%d"' % version
+    if current:
+        if _matches(etag, if_none_match):
+            return message_type(etag=etag, notModified=True)
+        entry = cached.get(response_key)
+        if entry and entry[0] == version:
+            return protojson.decode_message(message_type, entry[1])
+
+    response = build()
+    if current:
+        response.etag = etag
+        memcache.set(response_key, (version, protojson.encode_message(response)),
+                     time=RESPONSE_TTL)
+    return response
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+"""schedule.py
+
+Time overlaps between the sessions of a user's wishlist. The wishlist's
+session intervals (from startDate, startTime and duration) are kept sorted
+by start, each with the latest end so far, and cached in memcache per user
+along with the wishlist they were built from. Checking a new session then
+takes a binary search plus the overlapping sessions, and conflict groups
+come from one sweep over the sorted intervals.
+
+"""
+
+import bisect
+import calendar
+import datetime
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+MEMCACHE_INTERVALS_KEY = "WISHLIST_INTERVALS_%s"
+INTERVALS_TTL = 3600
+
+
+def sessionInterval(session):
+    """Return (start, end) of a session in minutes since the epoch, or
+    None if it has no date, time or duration."""
+    if not (session.startDate and session.startTime and session.duration):
+        return None
+    start = calendar.timegm(datetime.datetime.combine(
+        session.startDate, session.startTime).timetuple()) // 60
+    return start, start + session.duration
+
+
+def _withMaxEnds(intervals):
+    """Sort (start, end, websafe key) intervals by start and add each one's
+    latest end so far."""
+    result = []
+    max_end = None
+    for start, end, wssk in sorted(intervals):
+        max_end = end if max_end is None else max(max_end, end)
+        result.append((start, end, wssk, max_end))
+    return result
+
+
+def getIntervals(profile):
+    """Return the sorted intervals of a Profile's wishlist, from memcache
+    if they were built from the current wishlist."""
+    cache_key = MEMCACHE_INTERVALS_KEY % profile.key.id()
+    wishlist = list(profile.sessionWishlist)
+    cached = memcache.get(cache_key)
+    if cached and cached[0] == wishlist:
+        return cached[1]
+
+    keys = []
+    for wssk in wishlist:
+        try:
+            keys.append((wssk, ndb.Key(urlsafe=wssk)))
+        except Exception:
+            pass
+    intervals = []
+    for (wssk, _), session in zip(keys, ndb.get_multi([key for _, key in keys])):
+        interval = session and sessionInterval(session)
+        if interval:
+            intervals.append(interval + (wssk,))
+    intervals = _withMaxEnds(intervals)
+    memcache.set(cache_key, (wishlist, intervals), time=INTERVALS_TTL)
+    return intervals
+
+
+def addInterval(profile, intervals, session):
+    """Cache the intervals of a Profile whose wishlist (already updated)
+    gained session."""
+    interval = sessionInterval(session)
+    if interval:
+        intervals = _withMaxEnds(
+            [i[:3] for i in intervals] + [interval + (session.key.urlsafe(),)])
+    memcache.set(MEMCACHE_INTERVALS_KEY % profile.key.id(),
+                 (list(profile.sessionWishlist), intervals), time=INTERVALS_TTL)
+
+
+def overlapping(intervals, session):
+    """Return the websafe keys of wishlist sessions overlapping session."""
+    interval = sessionInterval(session)
+    if not interval:
+        return []
+    start, end = interval
+    # only sessions starting before this one ends can overlap; walk back
+    # from there while some earlier session still ends after it starts
+    i = bisect.bisect_left(intervals, (end,))
+    found = []
+    while i > 0 and intervals[i - 1][3] > start:
+        i -= 1
+        if intervals[i][1] > start:
+            found.append(intervals[i][2])
+    found.reverse()
+    return found
+
+
+def conflictGroups(intervals):
+    """Return groups of wishlist sessions whose times overlap, as
+    (start, end, [websafe keys]), in time order."""
+    groups = []
+    group = None
+    for start, end, wssk, _ in intervals:
+        if group and start < group[1]:
+            group[1] = max(group[1], end)
+            group[2].append(wssk)
+        else:
+            group = [start, end, [wssk]]
+            groups.append(group)
+    return [tuple(group) for group in groups if len(group[2]) > 1]
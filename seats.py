@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+
+"""seats.py
+
+Sharded seat counters for Conference registration. A conference's available
+seats are split across NUM_SHARDS root SeatShard entities, so concurrent
+registrations write to different entity groups instead of all contending on
+the Conference entity. The aggregate is cached in memcache for reads.
+
+"""
+
+import random
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import ConflictException
+from models import SeatShard
+
+# adjustSeats() touches every shard in one cross-group transaction,
+# so this must stay within the datastore's 25 entity group limit
+NUM_SHARDS = 20
+MAX_REFRESHES = 3
+MEMCACHE_SEATS_KEY = "SEATS_AVAILABLE_%s"
+SEATS_CACHE_TTL = 60
+
+_SHARD_EMPTY = object()
+
+
+def _shardKeys(conf_key):
+    """Return the SeatShard keys of a conference, in shard order."""
+    wsck = conf_key.urlsafe()
+    return [ndb.Key(SeatShard, '%s:%d' % (wsck, i)) for i in range(NUM_SHARDS)]
+
+
+def _split(total):
+    """Split total as evenly as possible across NUM_SHARDS."""
+    base, extra = divmod(max(total or 0, 0), NUM_SHARDS)
+    return [base + (1 if i < extra else 0) for i in range(NUM_SHARDS)]
+
+
+def _ensureShards(conf):
+    """Return the shards of a conference, creating any missing ones from
+    Conference.seatsAvailable (conferences created before sharding)."""
+    keys = _shardKeys(conf.key)
+    shards = ndb.get_multi(keys)
+    if None in shards:
+        shares = _split(conf.seatsAvailable)
+        shards = [shard or SeatShard.get_or_insert(key.id(), seats=share)
+                  for shard, key, share in zip(shards, keys, shares)]
+    return shards
+
+
+def seatShards(conf_key, total):
+    """Return (unsaved) seat shards holding total seats for a conference."""
+    return [SeatShard(key=key, seats=share) for key, share in
+            zip(_shardKeys(conf_key), _split(total))]
+
+
+def initSeats(conf_key, total):
+    """Create the seat shards of a new conference."""
+    ndb.put_multi(seatShards(conf_key, total))
+    memcache.set(MEMCACHE_SEATS_KEY % conf_key.urlsafe(), total,
+                 time=SEATS_CACHE_TTL)
+
+
+def getSeatsAvailable(conf):
+    """Return the number of seats available for a conference."""
+    return getSeatsAvailableMulti([conf])[conf.key]
+
+
+def getSeatsAvailableMulti(confs):
+    """Return {conference key: seats available} for several conferences,
+    summing the shards (in one get_multi) of those not in memcache."""
+    by_cache_key = dict((MEMCACHE_SEATS_KEY % conf.key.urlsafe(), conf)
+                        for conf in confs)
+    cached = memcache.get_multi(by_cache_key.keys())
+
+    available = {}
+    missing = []
+    for cache_key, conf in by_cache_key.items():
+        if cache_key in cached:
+            available[conf.key] = cached[cache_key]
+        else:
+            missing.append((cache_key, conf))
+
+    if missing:
+        shards = ndb.get_multi(
+            [key for _, conf in missing for key in _shardKeys(conf.key)])
+        fresh = {}
+        for i, (cache_key, conf) in enumerate(missing):
+            chunk = shards[i * NUM_SHARDS:(i + 1) * NUM_SHARDS]
+            # shards not created yet still hold their initial share
+            total = sum(shard.seats if shard else share for shard, share in
+                        zip(chunk, _split(conf.seatsAvailable)))
+            available[conf.key] = fresh[cache_key] = total
+        memcache.add_multi(fresh, time=SEATS_CACHE_TTL)
+
+    return available
+
+
+def _applyToShard(shard_key, delta, work):
+    """Transaction body: run work() and move delta seats on one shard."""
+    shard = shard_key.get()
+    if shard is None or shard.seats + delta < 0:
+        return _SHARD_EMPTY
+    result = work()
+    if result:
+        shard.seats += delta
+        shard.put()
+    return result
+
+
+def changeSeats(conf, delta, work):
+    """Take (delta < 0) or give back (delta > 0) seats on a single shard.
+
+    work() runs inside the same cross-group transaction as the shard
+    update and must return True for the seat change to be applied; its
+    result is returned. A random shard is tried first, then shards known
+    to have enough seats. Raises ConflictException if no shard has them.
+    """
+    candidates = [random.choice(_shardKeys(conf.key))]
+    refreshes = 0
+    while True:
+        if not candidates:
+            if refreshes == MAX_REFRESHES:
+                break
+            refreshes += 1
+            candidates = [shard.key for shard in _ensureShards(conf)
+                          if shard.seats + delta >= 0]
+            if not candidates:
+                break
+            random.shuffle(candidates)
+
+        shard_key = candidates.pop()
+        result = ndb.transaction(
+            lambda: _applyToShard(shard_key, delta, work), xg=True)
+        if result is not _SHARD_EMPTY:
+            if result:
+                cache_key = MEMCACHE_SEATS_KEY % conf.key.urlsafe()
+                if delta < 0:
+                    memcache.decr(cache_key, -delta)
+                else:
+                    memcache.incr(cache_key, delta)
+            return result
+
+    raise ConflictException("There are no seats available.")
+
+
+def _getAllShards(conf):
+    """Transaction body: get every shard, starting missing ones (unsaved)."""
+    keys = _shardKeys(conf.key)
+    return [shard or SeatShard(key=key, seats=share) for shard, key, share
+            in zip(ndb.get_multi(keys), keys, _split(conf.seatsAvailable))]
+
+
+def _takeSeats(shards, count):
+    """Take up to count seats from the fullest shards first; returns how
+    many could not be taken."""
+    for shard in sorted(shards, key=lambda s: -s.seats):
+        taken = min(count, shard.seats)
+        shard.seats -= taken
+        count -= taken
+    return count
+
+
+def reserveSeats(conf, count):
+    """Take count seats at once, all or nothing, in one transaction over
+    all shards. Returns False, taking none, if fewer are available."""
+    if count <= 0:
+        return True
+
+    @ndb.transactional(xg=True)
+    def txn():
+        shards = _getAllShards(conf)
+        if sum(shard.seats for shard in shards) < count:
+            return False
+        _takeSeats(shards, count)
+        ndb.put_multi(shards)
+        return True
+
+    if not txn():
+        return False
+    memcache.decr(MEMCACHE_SEATS_KEY % conf.key.urlsafe(), count)
+    return True
+
+
+def adjustSeats(conf, delta):
+    """Add (or remove, if negative) seats across all shards at once, e.g.
+    when maxAttendees changes. Never takes a shard below zero; returns
+    the change actually applied."""
+
+    @ndb.transactional(xg=True)
+    def txn():
+        shards = _getAllShards(conf)
+        if delta > 0:
+            for shard, share in zip(shards, _split(delta)):
+                shard.seats += share
+            applied = delta
+        else:
+            applied = delta + _takeSeats(shards, -delta)
+        ndb.put_multi(shards)
+        return applied
+
+    applied = txn()
+    memcache.delete(MEMCACHE_SEATS_KEY % conf.key.urlsafe())
+    return applied
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+"""speakers.py
+
+Speaker index for Sessions. A ConferenceSpeaker entity (child of the
+Conference), keyed by the normalized speaker name, holds the speaker's
+session keys and count in that conference. It is updated in the same
+transaction as the Session write, so counting or listing a speaker's
+sessions in a conference is a key lookup instead of a query over every
+session, and a speaker's sessions everywhere are one query on speakerId.
+There is no global entry per speaker: it would grow without bound and be
+written by every conference the speaker talks at. Bulk imports write their
+sessions first and then index them per speaker, as does the index-speakers
+backfill for sessions written before the index.
+
+"""
+
+from google.appengine.ext import ndb
+
+import backfill
+from models import ConferenceSpeaker
+
+PUT_BATCH = 500
+# ConferenceSpeaker entries (all in the conference's entity group) per
+# index transaction
+INDEX_BATCH = 100
+
+
+def normalizeSpeaker(name):
+    """Return the index identity of a speaker name."""
+    return ' '.join((name or '').split()).lower()
+
+
+def conferenceSpeakerKey(conf_key, name):
+    return ndb.Key(ConferenceSpeaker, normalizeSpeaker(name), parent=conf_key)
+
+
+def speakerSessionKeys(name):
+    """Return the keys of a speaker's sessions in every conference."""
+    entries = ConferenceSpeaker.query(
+        ConferenceSpeaker.speakerId == normalizeSpeaker(name)).fetch()
+    return [key for entry in entries for key in entry.speakerSess]
+
+
+def _indexEntry(session):
+    """Get (or start) the ConferenceSpeaker entry of a session."""
+    key = conferenceSpeakerKey(session.conference, session.speaker)
+    return key.get() or ConferenceSpeaker(key=key, speakerName=session.speaker)
+
+
+@ndb.transactional(xg=True)
+def putSession(session):
+    """Write a Session and add it to its speaker's index entry.
+
+    Returns the speaker's ConferenceSpeaker entry, or None if the session
+    has no speaker.
+    """
+    session.put()
+    if not normalizeSpeaker(session.speaker):
+        return None
+    entry = _indexEntry(session)
+    if session.key not in entry.speakerSess:
+        entry.speakerSess.append(session.key)
+        entry.sessionCount = len(entry.speakerSess)
+    entry.put()
+    return entry
+
+
+@ndb.transactional(xg=True)
+def deleteSession(session):
+    """Delete a Session and remove it from its speaker's index entry."""
+    session.key.delete()
+    if not normalizeSpeaker(session.speaker):
+        return
+    entry = _indexEntry(session)
+    if session.key in entry.speakerSess:
+        entry.speakerSess.remove(session.key)
+    entry.sessionCount = len(entry.speakerSess)
+    if entry.sessionCount:
+        entry.put()
+    else:
+        entry.key.delete()
+
+
+def putSessions(sessions):
+    """Write many Sessions of one conference with put_multi, then add them
+    to the speaker index in aggregate: one read and one write per speaker
+    instead of per session.
+
+    The sessions are written before the index transactions, as they are
+    root entities and too many for one. Returns the ConferenceSpeaker
+    entries updated.
+    """
+    for start in range(0, len(sessions), PUT_BATCH):
+        ndb.put_multi(sessions[start:start + PUT_BATCH])
+    return indexSessions(sessions)
+
+
+def indexSessions(sessions):
+    """Add written Sessions of one conference to the speaker index, one
+    read and one write per speaker; sessions already indexed are left as
+    they are. Returns the ConferenceSpeaker entries updated."""
+    by_speaker = {}
+    for session in sessions:
+        name = normalizeSpeaker(session.speaker)
+        if name:
+            by_speaker.setdefault(name, []).append(session)
+
+    groups = [by_speaker[name] for name in sorted(by_speaker)]
+    entries = []
+    for start in range(0, len(groups), INDEX_BATCH):
+        entries.extend(_indexSessions(groups[start:start + INDEX_BATCH]))
+    return entries
+
+
+@ndb.transactional()
+def _indexSessions(groups):
+    """Add lists of one speaker's sessions to their index entries."""
+    keys = [conferenceSpeakerKey(group[0].conference, group[0].speaker)
+            for group in groups]
+    conf_speakers = []
+    for key, found, group in zip(keys, ndb.get_multi(keys), groups):
+        entry = found or ConferenceSpeaker(key=key, speakerName=group[0].speaker)
+        indexed = set(entry.speakerSess)
+        entry.speakerSess.extend(session.key for session in group
+                                 if session.key not in indexed)
+        entry.sessionCount = len(entry.speakerSess)
+        conf_speakers.append(entry)
+    ndb.put_multi(conf_speakers)
+    return conf_speakers
+
+
+@backfill.job('index-speakers', 'Session')
+def _indexExisting(keys):
+    """Index a batch of sessions, a conference at a time (an index
+    transaction covers one conference's entity group). Entries written
+    before speakerId existed get it when rewritten."""
+    by_conference = {}
+    for session in ndb.get_multi(keys):
+        if session:
+            by_conference.setdefault(session.conference, []).append(session)
+    for conf_key in sorted(by_conference):
+        indexSessions(by_conference[conf_key])
@@ -249,7 +249,7 @@ conferenceApp.controllers.controller('CreateConferenceCtrl',
  * @description
  * A controller used for the Show conferences page.
  */
-conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $log, oauth2Provider, HTTP_ERRORS) {
+conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $log, $q, oauth2Provider, HTTP_ERRORS) {
 
     /**
      * Holds the status if the query is being executed.
@@ -408,6 +408,32 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
         }
     };
 
+    /**
+     * Returns a promise of the values completing a filter's value so far,
+     * for the filter fields that can be completed.
+     *
+     * @param filter
+     * @param prefix the value typed so far.
+     */
+    $scope.getCompletions = function (filter, prefix) {
+        var deferred = $q.defer();
+        if (!filter.field || filter.field.enumValue != 'CITY') {
+            deferred.resolve([]);
+            return deferred.promise;
+        }
+        gapi.client.conference.getCompletions({field: 'CITY', prefix: prefix}).
+            execute(function (resp) {
+                $scope.$apply(function () {
+                    var values = [];
+                    angular.forEach(resp.items || [], function (item) {
+                        values.push(item.value);
+                    });
+                    deferred.resolve(values);
+                });
+            });
+        return deferred.promise;
+    };
+
     /**
      * Query the conferences depending on the tab currently selected.
      *
@@ -423,12 +449,24 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
         }
     };
 
+    /**
+     * Holds the cursor of the next page of queryConferences results, if any.
+     * @type {string}
+     */
+    $scope.nextCursor = null;
+
     /**
      * Invokes the conference.queryConferences API.
+     *
+     * @param loadMore if true, fetches the next page and appends it to $scope.conferences.
      */
-    $scope.queryConferencesAll = function () {
+    $scope.queryConferencesAll = function (loadMore) {
         var sendFilters = {
-            filters: []
+            filters: [],
+            pageSize: $scope.pagination.pageSize
+        }
+        if (loadMore) {
+            sendFilters.cursor = $scope.nextCursor;
         }
         for (var i = 0; i < $scope.filters.length; i++) {
             var filter = $scope.filters[i];
@@ -458,10 +496,14 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                         $scope.alertStatus = 'success';
                         $log.info($scope.messages);
 
-                        $scope.conferences = [];
+                        if (!loadMore) {
+                            $scope.conferences = [];
+                            $scope.pagination.currentPage = 0;
+                        }
                         angular.forEach(resp.items, function (conference) {
                             $scope.conferences.push(conference);
                         });
+                        $scope.nextCursor = resp.nextCursor || null;
                     }
                     $scope.submitted = true;
                 });
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+
+"""base.py
+
+Test case with the datastore (strongly consistent, enforcing index.yaml),
+memcache and task queue stubs active.
+
+"""
+
+import os
+import unittest
+
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class StubTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.setup_env(app_id='conference-tests', overwrite=True)
+        policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1)
+        self.testbed.init_datastore_v3_stub(consistency_policy=policy,
+                                            require_indexes=True, root_path=ROOT)
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=ROOT)
+        self.taskqueue = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        ndb.get_context().clear_cache()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def queuedTasks(self, url=None, queue='default'):
+        return [task for task in self.taskqueue.GetTasks(queue)
+                if url is None or task['url'] == url]
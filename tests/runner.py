@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+
+"""runner.py
+
+Runs the unit tests in this directory against the App Engine SDK
+service stubs (testbed).
+
+usage: python tests/runner.py ~/google_appengine [pattern]
+
+"""
+
+import os
+import sys
+import unittest
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(TESTS)
+
+
+def main(sdk_path, pattern='test_*.py'):
+    sys.path.insert(0, ROOT)
+    from loadtest import setupSdk
+    setupSdk(sdk_path)
+    sys.path.insert(0, TESTS)
+    suite = unittest.TestLoader().discover(TESTS, pattern=pattern)
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    return 0 if result.wasSuccessful() else 1
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+    sys.exit(main(*sys.argv[1:3]))
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+"""test_autocomplete.py
+
+Completion counts queued by autocomplete.queueAdjust() and applied by
+their tasks.
+
+"""
+
+import base64
+import json
+import urlparse
+
+from base import StubTestCase
+from google.appengine.api import taskqueue
+
+import autocomplete
+
+
+class QueueAdjustTest(StubTestCase):
+
+    def runTasks(self):
+        for task in self.queuedTasks('/tasks/adjust_completions'):
+            params = urlparse.parse_qs(base64.b64decode(task['body']))
+            autocomplete.adjust(json.loads(params['changes'][0]))
+            self.taskqueue.DeleteTask('default', task['name'])
+
+    def testCountsAppliedByTask(self):
+        autocomplete.queueAdjust([('city', 'London', 1), ('city', 'london ', 1),
+                                  ('name', 'PyCon London', 1)])
+        self.assertEqual(autocomplete.complete('city', 'lo'), [])
+        self.runTasks()
+        self.assertEqual(autocomplete.complete('city', 'lo'), [('London', 2)])
+        self.assertEqual(autocomplete.complete('name', 'lon'), [('PyCon London', 1)])
+
+    def testNetZeroChangesNotQueued(self):
+        autocomplete.queueAdjust(autocomplete.replace('city', 'Paris', 'paris'))
+        autocomplete.queueAdjust([('city', 'Paris', 1), ('city', 'Paris', -1)])
+        self.assertEqual(self.queuedTasks('/tasks/adjust_completions'), [])
+
+    def testOneTaskPerTransaction(self):
+        autocomplete.queueAdjust([('speaker', 'Speaker %d' % i, 1)
+                                  for i in range(autocomplete.COMPLETIONS_PER_TXN + 1)])
+        self.assertEqual(len(self.queuedTasks('/tasks/adjust_completions')), 2)
+
+    def testQueueFailureIsNotRaised(self):
+        def fail(queue, tasks):
+            raise taskqueue.TransientError()
+        add = taskqueue.Queue.add
+        taskqueue.Queue.add = fail
+        try:
+            autocomplete.queueAdjust([('city', 'London', 1)])
+        finally:
+            taskqueue.Queue.add = add
+
+    def testPrefixLongerThanIndexedPagesPastCachedCandidates(self):
+        # all share the indexed stem 'conference n', and the cached
+        # candidates of it are all more used than the one that matches
+        autocomplete.adjust([('name', 'Conference North %d' % i, 2)
+                             for i in range(autocomplete.MAX_CANDIDATES + 10)] +
+                            [('name', 'Conference Nowhere', 1)])
+        self.assertEqual(len(autocomplete.complete('name', 'conference n', 50)), 50)
+        self.assertEqual(autocomplete.complete('name', 'conference now'),
+                         [('Conference Nowhere', 1)])
+        self.assertEqual(len(autocomplete.complete('name', 'conference nort', 55)), 55)
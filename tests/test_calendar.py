@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+"""test_calendar.py
+
+Paging through getConferenceCalendar, and the calendar-buckets backfill.
+
+"""
+
+from datetime import date
+from datetime import datetime
+
+from base import StubTestCase
+from google.appengine.api import datastore
+from google.appengine.ext import ndb
+
+from conference import ConferenceApi
+from models import Conference
+from models import Profile
+
+
+class CalendarTest(StubTestCase):
+
+    def setUp(self):
+        super(CalendarTest, self).setUp()
+        self.organizer = ndb.Key(Profile, 'org')
+        Profile(key=self.organizer, displayName='Org').put()
+
+    def conference(self, name, start, end=None, city='London'):
+        return Conference(parent=self.organizer, name=name, organizerUserId='org',
+                          city=city, startDate=start, endDate=end or start).put()
+
+    def calendar(self, **fields):
+        method = ConferenceApi().getConferenceCalendar
+        return method(method.remote.request_type(**fields))
+
+    def allPages(self, **fields):
+        names, cursor = [], None
+        while True:
+            page = self.calendar(cursor=cursor, **fields)
+            names.extend(conf.name for conf in page.items)
+            cursor = page.nextCursor
+            if not cursor:
+                return names
+
+    def testPagesInStartDateOrder(self):
+        for i, day in enumerate([5, 3, 3, 9, 1, 3, 7]):
+            self.conference('Conference %d' % i, date(2027, 5, day))
+        self.conference('Elsewhere', date(2027, 5, 4), city='Paris')
+        self.conference('Later', date(2027, 8, 1))
+
+        first = self.calendar(startDate='2027-05-01', endDate='2027-05-31',
+                              city='London', pageSize=3)
+        self.assertEqual(len(first.items), 3)
+        self.assertTrue(first.nextCursor)
+
+        names = self.allPages(startDate='2027-05-01', endDate='2027-05-31',
+                              city='London', pageSize=2)
+        self.assertEqual(len(names), 7)
+        self.assertEqual(len(set(names)), 7)
+        self.assertEqual(names[0], 'Conference 4')
+        self.assertEqual(names[-1], 'Conference 3')
+
+    def testMonthRangeDropsConferencesOutsideIt(self):
+        self.conference('Before', date(2027, 1, 2))
+        self.conference('Inside', date(2027, 3, 10), date(2027, 3, 12))
+        self.conference('Spanning', date(2027, 1, 20), date(2027, 4, 2))
+        # spans more than MAX_CALENDAR_BUCKETS days: read by month
+        self.assertEqual(self.allPages(startDate='2027-01-15', endDate='2027-03-31'),
+                         ['Spanning', 'Inside'])
+
+    def testInvalidCursor(self):
+        import endpoints
+        self.assertRaises(endpoints.BadRequestException, self.calendar,
+                          week='2027-W10', cursor='garbage')
+
+
+class CalendarBucketsBackfillTest(StubTestCase):
+
+    def testRewritesBuckets(self):
+        # written as before the computed properties existed
+        entity = datastore.Entity('Conference')
+        entity.update({'name': 'Old', 'startDate': datetime(2027, 5, 3),
+                       'endDate': datetime(2027, 5, 4)})
+        key = ndb.Key.from_old_key(datastore.Put(entity))
+        self.assertEqual(Conference.query(Conference.days == '2027-05-03').count(), 0)
+
+        ConferenceApi._putCalendarBuckets([key])
+        self.assertEqual(Conference.query(Conference.days == '2027-05-04').fetch(keys_only=True),
+                         [key])
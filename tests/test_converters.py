@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+"""test_converters.py
+
+The compiled copiers in converters.py against the reflective copies they
+replaced, kept here (with the session's websafe conference key, a later
+field) as reflectiveConferenceCopy, reflectiveSessionCopy and
+reflectiveProfileCopy; benchmarks/copiers.py times the two.
+
+"""
+
+from datetime import date
+from datetime import time
+
+from base import StubTestCase
+from google.appengine.ext import ndb
+
+from converters import copyConferenceToForm
+from converters import copyProfileToForm
+from converters import copySessionToForm
+from models import Conference
+from models import ConferenceForm
+from models import Profile
+from models import ProfileForm
+from models import Session
+from models import SessionForm
+from models import TeeShirtSize
+
+
+def reflectiveConferenceCopy(conf):
+    cf = ConferenceForm()
+    for field in cf.all_fields():
+        if hasattr(conf, field.name):
+            # convert Date to date string; just copy others
+            if field.name.endswith('Date'):
+                setattr(cf, field.name, str(getattr(conf, field.name)))
+            else:
+                setattr(cf, field.name, getattr(conf, field.name))
+        elif field.name == "websafeKey":
+            setattr(cf, field.name, conf.key.urlsafe())
+    cf.check_initialized()
+    return cf
+
+
+def reflectiveSessionCopy(session):
+    sf = SessionForm()
+    for field in sf.all_fields():
+        if hasattr(session, field.name):
+            # convert Date to date string; just copy others
+            if field.name in ['startDate', 'startTime']:
+                setattr(sf, field.name, str(getattr(session, field.name)))
+            elif field.name == 'duration':
+                setattr(sf, field.name, int(getattr(session, field.name)))
+            elif field.name == 'conference':
+                setattr(sf, field.name, getattr(session, field.name).urlsafe())
+            else:
+                setattr(sf, field.name, getattr(session, field.name))
+    setattr(sf, 'sessionKey', str(session.key.urlsafe()))
+    sf.check_initialized()
+    return sf
+
+
+def reflectiveProfileCopy(prof):
+    pf = ProfileForm()
+    for field in pf.all_fields():
+        if hasattr(prof, field.name):
+            # convert t-shirt string to Enum; just copy others
+            if field.name == 'teeShirtSize':
+                setattr(pf, field.name, getattr(TeeShirtSize, getattr(prof, field.name)))
+            else:
+                setattr(pf, field.name, getattr(prof, field.name))
+    pf.check_initialized()
+    return pf
+
+
+def makeEntities():
+    """Return a fully populated (Conference, Session, Profile)."""
+    prof_key = ndb.Key(Profile, 'user@example.com')
+    conf = Conference(key=ndb.Key(Conference, 7, parent=prof_key),
+                      name='PyCon', description='Python', organizerUserId='user@example.com',
+                      topics=['Web', 'Data'], city='London',
+                      startDate=date(2027, 5, 3), endDate=date(2027, 5, 5), month=5,
+                      maxAttendees=200, seatsAvailable=150)
+    session = Session(key=ndb.Key(Session, 11), name='Keynote', speaker='Ada',
+                      highlights=['intro', 'demo'], duration=45, typeOfSession='keynotes',
+                      startDate=date(2027, 5, 3), startTime=time(9, 30),
+                      conference=conf.key)
+    prof = Profile(key=prof_key, displayName='Ada', mainEmail='user@example.com',
+                   teeShirtSize='XL_W', conferenceKeysToAttend=[conf.key.urlsafe()])
+    return conf, session, prof
+
+
+class CopierTest(StubTestCase):
+
+    def assertSameFields(self, compiled, reflective):
+        for field in compiled.all_fields():
+            self.assertEqual(getattr(compiled, field.name), getattr(reflective, field.name),
+                             field.name)
+
+    def testConference(self):
+        conf = makeEntities()[0]
+        form = copyConferenceToForm(conf)
+        self.assertSameFields(form, reflectiveConferenceCopy(conf))
+        self.assertEqual(form.startDate, '2027-05-03')
+        self.assertEqual(form.websafeKey, conf.key.urlsafe())
+
+    def testSession(self):
+        session = makeEntities()[1]
+        form = copySessionToForm(session)
+        self.assertSameFields(form, reflectiveSessionCopy(session))
+        self.assertEqual(form.startTime, '09:30:00')
+        self.assertEqual(form.conference, session.conference.urlsafe())
+        self.assertEqual(form.sessionKey, session.key.urlsafe())
+
+    def testProfile(self):
+        prof = makeEntities()[2]
+        form = copyProfileToForm(prof)
+        self.assertSameFields(form, reflectiveProfileCopy(prof))
+        self.assertEqual(form.teeShirtSize, TeeShirtSize.XL_W)
+
+    def testMissingDatesLeftUnset(self):
+        # the reflective copy turned them into the string 'None'
+        conf = Conference(key=ndb.Key(Conference, 8), name='Undated')
+        form = copyConferenceToForm(conf)
+        self.assertEqual(form.startDate, None)
+        self.assertEqual(reflectiveConferenceCopy(conf).startDate, 'None')
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+"""test_featuredspeaker.py
+
+getFeaturedSpeaker reads and the featured speaker task's writes.
+
+"""
+
+from base import StubTestCase
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+import conference
+from conference import ConferenceApi
+from models import Session
+import speakers
+
+
+class FeaturedSpeakerTest(StubTestCase):
+
+    def setUp(self):
+        super(FeaturedSpeakerTest, self).setUp()
+        self.conf_keys = [ndb.Key('Conference', i) for i in (1, 2)]
+        self.wscks = [key.urlsafe() for key in self.conf_keys]
+        for name in 'Keynote', 'Workshop':
+            speakers.putSession(Session(name=name, speaker='Ada',
+                                        conference=self.conf_keys[0]))
+
+    def featured(self, wsck=None):
+        method = ConferenceApi().getFeaturedSpeaker
+        return method(method.remote.request_type(websafeConferenceKey=wsck)).data
+
+    def testReadCachesOnlyItsConference(self):
+        announcement = self.featured(self.wscks[0])
+        self.assertIn('Ada', announcement)
+        self.assertEqual(memcache.get(conference.MEMCACHE_FEATURED_SPEAKER_KEY % self.wscks[0]),
+                         announcement)
+        # the latest announcement is the task's to set
+        self.assertEqual(memcache.get(conference.FEATURED_SPEAKER_SESSIONS_KEY), None)
+        self.assertEqual(self.featured(), '')
+
+    def testReadUsesTaskValue(self):
+        memcache.set(conference.MEMCACHE_FEATURED_SPEAKER_KEY % self.wscks[1], 'set by a task')
+        self.assertEqual(self.featured(self.wscks[1]), 'set by a task')
+
+    def testTaskSetsLatest(self):
+        announcement = ConferenceApi._setFeaturedSpeaker(self.wscks[0])
+        self.assertIn('Ada', announcement)
+        self.assertEqual(self.featured(), announcement)
+        self.assertEqual(self.featured(self.wscks[1]), '')
+        self.assertEqual(self.featured(), announcement)
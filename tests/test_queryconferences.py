@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+"""test_queryconferences.py
+
+Paging through queryConferences, with the planner's choice of driver.
+
+"""
+
+from base import StubTestCase
+from google.appengine.ext import ndb
+
+from conference import ConferenceApi
+from models import Conference
+from models import ConferenceQueryForm
+from models import Profile
+import planner
+
+
+class FilterOrderTest(StubTestCase):
+
+    def setUp(self):
+        super(FilterOrderTest, self).setUp()
+        organizer = ndb.Key(Profile, 'org')
+        Profile(key=organizer, displayName='Org').put()
+        # city=London is the more selective driver
+        for i in range(3):
+            Conference(parent=organizer, name='London %d' % i, organizerUserId='org',
+                       city='London', topics=['Web']).put()
+        for i in range(6):
+            Conference(parent=organizer, name='Paris %d' % i, organizerUserId='org',
+                       city='Paris', topics=['Web']).put()
+        self.city = ConferenceQueryForm(field='CITY', operator='EQ', value='London')
+        self.topic = ConferenceQueryForm(field='TOPIC', operator='EQ', value='Web')
+
+    def query(self, filters, cursor=None):
+        method = ConferenceApi().queryConferences
+        return method(method.remote.request_type(filters=filters, pageSize=1,
+                                                 cursor=cursor))
+
+    def testPlanDoesNotDependOnFilterOrder(self):
+        predicates = ConferenceApi()._formatFilters([self.city, self.topic])
+        reordered = ConferenceApi()._formatFilters([self.topic, self.city])
+        self.assertEqual(planner.plan(predicates).number,
+                         planner.plan(reordered).number)
+
+    def testCursorWorksWithFiltersReordered(self):
+        names = []
+        page = self.query([self.city, self.topic])
+        names.extend(conf.name for conf in page.items)
+        while page.nextCursor:
+            page = self.query([self.topic, self.city], page.nextCursor)
+            names.extend(conf.name for conf in page.items)
+        self.assertEqual(names, ['London 0', 'London 1', 'London 2'])
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+"""test_registrations.py
+
+The migrate-registrations backfill, moving registrations listed on
+Profiles to Registration entities.
+
+"""
+
+import base64
+import urlparse
+
+from base import StubTestCase
+from google.appengine.ext import ndb
+
+import backfill
+import conference
+from conference import ConferenceApi
+from models import Profile
+from models import Registration
+
+
+class MigrateRegistrationsTest(StubTestCase):
+
+    def setUp(self):
+        super(MigrateRegistrationsTest, self).setUp()
+        self.conferences = [ndb.Key('Conference', i + 1) for i in range(3)]
+        wscks = [key.urlsafe() for key in self.conferences]
+        # more Profiles than a backfill batch, one with more registrations
+        # than a migration transaction moves
+        self.profiles = [Profile(id='user%d' % i, conferenceKeysToAttend=wscks[:i % 3])
+                         for i in range(backfill.BATCH + 5)]
+        self.profiles.append(Profile(id='busy', conferenceKeysToAttend=
+                                     wscks * (conference.MIGRATE_REGISTRATIONS // 2)))
+        ndb.put_multi(self.profiles)
+
+    def runChain(self):
+        """Run queued backfill tasks, as the task queue would, until none are left."""
+        runs = 0
+        while self.queuedTasks('/tasks/backfill'):
+            task = self.queuedTasks('/tasks/backfill')[0]
+            self.taskqueue.DeleteTask('default', task['name'])
+            params = dict(urlparse.parse_qsl(base64.b64decode(task['body']),
+                                             keep_blank_values=True))
+            backfill.runBatch(params['job'], params['run'], params['cursor'])
+            runs += 1
+        return runs
+
+    def testChainMigratesEveryProfile(self):
+        backfill.start('migrate-registrations')
+        self.assertEqual(self.runChain(), 2)
+
+        for profile in ndb.get_multi([prof.key for prof in self.profiles]):
+            self.assertEqual(profile.conferenceKeysToAttend, [])
+        registered = Registration.query(ancestor=ndb.Key(Profile, 'user5')).fetch()
+        self.assertEqual(sorted(reg.conference for reg in registered),
+                         self.conferences[:2])
+        self.assertEqual(Registration.query(ancestor=ndb.Key(Profile, 'busy'))
+                         .count(), 3)
+        self.assertEqual(Registration.query().count(),
+                         sum(i % 3 for i in range(backfill.BATCH + 5)) + 3)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+"""test_responsecache.py
+
+ETags and notModified replies from responsecache.py, directly and through
+getConference.
+
+"""
+
+from base import StubTestCase
+from google.appengine.ext import ndb
+
+from conference import ConferenceApi
+from models import Conference
+from models import ConferenceForm
+from models import Profile
+import responsecache
+
+
+class SettledTestCase(StubTestCase):
+    """Responses are cached as soon as they are built."""
+
+    def setUp(self):
+        super(SettledTestCase, self).setUp()
+        self.settleTime = responsecache.SETTLE_TIME
+        responsecache.SETTLE_TIME = 0
+
+    def tearDown(self):
+        responsecache.SETTLE_TIME = self.settleTime
+        super(SettledTestCase, self).tearDown()
+
+
+class ResponseCacheTest(SettledTestCase):
+
+    def setUp(self):
+        super(ResponseCacheTest, self).setUp()
+        self.builds = 0
+
+    def build(self):
+        self.builds += 1
+        return ConferenceForm(name='Conference %d' % self.builds)
+
+    def get(self, if_none_match=None):
+        return responsecache.getResponse('test', 'wsck', ConferenceForm,
+                                         if_none_match, self.build)
+
+    def testRoundTrip(self):
+        first = self.get()
+        self.assertEqual(first.name, 'Conference 1')
+        self.assertTrue(first.etag)
+        self.assertFalse(first.notModified)
+
+        again = self.get(first.etag)
+        self.assertTrue(again.notModified)
+        self.assertEqual(again.etag, first.etag)
+        self.assertEqual(again.name, None)
+        self.assertEqual(self.builds, 1)
+
+    def testCachedWithoutIfNoneMatch(self):
+        first = self.get()
+        second = self.get()
+        self.assertEqual(second.name, first.name)
+        self.assertEqual(second.etag, first.etag)
+        self.assertEqual(self.builds, 1)
+
+    def testBumpMakesETagStale(self):
+        first = self.get()
+        responsecache.bumpVersions(['wsck'])
+        second = self.get(first.etag)
+        self.assertFalse(second.notModified)
+        self.assertEqual(second.name, 'Conference 2')
+        self.assertNotEqual(second.etag, first.etag)
+
+    def testNoETagBeforeSettled(self):
+        responsecache.SETTLE_TIME = 3600
+        first = self.get()
+        self.assertEqual(first.etag, None)
+        self.assertFalse(self.get('*').notModified)
+        self.assertEqual(self.builds, 2)
+
+
+class GetConferenceTest(SettledTestCase):
+
+    def getConference(self, wsck, if_none_match=None):
+        method = ConferenceApi().getConference
+        return method(method.remote.request_type(websafeConferenceKey=wsck,
+                                                 ifNoneMatch=if_none_match))
+
+    def testIfNoneMatchRoundTrip(self):
+        prof_key = ndb.Key(Profile, 'org')
+        Profile(key=prof_key, displayName='Org').put()
+        wsck = Conference(parent=prof_key, name='PyCon',
+                          organizerUserId='org').put().urlsafe()
+
+        first = self.getConference(wsck)
+        self.assertEqual(first.name, 'PyCon')
+        self.assertEqual(first.organizerDisplayName, 'Org')
+        self.assertTrue(first.etag)
+
+        again = self.getConference(wsck, first.etag)
+        self.assertTrue(again.notModified)
+        self.assertEqual(again.name, None)
+
+        responsecache.bumpVersions([wsck])
+        changed = self.getConference(wsck, first.etag)
+        self.assertFalse(changed.notModified)
+        self.assertEqual(changed.name, 'PyCon')
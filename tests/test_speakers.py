@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+"""test_speakers.py
+
+The speaker index in speakers.py and its index-speakers backfill.
+
+"""
+
+from base import StubTestCase
+from google.appengine.ext import ndb
+
+import backfill
+from models import Session
+import speakers
+
+
+class IndexSpeakersTest(StubTestCase):
+
+    def setUp(self):
+        super(IndexSpeakersTest, self).setUp()
+        self.conferences = [ndb.Key('Conference', i) for i in (1, 2)]
+        # written before the index, so not in it
+        self.sessions = ndb.put_multi([
+            Session(name='Keynote', speaker='Ada Lovelace', conference=self.conferences[0]),
+            Session(name='Workshop', speaker='ada  lovelace', conference=self.conferences[0]),
+            Session(name='Talk', speaker='Ada Lovelace', conference=self.conferences[1]),
+            Session(name='Break', conference=self.conferences[1]),
+        ])
+
+    def assertIndexed(self):
+        self.assertEqual(sorted(speakers.speakerSessionKeys(' ADA Lovelace')),
+                         sorted(self.sessions[:3]))
+        counts = [speakers.conferenceSpeakerKey(conf_key, 'Ada Lovelace').get().sessionCount
+                  for conf_key in self.conferences]
+        self.assertEqual(counts, [2, 1])
+
+    def testBackfillIndexesExistingSessions(self):
+        self.assertEqual(speakers.speakerSessionKeys('Ada Lovelace'), [])
+        backfill.start('index-speakers')
+        self.assertEqual(len(self.queuedTasks('/tasks/backfill')), 1)
+        # fewer sessions than a batch: one task, and no next one queued
+        backfill.runBatch('index-speakers', 'run', '')
+        self.assertEqual(len(self.queuedTasks('/tasks/backfill')), 1)
+        self.assertIndexed()
+
+    def testBackfillIsIdempotent(self):
+        speakers.putSession(self.sessions[0].get())
+        speakers._indexExisting(self.sessions)
+        speakers._indexExisting(self.sessions)
+        self.assertIndexed()
+
+    def testDeleteSession(self):
+        speakers._indexExisting(self.sessions)
+        speakers.deleteSession(self.sessions[2].get())
+        self.assertEqual(sorted(speakers.speakerSessionKeys('Ada Lovelace')),
+                         sorted(self.sessions[:2]))
+        self.assertEqual(speakers.conferenceSpeakerKey(self.conferences[1],
+                                                       'Ada Lovelace').get(), None)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+"""test_textsearch.py
+
+Tokenizing, banded postings and searching in textsearch.py.
+
+"""
+
+import unittest
+
+from base import StubTestCase
+from google.appengine.ext import ndb
+
+from models import CommonTerm
+from models import Conference
+import textsearch
+
+
+class StemTest(unittest.TestCase):
+
+    def testPluralsMatchSingulars(self):
+        for plural, singular in [('classes', 'class'), ('addresses', 'address'),
+                                 ('talks', 'talk'), ('libraries', 'library')]:
+            self.assertEqual(textsearch._stem(plural), textsearch._stem(singular))
+
+    def testDoubleS(self):
+        self.assertEqual(textsearch._stem('class'), 'class')
+        self.assertEqual(textsearch._stem('classes'), 'class')
+
+    def testTokenizeDropsNumbersAndStopWords(self):
+        self.assertEqual(textsearch.tokenize('The 2015 Python classes'),
+                         ['python', 'class'])
+
+
+class SearchTest(StubTestCase):
+
+    def conference(self, name, description=''):
+        conf = Conference(name=name, description=description, organizerUserId='org')
+        conf.put()
+        return conf.key
+
+    def testFindsEveryTerm(self):
+        both = self.conference('Python Classes', 'scaling data')
+        self.conference('Python', 'web')
+        textsearch.indexDocuments([both] + [k for k in Conference.query().fetch(keys_only=True)
+                                            if k != both])
+        keys, more = textsearch.search('Conference', 'python class')
+        self.assertEqual(keys, [both])
+        self.assertIsNone(more)
+
+    def testTopBandFirst(self):
+        in_name = self.conference('Scaling')
+        in_description = self.conference('Other', 'scaling')
+        textsearch.indexDocuments([in_description, in_name])
+        keys, _ = textsearch.search('Conference', 'scaling')
+        self.assertEqual(keys, [in_name, in_description])
+
+    def testPagesWithoutRepeats(self):
+        keys = [self.conference('Data %d' % i, 'data' if i % 2 else '')
+                for i in range(7)]
+        textsearch.indexDocuments(keys)
+        seen, offset = [], 0
+        while offset is not None:
+            page, offset = textsearch.search('Conference', 'data', offset, 3)
+            seen.extend(page)
+        self.assertEqual(sorted(seen), sorted(keys))
+
+    def testReweightMovesBands(self):
+        key = self.conference('Other', 'scaling')
+        textsearch.indexDocuments([key])
+        conf = key.get()
+        conf.name = 'Scaling'
+        conf.put()
+        textsearch.indexDocuments([key])
+        blocks = [textsearch._postingsKey('Conference', 'scaling', band,
+                                          textsearch._shard(key.urlsafe())).get()
+                  for band in range(len(textsearch.BAND_WEIGHTS))]
+        self.assertEqual([bool(block) for block in blocks], [False, True, False])
+
+    def testCommonTermsAreDropped(self):
+        limit = textsearch.MAX_BLOCK_POSTINGS
+        textsearch.MAX_BLOCK_POSTINGS = 2
+        try:
+            keys = [self.conference('Session %d' % i) for i in range(3 * textsearch.NUM_SHARDS)]
+            textsearch.indexDocuments(keys)
+        finally:
+            textsearch.MAX_BLOCK_POSTINGS = limit
+        self.assertTrue(ndb.Key(CommonTerm, 'Conference:session').get())
+        self.assertEqual(textsearch.search('Conference', 'session'), ([], None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+"""test_utils.py
+
+Cached tokeninfo lookups of getUserId(id_type="oauth"), against the
+stand-in tokeninfo service of loadtest.py.
+
+"""
+
+import os
+import time
+
+from base import StubTestCase
+from google.appengine.api import apiproxy_stub_map
+
+from loadtest import makeTokenInfoStub
+import utils
+
+
+class FakeTime(object):
+
+    def __init__(self):
+        self.now = time.time()
+
+    def time(self):
+        return self.now
+
+
+class TokenCacheTest(StubTestCase):
+
+    def setUp(self):
+        super(TokenCacheTest, self).setUp()
+        self.fetches = 0
+        stub = makeTokenInfoStub()
+        fetch = stub._Dynamic_Fetch
+
+        def countingFetch(request, response):
+            self.fetches += 1
+            fetch(request, response)
+        stub._Dynamic_Fetch = countingFetch
+        apiproxy_stub_map.apiproxy.RegisterStub('urlfetch', stub)
+
+        self.clock = FakeTime()
+        self.realTime = utils.time
+        utils.time = self.clock
+        utils._tokenCache = utils._TokenCache(utils.TOKEN_CACHE_SIZE)
+        os.environ.pop('OAUTH_USER_ID', None)
+
+    def tearDown(self):
+        utils.time = self.realTime
+        os.environ.pop('HTTP_AUTHORIZATION', None)
+        super(TokenCacheTest, self).tearDown()
+
+    def userId(self, token):
+        os.environ['HTTP_AUTHORIZATION'] = 'Bearer %s' % token
+        return utils.getUserId(None, id_type='oauth')
+
+    def testMissThenHit(self):
+        self.assertEqual(self.userId('1234'), '1234')
+        self.assertEqual(self.fetches, 1)
+        self.assertEqual(self.userId('1234'), '1234')
+        self.assertEqual(self.fetches, 1)
+
+    def testMemcacheHitOnAnotherInstance(self):
+        self.userId('1234')
+        utils._tokenCache = utils._TokenCache(utils.TOKEN_CACHE_SIZE)
+        self.assertEqual(self.userId('1234'), '1234')
+        self.assertEqual(self.fetches, 1)
+
+    def testExpiresAfterTTL(self):
+        self.userId('1234')
+        self.clock.now += utils.TOKEN_CACHE_TTL + 1
+        self.assertEqual(self.userId('1234'), '1234')
+        self.assertEqual(self.fetches, 2)
+
+    def testInvalidTokenCachedForNegativeTTL(self):
+        # rejected as an ID token, then as an access token
+        self.assertEqual(self.userId('invalid-token'), '')
+        self.assertEqual(self.fetches, 2)
+        self.assertEqual(self.userId('invalid-token'), '')
+        self.assertEqual(self.fetches, 2)
+
+        self.clock.now += utils.INVALID_TOKEN_TTL + 1
+        self.assertEqual(self.userId('invalid-token'), '')
+        self.assertEqual(self.fetches, 4)
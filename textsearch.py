@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+
+"""textsearch.py
+
+Full-text search over Conferences (name, description) and Sessions (name,
+highlights) using an inverted index in the datastore.
+
+Text is split into lowercase words; stop words and numbers are dropped and
+common suffixes stripped. A term's postings, {websafe document key:
+weight}, are split into blocks by weight band (BAND_WEIGHTS) and by
+document, over NUM_SHARDS compressed SearchPostings entities per band.
+A search reads the top band of its terms first and goes down a band only
+when the page is not filled yet, so results come in band order and most
+pages read one band per term.
+
+A term whose block grows past MAX_BLOCK_POSTINGS is in too many documents
+to be useful: it is marked with a CommonTerm, its blocks are deleted and
+it is no longer indexed or searched for. This bounds entity sizes and
+stops writes to the hottest terms. Each document's SearchDocument records
+the terms it is indexed under, so reindexing only touches the terms that
+changed.
+
+Indexing runs in push tasks (queueIndexing) after conference and session
+writes, so results are eventually consistent. Blocks that are searched
+are cached in memcache until the term is next written. The reindex jobs
+(see backfill.py) rebuild the index from the documents.
+
+"""
+
+import hashlib
+import re
+import zlib
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+import backfill
+from models import CommonTerm
+from models import SearchDocument
+from models import SearchPostings
+
+NUM_SHARDS = 16
+# lowest weight of each band, best first
+BAND_WEIGHTS = (5, 3, 0)
+# a block this big marks its term as common
+MAX_BLOCK_POSTINGS = 5000
+# xg transaction limit, leaving room for a CommonTerm per block
+POSTINGS_PER_TXN = 12
+KEYS_PER_TASK = 100
+MEMCACHE_BLOCK_KEY = "SEARCH_BLOCK_%s"
+BLOCK_CACHE_TTL = 3600
+# bigger blocks would not fit in a memcache value
+MAX_CACHED_POSTINGS = 10000
+MAX_TERM_LENGTH = 30
+
+# weight of a word by the field it is found in
+FIELDS = {
+    'Conference': (('name', 3), ('description', 1)),
+    'Session': (('name', 3), ('highlights', 2)),
+}
+STOP_WORDS = frozenset(
+    'a an and are as at be by for from how in is it of on or the to with'.split())
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def _stem(word):
+    """Strip a few common English suffixes."""
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if word.endswith('sses'):
+        return word[:-2]
+    for suffix in ('ing', 'ed', 's'):
+        if (len(word) - len(suffix) >= 3 and word.endswith(suffix)
+                and not word.endswith('ss')):
+            return word[:-len(suffix)]
+    return word
+
+
+def tokenize(text):
+    """Return the index terms of a text, in order, with repeats."""
+    return [_stem(word) for word in _WORD.findall((text or '').lower())
+            if word not in STOP_WORDS and len(word) <= MAX_TERM_LENGTH
+            and not word.isdigit()]
+
+
+def documentTerms(doc):
+    """Return {term: weight} for a Conference or Session."""
+    terms = {}
+    for field, weight in FIELDS[doc.key.kind()]:
+        value = getattr(doc, field)
+        for text in value if isinstance(value, list) else [value]:
+            for term in tokenize(text):
+                terms[term] = terms.get(term, 0) + weight
+    return terms
+
+
+def _shard(wsk):
+    return zlib.crc32(wsk) % NUM_SHARDS
+
+
+def _band(weight):
+    for band, lowest in enumerate(BAND_WEIGHTS):
+        if weight >= lowest:
+            return band
+    return len(BAND_WEIGHTS) - 1
+
+
+def _postingsKey(kind, term, band, shard):
+    return ndb.Key(SearchPostings, u'%s:%s:%d:%d' % (kind, term, band, shard))
+
+
+def _commonKey(kind, term):
+    return ndb.Key(CommonTerm, u'%s:%s' % (kind, term))
+
+
+def _blockCacheKey(kind, term, band):
+    return MEMCACHE_BLOCK_KEY % hashlib.sha1(
+        (u'%s:%s:%d' % (kind, term, band)).encode('utf-8')).hexdigest()
+
+
+# - - - Indexing - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def queueIndexing(keys):
+    """Queue the (re)indexing of documents by key, e.g. after writing or
+    deleting them."""
+    wsks = [key.urlsafe() for key in keys]
+    for start in range(0, len(wsks), KEYS_PER_TASK):
+        taskqueue.add(params={'keys': ' '.join(wsks[start:start + KEYS_PER_TASK])},
+                      url='/tasks/index_documents')
+
+
+@ndb.transactional(xg=True)
+def _applyPostings(changes):
+    """Set (or with None, remove) weights on a few blocks; returns the
+    (kind, term) of blocks that grew too big, now marked common."""
+    keys = [_postingsKey(*block) for block, _ in changes]
+    blocks = [block or SearchPostings(key=key, postings={})
+              for block, key in zip(ndb.get_multi(keys), keys)]
+    common = set()
+    for block, ((kind, term, _, _), weights) in zip(blocks, changes):
+        for wsk, weight in weights.items():
+            if weight is None:
+                block.postings.pop(wsk, None)
+            else:
+                block.postings[wsk] = weight
+        if len(block.postings) > MAX_BLOCK_POSTINGS:
+            common.add((kind, term))
+    kept = [block for block, ((kind, term, _, _), _) in zip(blocks, changes)
+            if (kind, term) not in common]
+    ndb.put_multi([block for block in kept if block.postings] +
+                  [CommonTerm(key=_commonKey(kind, term)) for kind, term in common])
+    ndb.delete_multi([block.key for block in kept if not block.postings])
+    return common
+
+
+def _dropTerms(terms):
+    """Delete every block of (kind, term)s marked common."""
+    ndb.delete_multi([_postingsKey(kind, term, band, shard)
+                      for kind, term in terms
+                      for band in range(len(BAND_WEIGHTS))
+                      for shard in range(NUM_SHARDS)])
+    memcache.delete_multi([_blockCacheKey(kind, term, band)
+                           for kind, term in terms
+                           for band in range(len(BAND_WEIGHTS))])
+
+
+def indexDocuments(keys, rebuild=False):
+    """Bring the postings of Conferences or Sessions up to date with the
+    documents, removing those that no longer exist.
+
+    Only the weights that changed since the document's SearchDocument are
+    written, so repeating (or retrying) this is harmless. With rebuild,
+    every weight is written as if the document was new.
+    """
+    search_keys = [ndb.Key(SearchDocument, key.urlsafe()) for key in keys]
+    docs = ndb.get_multi(keys + search_keys)
+    updates = []
+    for key, doc, search_doc in zip(keys, docs[:len(keys)], docs[len(keys):]):
+        old = search_doc.terms if search_doc and not rebuild else {}
+        new = documentTerms(doc) if doc else {}
+        if old != new or rebuild:
+            updates.append((key, old, new))
+
+    terms = sorted(set((key.kind(), term) for key, old, new in updates
+                       for term in set(old) | set(new)))
+    common = set(term for term, marker in zip(terms, ndb.get_multi(
+        [_commonKey(kind, term) for kind, term in terms])) if marker)
+
+    changes = {}
+    indexed = []
+    for key, old, new in updates:
+        wsk = key.urlsafe()
+        shard = _shard(wsk)
+        for term in set(old) | set(new):
+            if (key.kind(), term) in common or old.get(term) == new.get(term):
+                continue
+            # a new weight may move the posting to another band
+            if term in old:
+                changes.setdefault((key.kind(), term, _band(old[term]), shard), {})[wsk] = None
+            if term in new:
+                changes.setdefault((key.kind(), term, _band(new[term]), shard), {})[wsk] = new[term]
+        indexed.append(SearchDocument(key=ndb.Key(SearchDocument, wsk), terms=new))
+
+    changes = sorted(changes.items())
+    newly_common = set()
+    for start in range(0, len(changes), POSTINGS_PER_TXN):
+        newly_common |= _applyPostings(changes[start:start + POSTINGS_PER_TXN])
+    if newly_common:
+        _dropTerms(newly_common)
+    ndb.put_multi([search_doc for search_doc in indexed if search_doc.terms])
+    ndb.delete_multi([search_doc.key for search_doc in indexed if not search_doc.terms])
+    memcache.delete_multi([_blockCacheKey(kind, term, band)
+                           for kind, term, band, _ in set(block for block, _ in changes)])
+
+
+@backfill.job('reindex-conferences', 'Conference')
+def _reindexConferences(keys):
+    indexDocuments(keys, rebuild=True)
+
+
+@backfill.job('reindex-sessions', 'Session')
+def _reindexSessions(keys):
+    indexDocuments(keys, rebuild=True)
+
+
+# - - - Searching - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def _getBlocks(kind, terms, band):
+    """Return [{websafe key: weight}] of terms in a band, from memcache
+    where possible and otherwise from their shards in one get_multi."""
+    cache_keys = [_blockCacheKey(kind, term, band) for term in terms]
+    cached = memcache.get_multi(cache_keys)
+    missing = [term for term, cache_key in zip(terms, cache_keys)
+               if cache_key not in cached]
+    shards = ndb.get_multi([_postingsKey(kind, term, band, shard)
+                            for term in missing for shard in range(NUM_SHARDS)])
+
+    fresh = {}
+    for i, term in enumerate(missing):
+        postings = {}
+        for shard in shards[i * NUM_SHARDS:(i + 1) * NUM_SHARDS]:
+            if shard:
+                postings.update(shard.postings)
+        cached[_blockCacheKey(kind, term, band)] = postings
+        if len(postings) <= MAX_CACHED_POSTINGS:
+            fresh[_blockCacheKey(kind, term, band)] = postings
+    if fresh:
+        memcache.set_multi(fresh, time=BLOCK_CACHE_TTL)
+    return [cached[cache_key] for cache_key in cache_keys]
+
+
+def search(kind, query, offset=0, limit=20):
+    """Find the documents of a kind containing every term of query.
+
+    Documents come in order of the lowest band they are in for any term,
+    then by the sum of their weights. Terms too common to be indexed are
+    left out of the query, so a query of only those finds nothing.
+    Returns (keys, offset of the next page or None).
+    """
+    terms = sorted(set(tokenize(query)))
+    markers = ndb.get_multi([_commonKey(kind, term) for term in terms])
+    terms = [term for term, marker in zip(terms, markers) if not marker]
+    if not terms:
+        return [], None
+
+    # {term: {websafe key: (band, weight)}} of the bands read so far
+    postings = dict((term, {}) for term in terms)
+    for band in range(len(BAND_WEIGHTS)):
+        for term, block in zip(terms, _getBlocks(kind, terms, band)):
+            for wsk, weight in block.items():
+                postings[term][wsk] = (band, weight)
+        # intersect from the term with the fewest postings read
+        ordered = sorted(postings.values(), key=len)
+        found = [wsk for wsk in ordered[0]
+                 if all(wsk in term_postings for term_postings in ordered[1:])]
+        if len(found) > offset + limit:
+            break
+
+    ranked = sorted(found, key=lambda wsk: (
+        max(p[wsk][0] for p in ordered), -sum(p[wsk][1] for p in ordered), wsk))
+    page = ranked[offset:offset + limit]
+    more = offset + limit < len(ranked)
+    return [ndb.Key(urlsafe=wsk) for wsk in page], offset + limit if more else None
@@ -1,38 +1,114 @@
+import hashlib
 import json
 import os
+import threading
 import time
 import uuid
+from collections import OrderedDict
 
+from google.appengine.api import memcache
 from google.appengine.api import urlfetch
 from models import Profile
 
+TOKENINFO_URL = 'https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
+TOKENINFO_ATTEMPTS = 3
+TOKENINFO_DEADLINE = 5
+TOKEN_CACHE_SIZE = 1000
+TOKEN_CACHE_TTL = 600       # seconds; never longer than the token's expiry
+INVALID_TOKEN_TTL = 60
+MEMCACHE_TOKEN_KEY = "TOKENINFO_%s"
+
+
+class _TokenCache(object):
+    """Instance-local LRU of token hash -> user id, with per-entry expiry."""
+
+    def __init__(self, size):
+        self._size = size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None or item[1] <= time.time():
+                return None
+            # re-insert as most recently used
+            self._items[key] = item
+            return item[0]
+
+    def set(self, key, user_id, ttl):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (user_id, time.time() + ttl)
+            while len(self._items) > self._size:
+                self._items.popitem(last=False)
+
+
+_tokenCache = _TokenCache(TOKEN_CACHE_SIZE)
+
+
+def _fetchTokenInfo(token):
+    """Look a token up at the tokeninfo endpoint.
+
+    Returns (user_id, ttl): user_id is '' for an invalid token, ttl is how
+    long the answer may be cached, or 0 if it must not be (transient errors).
+    Failed calls are retried straight away rather than sleeping the request.
+    """
+    token_type = 'id_token'
+    if 'OAUTH_USER_ID' in os.environ:
+        token_type = 'access_token'
+    for _ in range(TOKENINFO_ATTEMPTS):
+        try:
+            resp = urlfetch.fetch(TOKENINFO_URL % (token_type, token),
+                                  deadline=TOKENINFO_DEADLINE)
+        except urlfetch.Error:
+            continue
+        if resp.status_code == 200:
+            info = json.loads(resp.content)
+            ttl = min(TOKEN_CACHE_TTL, int(info.get('expires_in', 0)))
+            return info.get('user_id', ''), max(ttl, 0)
+        elif resp.status_code == 400 and 'invalid_token' in resp.content:
+            if token_type == 'access_token':
+                # rejected as both token types
+                return '', INVALID_TOKEN_TTL
+            token_type = 'access_token'
+    return '', 0
+
+
 def getUserId(user, id_type="email"):
     if id_type == "email":
         return user.email()
 
     if id_type == "oauth":
         """A workaround implementation for getting userid."""
+        # ConferenceApi does not come here: it uses the "email" id of the
+        # user endpoints.get_current_user() returns, and endpoints checks
+        # tokens itself (ID tokens against cached certs, access tokens
+        # through the OAuth service), so tokeninfo is never asked. The
+        # cache is for callers of this workaround only.
         auth = os.getenv('HTTP_AUTHORIZATION')
         bearer, token = auth.split()
-        token_type = 'id_token'
-        if 'OAUTH_USER_ID' in os.environ:
-            token_type = 'access_token'
-        url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-               % (token_type, token))
-        user = {}
-        wait = 1
-        for i in range(3):
-            resp = urlfetch.fetch(url)
-            if resp.status_code == 200:
-                user = json.loads(resp.content)
-                break
-            elif resp.status_code == 400 and 'invalid_token' in resp.content:
-                url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-                       % ('access_token', token))
-            else:
-                time.sleep(wait)
-                wait = wait + i
-        return user.get('user_id', '')
+
+        # look in the instance cache, then memcache, keyed by a hash so
+        # bearer tokens are never stored
+        key = hashlib.sha256(token).hexdigest()
+        user_id = _tokenCache.get(key)
+        if user_id is not None:
+            return user_id
+        cache_key = MEMCACHE_TOKEN_KEY % key
+        cached = memcache.get(cache_key)
+        if cached is not None:
+            user_id, expires = cached
+            ttl = expires - time.time()
+            if ttl > 0:
+                _tokenCache.set(key, user_id, ttl)
+                return user_id
+
+        user_id, ttl = _fetchTokenInfo(token)
+        if ttl:
+            _tokenCache.set(key, user_id, ttl)
+            memcache.set(cache_key, (user_id, time.time() + ttl), time=ttl)
+        return user_id
 
     if id_type == "custom":
         # implement your own user_id creation and getting algorythm